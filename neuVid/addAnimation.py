@@ -21,9 +21,10 @@ import sys
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from utilsColors import colors, getColor
 from utilsGeneral import newObject, report_version
-from utilsMaterials import getMaterialValue, insertMaterialKeyframe, newShadelessImageMaterial, setMaterialValue
+from utilsMaterials import getObjectValue, insertMaterialKeyframe, insertObjectKeyframe, newShadelessImageMaterial, setMaterialValue, setObjectValue
 from utilsJson import guess_extraneous_comma, parseFov, parseNeuronsIds, parseRoiNames, parseSynapsesSetNames, removeComments
 from utilsNg import ng_camera_look_from, quat_ng_to_blender
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count, trace_phase
 
 report_version()
 
@@ -83,6 +84,19 @@ if not "animation" in jsonData:
     sys.exit()
 jsonAnim = jsonData["animation"]
 
+def partitionProxyNames(group):
+    # A group partitioned automatically by importMeshes.py has a proxy for each partition,
+    # with names like "Neuron.proxy.group.0", "Neuron.proxy.group.1", etc.
+    result = [o.name for o in bpy.data.objects if o.name.startswith("Neuron.proxy.") and "group" in o and o["group"] == group]
+    result.sort()
+    return result
+
+def proxyNames(group):
+    result = partitionProxyNames(group)
+    if len(result) == 0:
+        result = ["Neuron.proxy." + group]
+    return result
+
 def meshObjs(name, strict):
     global groupToNeuronIds, groupToRoiNames, groupToSynapseSetNames, useSeparateNeuronFiles
 
@@ -108,13 +122,16 @@ def meshObjs(name, strict):
                 type = x[0:i]
                 group = x[i + 1:]
                 if type == "neurons":
-                    if useSeparateNeuronFiles:
+                    # Without "separate": true in the JSON file, only the groups partitioned by importMeshes.py
+                    # have separate files, and the other groups' neurons are in the main file as usual.
+                    if useSeparateNeuronFiles or len(partitionProxyNames(group)) > 0:
                         # For now, at least, support only the simplest case when using
                         # one or more separate files of neuron IDs.
                         if len(name.split()) == 1:
-                            dest["Neuron.proxy." + group] = None
+                            for proxyName in proxyNames(group):
+                                dest[proxyName] = None
                         else:
-                            print("Error: mesh expressions with '+'/'-' are not supported for separate neuron files")
+                            print("Error: mesh expressions with '+'/'-' are not supported for separate neuron files (group '{}')".format(group))
                             sys.exit()
                     else:
                         for neuronId in groupToNeuronIds[group]:
@@ -369,35 +386,35 @@ def setValueCmd(args, strict):
 
         for obj in objs:
             matName = "Material." + obj.name
-            mat = obj.data.materials[matName]
 
+            # The object's own material, or its attributes if it uses a shared material.
             if frame() != 1:
                 if "alpha" in args:
-                    insertMaterialKeyframe(mat, "alpha", frame=frame()-1)
+                    insertObjectKeyframe(obj, "alpha", frame=frame()-1)
                 else:
-                    insertMaterialKeyframe(mat, "diffuse_color", frame=frame()-1)
+                    insertObjectKeyframe(obj, "diffuse_color", frame=frame()-1)
 
             if "alpha" in args:
-                setMaterialValue(mat, "alpha", alpha)
-                insertMaterialKeyframe(mat, "alpha", frame())
+                setObjectValue(obj, "alpha", alpha)
+                insertObjectKeyframe(obj, "alpha", frame())
             elif "color" in args:
                 if staggerFrac:
                     color = colorsys.hsv_to_rgb(colorHSV[0], colorHSV[1], colorHSV[2])
                     colorHSV = (colorHSV[0], colorHSV[1] + deltaS, colorHSV[2] + deltaV)
 
-                setMaterialValue(mat, "diffuse_color", color)
-                insertMaterialKeyframe(mat, "diffuse_color", frame=frame())
+                setObjectValue(obj, "diffuse_color", color)
+                insertObjectKeyframe(obj, "diffuse_color", frame=frame())
             elif "exponent" in args:
                 try:
-                    setMaterialValue(mat, "exponent", exp)
-                    insertMaterialKeyframe(mat, "exponent", frame())
+                    setObjectValue(obj, "exponent", exp)
+                    insertObjectKeyframe(obj, "exponent", frame())
                 except:
                     print("'{}' does not support 'exponent'.".format(matName))
                     sys.exit()
             else:
                 try:
-                    setMaterialValue(mat, "threshold", threshold)
-                    insertMaterialKeyframe(mat, "threshold", frame())
+                    setObjectValue(obj, "threshold", threshold)
+                    insertObjectKeyframe(obj, "threshold", frame())
                 except:
                     print("'{}' does not support 'threshold'.".format(matName))
                     sys.exit()
@@ -528,25 +545,37 @@ def fadeCmd(args, strict):
         # For stagger and not accelerating, each item fades on/off in this many frames.
         FADE_FRAMES_NOT_ACCEL = 3
 
-        if type == "alpha" and len(objs) == 1 and "ids" in objs[0]:
-            # Proxy for a separate Blender file.
-            proxy = objs[0]
-            proxyMatName = "Material." + proxy.name
-            proxyMat = proxy.data.materials[proxyMatName]
-            if not "alpha-fcurves" in proxyMat:
-                proxyMat["alpha-fcurves"] = {}
-            # IDs of what the proxy will be replaced by when the separate file is loaded.
-            # Their animation must be stored on the proxy, to make staggering work.
-            objs = proxy["ids"]
-
-            # And the proxy itself must still have some overall animation, so render.py does not
-            # think the proxy is always visible and should be expanded right away.
-            startingFrame = frame(startingTime)
-            endingFrame = frame(startingTime + duration)
-            setMaterialValue(proxyMat, type, startingValue)
-            insertMaterialKeyframe(proxyMat, type, startingFrame)
-            setMaterialValue(proxyMat, type, endingValue)
-            insertMaterialKeyframe(proxyMat, type, endingFrame)
+        if type == "alpha" and len(objs) > 0 and all(["ids" in o for o in objs]):
+            # Proxies for separate Blender files (more than one if the group was partitioned).
+            idToProxyMat = {}
+            proxyIds = []
+            for proxy in objs:
+                proxyMatName = "Material." + proxy.name
+                proxyMat = proxy.data.materials[proxyMatName]
+                if not "alpha-fcurves" in proxyMat:
+                    proxyMat["alpha-fcurves"] = {}
+                # IDs of what the proxy will be replaced by when the separate file is loaded.
+                # Their animation must be stored on the proxy, to make staggering work.
+                for id in proxy["ids"]:
+                    idToProxyMat[id] = proxyMat
+                    proxyIds.append(id)
+
+                # And the proxy itself must still have some overall animation, so render.py does not
+                # think the proxy is always visible and should be expanded right away.
+                startingFrame = frame(startingTime)
+                endingFrame = frame(startingTime + duration)
+                setMaterialValue(proxyMat, type, startingValue)
+                insertMaterialKeyframe(proxyMat, type, startingFrame)
+                setMaterialValue(proxyMat, type, endingValue)
+                insertMaterialKeyframe(proxyMat, type, endingFrame)
+
+            # Stagger in the group's order, not the order of the partitions.
+            groups = set([o["group"] if "group" in o else None for o in objs])
+            group = groups.pop() if len(groups) == 1 else None
+            if len(objs) > 1 and group in groupToNeuronIds:
+                objs = [id for id in groupToNeuronIds[group] if id in idToProxyMat]
+            else:
+                objs = proxyIds
 
         nStaggerSubgroup = 0
         if stagger:
@@ -592,20 +621,19 @@ def fadeCmd(args, strict):
             minimum = FADE_FRAMES_NOT_ACCEL if stagger and not accelerating else 1
             endingFrame = max(frame(startingTime + deltaTime[0]), startingFrame + minimum)
             if not isinstance(obj, str):
-                matName = "Material." + obj.name
-                mat = obj.data.materials[matName]
                 if type == "location":
                     obj.location = startingValue
                     obj.keyframe_insert("location", frame=startingFrame)
                     obj.location = endingValue
                     obj.keyframe_insert("location", frame=endingFrame)
                 else:
-                    setMaterialValue(mat, type, startingValue)
-                    insertMaterialKeyframe(mat, type, startingFrame)
-                    setMaterialValue(mat, type, endingValue)
-                    insertMaterialKeyframe(mat, type, endingFrame)
+                    setObjectValue(obj, type, startingValue)
+                    insertObjectKeyframe(obj, type, startingFrame)
+                    setObjectValue(obj, type, endingValue)
+                    insertObjectKeyframe(obj, type, endingFrame)
             else:
                 # For applying the staggered alphas in render.py, when the separate Blender file has been loaded.
+                proxyMat = idToProxyMat[obj]
                 if not obj in proxyMat["alpha-fcurves"]:
                     proxyMat["alpha-fcurves"][obj] = []
                 l = proxyMat["alpha-fcurves"][obj]
@@ -674,9 +702,7 @@ def pulseCmd(args, strict):
         if objs is None:
             return
         for obj in objs:
-            matName = "Material." + obj.name
-            mat = obj.data.materials[matName]
-            baseColor = tuple(getMaterialValue(mat, "diffuse_color"))
+            baseColor = tuple(getObjectValue(obj, "diffuse_color"))
 
             deltaTime = 1 / (2 * rate)
             n = int(duration / deltaTime)
@@ -684,12 +710,12 @@ def pulseCmd(args, strict):
                 n -= 1
             if n <= 0:
                 return
-            insertMaterialKeyframe(mat, "diffuse_color", frame())
+            insertObjectKeyframe(obj, "diffuse_color", frame())
             t = time + deltaTime
             colors = [pulseColor, baseColor]
             for i in range(n):
-                setMaterialValue(mat, "diffuse_color", colors[i % 2])
-                insertMaterialKeyframe(mat, "diffuse_color", frame(t))
+                setObjectValue(obj, "diffuse_color", colors[i % 2])
+                insertObjectKeyframe(obj, "diffuse_color", frame(t))
                 t += deltaTime
 
 def orbitAxis(args):
@@ -1163,7 +1189,11 @@ def supportedCmds():
     cmds.sort()
     return cmds
 
+start_trace("addAnimation")
+
+begin_phase("open")
 bpy.ops.wm.open_mainfile(filepath=inputBlenderFile)
+end_phase()
 
 bpy.context.scene.render.fps = fps
 
@@ -1198,6 +1228,7 @@ if fovy:
 
 removeUnused()
 
+begin_phase("commands")
 for step in jsonAnim:
     if not isinstance(step, list) or len(step) != 2:
         print(invalidLineMsg(step))
@@ -1221,12 +1252,15 @@ for step in jsonAnim:
     cmdName += "Cmd"
     if cmdName in globals():
         cmd = globals()[cmdName]
-        cmd(cmdArgs, args.strict)
+        with trace_phase(cmdNamePublic(cmdName)):
+            cmd(cmdArgs, args.strict)
+        trace_count("commands")
     else:
         print("Invalid animation step:\n  {}".format(step))
         print("Unrecognized animation command: '{}'".format(cmdNamePublic(cmdName)))
         print("Supported animation commands: {}".format(", ".join(supportedCmds())))
         sys.exit()
+end_phase()
 
 bpy.context.scene.frame_set(1)
 
@@ -1278,6 +1312,7 @@ else:
 for obj in bpy.data.objects:
     obj.select_set(False)
 
+begin_phase("save")
 if bpy.app.version < (3, 1, 0):
     print("Writing {}".format(outputFile))
     bpy.ops.wm.save_as_mainfile(filepath=outputFile)
@@ -1285,3 +1320,6 @@ else:
     outputAbsPath = os.path.join(os.getcwd(), outputFile)
     print("Writing {}".format(outputAbsPath))
     bpy.ops.wm.save_as_mainfile(filepath=outputAbsPath)
+end_phase()
+
+end_trace()
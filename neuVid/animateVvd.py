@@ -14,7 +14,6 @@
 # glitches in the saved video.
 
 import argparse
-import h5py
 import json
 import math
 import os
@@ -671,6 +670,8 @@ def get_vol_int_attr(attrs, name):
     return val
 
 def get_vol_bbox(path):
+    # Imported here so the rest of this module (e.g., `describe_interpolators()`) can be used without h5py.
+    import h5py
     dx = dy = dz = 0
     with h5py.File(path, "r") as f:
         attrs = f["Channels"].attrs
@@ -979,6 +980,12 @@ def describe_interpolators(state, fps):
     result += "max_id={}\n".format(num_interpolators)
     result += "num={}\n".format(num_interpolators)
 
+    # The frames of each animator do not depend on the current frame.
+    animator_frames = {}
+    for name, animator_list in animators.items():
+        animator_frames[name] = [(frame_from_time(a.starting_time, fps), frame_from_time(a.starting_time + a.duration, fps))
+            for a in animator_list]
+
     for frame in range(num_frames):
         id_interpolator = frame
         id_key = 0
@@ -988,9 +995,7 @@ def describe_interpolators(state, fps):
             afters = []
             n = len(animator_list)
             for i in range(n):
-                animator = animator_list[i]
-                f0 = frame_from_time(animator.starting_time, fps)
-                f1 = frame_from_time(animator.starting_time + animator.duration, fps)
+                f0, f1 = animator_frames[name][i]
                 before_first = (i == 0 and frame < f0)
                 within = (f0 <= frame and frame <= f1)
                 # When the frame is between two animators, use the later one.  This case is not triggered too often
@@ -3,22 +3,27 @@
 # Run in Blender, e.g.:
 # blender --background --python assembleFrames.py -- -i movie/framesFinal -o movie/results
 # Assumes Blender 2.79.
+# Or, to encode with ffmpeg instead of Blender, run with plain Python, e.g.:
+# python assembleFrames.py --encoder ffmpeg -i movie/framesFinal -o movie/results
 
 import argparse
-import bpy
 import os
 import shutil
 import sys
 import tempfile
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsEncode import DEFAULT_CODEC, DEFAULT_CRF, DEFAULT_PIX_FMT, encode_frame_files, find_ffmpeg
+from utilsFrames import FrameIndex
 from utilsGeneral import report_version
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count
 
 report_version()
 
 argv = sys.argv
 if "--" not in argv:
-    argv = []
+    # Running as `python assembleFrames.py <arguments>`, possible with `--encoder ffmpeg`
+    argv = argv[1:] if not "bpy" in sys.modules else []
 else:
     argv = argv[argv.index("--") + 1:]
 
@@ -39,6 +44,25 @@ parser.set_defaults(padding=0)
 parser.add_argument("--pad", "-p", type=int, dest="padding", help="pad with this many copies of the last frame")
 
 parser.add_argument("--frame-jump", "-j", type=int, dest="step", help="number of frames to step forward")
+parser.set_defaults(fps=24)
+parser.add_argument("--fps", type=int, dest="fps", help="frames per second of the movie")
+
+parser.set_defaults(encoder="blender")
+parser.add_argument("--encoder", "-en", dest="encoder", choices=["blender", "ffmpeg"], help="encode with Blender's sequencer, or with ffmpeg (without Blender)")
+parser.set_defaults(ffmpeg=None)
+parser.add_argument("--ffmpeg", dest="ffmpeg", help="path to the ffmpeg executable (default: ffmpeg from the PATH)")
+parser.set_defaults(codec=DEFAULT_CODEC)
+parser.add_argument("--codec", "-c", dest="codec", help="ffmpeg video codec")
+parser.set_defaults(crf=DEFAULT_CRF)
+parser.add_argument("--crf", type=int, dest="crf", help="ffmpeg constant rate factor (lower is higher quality)")
+parser.set_defaults(pixFmt=DEFAULT_PIX_FMT)
+parser.add_argument("--pixfmt", "-pf", dest="pixFmt", help="ffmpeg output pixel format")
+parser.set_defaults(threads=0)
+parser.add_argument("--threads", "-t", type=int, dest="threads", help="ffmpeg encoding thread count (default: let ffmpeg choose, or an equal share of the cores for each of the --chunks)")
+parser.set_defaults(chunks=1)
+parser.add_argument("--chunks", "-ch", type=int, dest="chunks", help="number of parts of the movie for ffmpeg to encode at once, then join")
+parser.set_defaults(gop=None)
+parser.add_argument("--gop", type=int, dest="gop", help="frames between key frames, for --chunks (default: twice the fps)")
 
 args = parser.parse_args(argv)
 
@@ -63,13 +87,52 @@ if outputDir[:-1] != "/":
     outputDir += "/"
 print("Using output directory: '{}'".format(outputDir))
 
-seqEd = bpy.context.scene.sequence_editor_create()
+start_trace("assembleFrames")
+
+pngs = FrameIndex(inputDir, ".png").file_names()
+if len(pngs) == 0:
+    print("Error: no frames in '{}'".format(inputDir))
+    sys.exit()
+
+if args.chunks > 1 and args.encoder != "ffmpeg":
+    print("Error: --chunks requires --encoder ffmpeg")
+    sys.exit()
+
+if args.encoder == "ffmpeg":
+    ffmpeg = find_ffmpeg(args.ffmpeg)
+    if not ffmpeg:
+        print("Error: cannot find ffmpeg; use --ffmpeg to give its path")
+        sys.exit()
+    if args.step != None:
+        pngs = pngs[::args.step]
+    # The same file name as from Blender, but for the container suitable for the codec.
+    os.makedirs(outputDir, exist_ok=True)
+    outputFile = os.path.join(outputDir, "{}-{}.mp4".format(str(1).zfill(4), str(len(pngs) * args.stretch + args.padding).zfill(4)))
+    print("Using ffmpeg {}, codec {}, CRF {}, pixel format {}".format(ffmpeg, args.codec, args.crf, args.pixFmt))
+    if args.chunks > 1:
+        print("Using {} chunks encoded at once".format(args.chunks))
+
+    # The stretching and padding are done with per-frame durations instead of copies.
+    begin_phase("encode")
+    returncode = encode_frame_files([os.path.join(inputDir, png) for png in pngs], outputFile, args.fps, args.stretch, args.padding,
+        ffmpeg, args.chunks, args.gop, codec=args.codec, crf=args.crf, pix_fmt=args.pixFmt, threads=args.threads, width=args.width, height=args.height)
+    end_phase()
+    trace_count("frames", len(pngs) * args.stretch + args.padding)
+    end_trace()
+
+    if returncode != 0:
+        print("Error: ffmpeg failed with exit code {}".format(returncode))
+    else:
+        print("Wrote {}".format(outputFile))
+    sys.exit()
+
+import bpy
 
-pngs = [f for f in os.listdir(inputDir) if os.path.splitext(f)[1] == ".png"]
-pngs.sort()
+seqEd = bpy.context.scene.sequence_editor_create()
 
 tmp = None
 if args.stretch > 1 or args.padding > 0:
+    begin_phase("stretch")
     tmp = tempfile.mkdtemp()
     if args.stretch > 1:
         print("Using stretch {}, with temporary directory {}".format(args.stretch, tmp))
@@ -95,6 +158,7 @@ if args.stretch > 1 or args.padding > 0:
 
     pngs.sort()
     inputDir = tmp
+    end_phase()
 
 if args.step != None:
     bpy.context.scene.frame_step = args.step
@@ -118,7 +182,7 @@ else :
     bpy.context.scene.render.ffmpeg.format = "AVI"
     bpy.context.scene.render.ffmpeg.codec = "H264"
 
-bpy.context.scene.render.fps = 24
+bpy.context.scene.render.fps = args.fps
 
 bpy.context.scene.render.filepath = outputDir
 
@@ -126,8 +190,13 @@ bpy.context.scene.render.filepath = outputDir
 # should have any desired tone mapping already.
 bpy.context.scene.view_settings.view_transform = "Standard"
 
+begin_phase("encode")
 bpy.ops.render.render(animation=True)
+end_phase()
+trace_count("frames", len(pngs))
 
 if tmp:
     print("Removing temporary directory {}".format(tmp))
     shutil.rmtree(tmp)
+
+end_trace()
@@ -11,9 +11,13 @@ import sys
 import tempfile
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsFrames import FrameIndex, get_frame_indices
 from utilsGeneral import newObject, report_version
 from utilsJson import guess_extraneous_comma, removeComments
 from utilsMaterials import insertMaterialKeyframe, newBasicMaterial, new_shadeless_material, setMaterialValue
+from utilsOverlays import OverlayCache, pass_through
+from utilsParallel import run_frame_workers
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count, trace_phase
 
 def get_image_size(input):
     for f in os.listdir(input):
@@ -43,39 +47,11 @@ def get_arg(cmd, args, arg, types, type_error, default=None):
     print(f"Error: {cmd}: argument '{arg}' {type_error}")
     sys.exit()
 
-def get_image_basenames(dir):
-    paths = [os.path.splitext(f)[0] for f in os.listdir(dir) if os.path.splitext(f)[1] == ".png"]
-    paths.sort()
-    return paths
-
 def apply_image_size(axes_scene, comp_scene, image_size):
     for scene in [axes_scene, comp_scene]:
         scene.render.resolution_x = image_size[0]
         scene.render.resolution_y = image_size[1]
 
-def get_frame_indices(start_frame, end_frame, images):
-    if not start_frame:
-        i0 = 0
-    else:
-        for i in range(len(images)):
-            base = os.path.splitext(os.path.basename(images[i]))[0]
-            base_int = int(base)
-            if start_frame >= base_int:
-                i0 = i
-            else:
-                break
-    if not end_frame:
-        i1 = len(images) - 1
-    else:
-        for i in range(len(images)-1, 0-1, -1):
-            base = os.path.splitext(os.path.basename(images[i]))[0]
-            base_int = int(base)
-            if end_frame <= base_int:
-                i1 = i
-            else:
-                break
-    return i0, i1
-
 def append_bound(input_blender_file):
     objs_dir = input_blender_file + "/Object"
     referenced_obj_name = "Bound.neurons"
@@ -517,18 +493,44 @@ def comp_frame(comp_scene, axes_image_file, rendered_image, frame):
     if image_node2.image:
         bpy.data.images.remove(image_node2.image)
 
-def comp_frames(axes_scene, comp_scene, input, image_size, start_frame, end_frame):
-    rendered_frames = get_image_basenames(input)
+def comp_frames(axes_scene, comp_scene, input, output, image_size, start_frame, end_frame):
+    rendered_frames = FrameIndex(input, ".png")
     apply_image_size(axes_scene, comp_scene, image_size)
-    i0, i1 = get_frame_indices(start_frame, end_frame, rendered_frames)
+    i0, i1 = get_frame_indices(start_frame, end_frame, rendered_frames.frames)
+    # Render the overlay only when its animated values change, and skip it when it is transparent.
+    overlays = OverlayCache([m for m in bpy.data.materials if m.name.startswith("Material.")])
     for i in range(i0, i1 + 1):
         progress = round((i - i0) / (i1 - i0 + 1) * 100, 1)
-        rendered_image = os.path.join(input, f"{rendered_frames[i]}.png")
-        frame = int(rendered_frames[i])
+        frame = rendered_frames.frames[i]
+        rendered_image = rendered_frames.path(frame)
         print(f"{progress}%: {rendered_image}\n")
 
-        axes_image_file = render_axes(axes_scene, frame)
-        comp_frame(comp_scene, axes_image_file, rendered_image, frame)
+        if overlays.is_transparent(frame):
+            with trace_phase("pass_through"):
+                pass_through(rendered_image, output, frame)
+            trace_count("frames_passed_through")
+        else:
+            with trace_phase("axes"):
+                axes_image_file, reused = overlays.get(frame, lambda f: render_axes(axes_scene, f))
+            if reused:
+                trace_count("overlays_reused")
+            with trace_phase("comp"):
+                comp_frame(comp_scene, axes_image_file, rendered_image, frame)
+        trace_count("frames")
+
+# Runs this script as `workers` Blender processes, each on a contiguous range of the frames.
+# Returns the paths of the output frames that are missing afterwards.
+def comp_frames_parallel(argv, input, output, start_frame, end_frame, workers):
+    rendered_frames = FrameIndex(input, ".png")
+    if len(rendered_frames) == 0:
+        return []
+    i0, i1 = get_frame_indices(start_frame, end_frame, rendered_frames.frames)
+    frames = rendered_frames.frames[i0:i1 + 1]
+    failed = run_frame_workers(bpy.app.binary_path, os.path.realpath(__file__), argv, frames, workers, "--frame-start", "--frame-end")
+    if failed > 0:
+        print(f"Error: {failed} worker(s) failed")
+    output_paths = [os.path.join(output, f"{str(frame).zfill(4)}.png") for frame in frames]
+    return [path for path in output_paths if not os.path.isfile(path)]
 
 if __name__ == "__main__":
     report_version()
@@ -555,6 +557,8 @@ if __name__ == "__main__":
     parser.add_argument("--frame-end", "-e", type=int, dest="end", help="last frame to composite")
     parser.set_defaults(threads=None)
     parser.add_argument("--threads", "-t", dest="threads", type=int, help="thread count for Cycles (default: let Cycles choose)")
+    parser.set_defaults(workers=1)
+    parser.add_argument("--workers", "-w", dest="workers", type=int, help="number of Blender processes, each compositing a contiguous range of frames")
     parser.set_defaults(rescale_factor=1.0)
     parser.add_argument("--rescale", "-re", type=float, dest="rescale_factor", help="rescale factor (for numerical precision)")
     parser.set_defaults(debug=False)
@@ -576,33 +580,47 @@ if __name__ == "__main__":
 
     runtime0 = datetime.datetime.now()
 
-    image_size = get_image_size(input)
-    print(f"Using final image size: {image_size}")
-
-    # Works for neuron (FlyEM) data with Cycles.
-    overall_scale = 0.01
-    print("Original overall scale: {}, factor: {}".format(overall_scale, args.rescale_factor))
-    overall_scale *= args.rescale_factor
-    print("Using overall scale: {}".format(overall_scale))
-
-    input_blender_file = os.path.splitext(args.input_json_file)[0] + "Anim.blend"
-
-    axes_data = parse_axes(args.input_json_file, image_size)
-    axes_scene = setup_axes_scene(axes_data, input_blender_file, image_size)
-    comp_scene = setup_comp_scene(output)
-
-    if args.threads != None:
-        for scene in [comp_scene, axes_scene]:
-            scene.render.threads_mode = "FIXED"
-            scene.render.threads = args.threads
-        print("Using thread count: {}".format(args.threads))
-
-    if not args.debug:
-        comp_frames(axes_scene, comp_scene, input, image_size, args.start, args.end)
+    start_trace("compAxes")
+    if args.workers > 1 and not args.debug:
+        print(f"Using worker count: {args.workers}")
+        with trace_phase("workers"):
+            missing = comp_frames_parallel(argv, input, output, args.start, args.end, args.workers)
+        trace_count("frames_missing", len(missing))
+        if len(missing) > 0:
+            print(f"Frames missing from the frames with axes: {missing}")
     else:
-        test_output = os.path.splitext(args.input_json_file)[0] + "Axes.blend"
-        print("Writing {}".format(test_output))
-        bpy.ops.wm.save_as_mainfile(filepath=test_output)
+        begin_phase("setup")
+        image_size = get_image_size(input)
+        print(f"Using final image size: {image_size}")
+
+        # Works for neuron (FlyEM) data with Cycles.
+        overall_scale = 0.01
+        print("Original overall scale: {}, factor: {}".format(overall_scale, args.rescale_factor))
+        overall_scale *= args.rescale_factor
+        print("Using overall scale: {}".format(overall_scale))
+
+        input_blender_file = os.path.splitext(args.input_json_file)[0] + "Anim.blend"
+
+        axes_data = parse_axes(args.input_json_file, image_size)
+        axes_scene = setup_axes_scene(axes_data, input_blender_file, image_size)
+        comp_scene = setup_comp_scene(output)
+
+        if args.threads != None:
+            for scene in [comp_scene, axes_scene]:
+                scene.render.threads_mode = "FIXED"
+                scene.render.threads = args.threads
+            print("Using thread count: {}".format(args.threads))
+
+        end_phase()
+
+        if not args.debug:
+            with trace_phase("frames"):
+                comp_frames(axes_scene, comp_scene, input, output, image_size, args.start, args.end)
+        else:
+            test_output = os.path.splitext(args.input_json_file)[0] + "Axes.blend"
+            print("Writing {}".format(test_output))
+            bpy.ops.wm.save_as_mainfile(filepath=test_output)
+    end_trace()
 
     runtime1 = datetime.datetime.now()
     print(f"Compositing started at {runtime0}")
@@ -18,7 +18,10 @@ import sys
 timeStart = datetime.datetime.now()
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsFrames import FrameIndex
 from utilsGeneral import report_version
+from utilsParallel import run_frame_workers
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count, trace_phase
 
 report_version()
 
@@ -41,6 +44,8 @@ parser.add_argument("--requireBoth", dest="requireBoth", action="store_true", he
 parser.add_argument("--output", "-o", dest="output", help="directory for output of PNG files")
 parser.set_defaults(useOctane=False)
 parser.add_argument("--octane", "-oct", dest="useOctane", action="store_true", help="neurons were rendered with Octane")
+parser.set_defaults(workers=1)
+parser.add_argument("--workers", "-w", dest="workers", type=int, help="number of Blender processes, each compositing a contiguous range of frames")
 args = parser.parse_args(argv)
 
 backgroundColor = (0, 0, 0, 1)
@@ -68,11 +73,34 @@ if outputDir == None:
 if outputDir[-1] != "/":
     outputDir = outputDir + "/"
 
-rois = [os.path.splitext(f)[0] for f in os.listdir(inputROIDir) if os.path.splitext(f)[1] == ".exr"]
-rois = [x for x in rois if args.start <= int(x) and int(x) <= args.end]
-neurons = [os.path.splitext(f)[0] for f in os.listdir(inputNeuronsDir) if os.path.splitext(f)[1] == ".exr"]
-pngs = [os.path.splitext(f)[0] for f in os.listdir(outputDir) if os.path.splitext(f)[1] == ".png"]
-roisToInput = [f for f in rois if f not in pngs]
+start_trace("compFrames")
+
+rois = FrameIndex(inputROIDir, ".exr")
+neurons = FrameIndex(inputNeuronsDir, ".exr")
+pngs = FrameIndex(outputDir, ".png")
+roisToInput = [f for f in rois.frames_in_range(args.start, args.end) if f not in pngs]
+
+if args.workers > 1:
+    # Each worker is this script for a contiguous range of the frames to composite, and skips
+    # existing output frames, as above.
+    framesToComp = [f for f in roisToInput if not (args.requireBoth and not f in neurons)]
+    print("Using worker count: {}".format(args.workers))
+    with trace_phase("workers"):
+        failed = run_frame_workers(bpy.app.binary_path, os.path.realpath(__file__), argv, framesToComp, args.workers, "--start", "--end")
+    if failed > 0:
+        print("Error: {} worker(s) failed".format(failed))
+    missing = [outputDir + rois.names[f] + ".png" for f in framesToComp]
+    missing = [pngPath for pngPath in missing if not os.path.isfile(pngPath)]
+    trace_count("frames_missing", len(missing))
+    end_trace()
+
+    if len(missing) > 0:
+        print("Frames missing from the final composite: {}".format(missing))
+
+    timeEnd = datetime.datetime.now()
+    print("Compositing started at {}".format(timeStart))
+    print("Compositing ended at {}".format(timeEnd))
+    sys.exit()
 
 bpy.context.scene.use_nodes = True
 bpy.context.scene.render.use_compositing = True
@@ -128,16 +156,18 @@ outputNode.format.file_format = "PNG"
 
 treeLinks.new(overNode.outputs[0], outputNode.inputs[0])
 
+begin_phase("frames")
 missing = []
 for i in range(len(roisToInput)):
     print("{} of {}, {:.2f}%".format(i, len(roisToInput), 100 * i / len(roisToInput)))
 
-    roi = roisToInput[i]
+    frame = roisToInput[i]
+    roi = rois.names[frame]
     roiPath = inputROIDir + roi + ".exr"
     pngPath = outputDir + roi + ".png"
     neuronPath = inputNeuronsDir + roi + ".exr"
 
-    if args.requireBoth and not roi in neurons:
+    if args.requireBoth and not frame in neurons:
         continue
 
     roiImageNode.image = bpy.data.images.load(roiPath)
@@ -166,7 +196,7 @@ for i in range(len(roisToInput)):
 
     # Links have to be established after the images are loaded, apparently.
 
-    if roi in neurons:
+    if frame in neurons:
         neuronImageNode.image = bpy.data.images.load(neuronPath)
         if bpy.app.version < (2, 80, 0):
             neuronImageNode.layer = "RenderLayer"
@@ -189,6 +219,7 @@ for i in range(len(roisToInput)):
 
     outputNode.base_path = outputDir + roi
     bpy.ops.render.render()
+    trace_count("frames")
 
     # Necessary to workaround problems directly setting the output file name.
     os.rename(outputDir + roi + "/Image0001.png", pngPath)
@@ -205,6 +236,10 @@ for i in range(len(roisToInput)):
     if neuronImageNode.image:
         bpy.data.images.remove(neuronImageNode.image)
 
+end_phase()
+trace_count("frames_missing", len(missing))
+end_trace()
+
 if len(missing) > 0:
     print("Frames missing from the final composite: {}".format(missing))
 
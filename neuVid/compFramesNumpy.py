@@ -0,0 +1,181 @@
+# Composites into single frames the pairs of frames rendered separately, like compFrames.py
+# but without Blender: the ROI and neuron OpenEXR frames are read directly, and the unskewing
+# of the ROI depth, the depth compositing (z-combine) and the compositing over the background
+# are done with NumPy, with frames processed in parallel by worker processes.
+# The output PNG frames match those of compFrames.py except for Blender's dithering and its
+# anti-aliasing of the depth-comparison mask, which change some pixels by a few levels.
+
+# Run with plain Python, e.g.:
+# $ python compFramesNumpy.py -ir movie/framesROIs -in movie/framesNeurons -o movie/framesFinal --ocioConfig <blender>/<version>/datafiles/colormanagement/config.ocio
+# Requires the OpenEXR Python bindings, and for view transforms other than "Standard", PyOpenColorIO
+# (see utilsImages.py):
+# $ pip install OpenEXR opencolorio
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import datetime
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsFrames import FrameIndex
+from utilsGeneral import report_version
+from utilsImages import apply_view_transform, read_exr_passes, to_uint8, write_png
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count
+
+BACKGROUND_COLOR = np.array([0, 0, 0, 1], dtype=np.float32)
+
+def roi_depth(roi_passes):
+    if "Mist" in roi_passes:
+        # The "Mist" pass is skewed by hashed transparency, so unskew it as in compFrames.py:
+        # z = (z' - 1 + a) / a, with Blender's safe division giving 0 where a is 0.
+        mist = roi_passes["Mist"]
+        alpha = roi_passes["Combined"][..., 3]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(alpha != 0, (mist - 1 + alpha) / alpha, 0)
+    return roi_passes["Depth"]
+
+# Blender's "Z Combine" node with "Use Alpha": the nearer image is weighted by its alpha, over the other.
+def z_combine(image1, z1, image2, z2):
+    first = (z1 <= z2)[..., None]
+    front = np.where(first, image1, image2)
+    back = np.where(first, image2, image1)
+    fac = front[..., 3:4]
+    result = np.empty_like(image1)
+    result[..., :3] = fac * front[..., :3] + (1 - fac) * back[..., :3]
+    result[..., 3] = np.maximum(front[..., 3], back[..., 3])
+    return result
+
+# Blender's "Alpha Over" node with "Convert Premultiplied" and a factor of 1.
+def alpha_over(background, over):
+    a = over[..., 3:4]
+    result = (1 - a) * background + a * over
+    result[..., 3] = (1 - over[..., 3]) * background[3] + over[..., 3]
+    return np.where(a <= 0, background, result)
+
+def comp_frame(task):
+    roi_path, neuron_path, png_path, use_octane, view_transform, ocio_config = task
+    try:
+        comp_frame_images(roi_path, neuron_path, png_path, use_octane, view_transform, ocio_config)
+    except (OSError, KeyError) as e:
+        # Reported as missing by the caller.
+        print("Error: cannot composite '{}': {}".format(roi_path, str(e)))
+    return png_path
+
+def comp_frame_images(roi_path, neuron_path, png_path, use_octane, view_transform, ocio_config):
+    roi_passes = read_exr_passes(roi_path)
+    image1 = roi_passes["Combined"]
+    z1 = roi_depth(roi_passes)
+
+    if neuron_path:
+        neuron_passes = read_exr_passes(neuron_path)
+        image2 = neuron_passes["OctDenoiserBeauty" if use_octane else "Combined"]
+        z2 = neuron_passes["Depth"] if "Depth" in neuron_passes else np.ones_like(z1)
+    else:
+        image2 = np.broadcast_to(BACKGROUND_COLOR, image1.shape)
+        z2 = np.ones_like(z1)
+
+    result = alpha_over(BACKGROUND_COLOR, z_combine(image1, z1, image2, z2))
+    result = apply_view_transform(result, view_transform, ocio_config)
+    write_png(png_path, to_uint8(result))
+
+if __name__ == "__main__":
+    timeStart = datetime.datetime.now()
+    report_version()
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(start=1)
+    parser.set_defaults(end=999999)
+    parser.add_argument("--start", "-s", dest="start", type=int, help="first frame to comp")
+    parser.add_argument("--end", "-e", dest="end", type=int, help="last frame to comp")
+    parser.add_argument("--inputRois", "-ir", dest="inputROI", help="directory for input of ROI EXR files")
+    parser.add_argument("--inputNeurons", "-in", dest="inputNeurons", help="directory for input of neuron EXR files")
+    parser.set_defaults(requireBoth=False)
+    parser.add_argument("--requireBoth", dest="requireBoth", action="store_true", help="do NOT output only one frame if the other is missing")
+    parser.add_argument("--output", "-o", dest="output", help="directory for output of PNG files")
+    parser.set_defaults(useOctane=False)
+    parser.add_argument("--octane", "-oct", dest="useOctane", action="store_true", help="neurons were rendered with Octane")
+    parser.set_defaults(viewTransform="Filmic")
+    parser.add_argument("--viewTransform", "-vt", dest="viewTransform", help="view transform, as in Blender (default: Filmic, the default for compFrames.py with Blender 2.80 to 3.6; use AgX for Blender 4)")
+    parser.set_defaults(ocioConfig=None)
+    parser.add_argument("--ocioConfig", "-oc", dest="ocioConfig", help="path to Blender's OpenColorIO config.ocio, needed unless the view transform is Standard (default: the OCIO environment variable)")
+    parser.set_defaults(workers=None)
+    parser.add_argument("--workers", "-w", type=int, help="number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    inputROIDir = args.inputROI
+    if inputROIDir == None:
+        print("Missing -ir")
+        sys.exit()
+
+    inputNeuronsDir = args.inputNeurons
+    if inputNeuronsDir == None:
+        print("Missing -in")
+        sys.exit()
+
+    outputDir = args.output
+    if outputDir == None:
+        outputDir = "./"
+    os.makedirs(outputDir, exist_ok=True)
+
+    try:
+        import OpenEXR
+    except ImportError:
+        print("Error: reading OpenEXR files requires the OpenEXR Python bindings (pip install OpenEXR)")
+        sys.exit()
+    if args.viewTransform != "Standard":
+        try:
+            import PyOpenColorIO
+        except ImportError:
+            print("Error: the '{}' view transform requires PyOpenColorIO (pip install opencolorio), or use --viewTransform Standard".format(args.viewTransform))
+            sys.exit()
+        if not args.ocioConfig and not os.environ.get("OCIO"):
+            print("Error: the '{}' view transform requires --ocioConfig with the path to Blender's config.ocio".format(args.viewTransform))
+            sys.exit()
+    print("Using view transform: {}".format(args.viewTransform))
+
+    start_trace("compFramesNumpy")
+
+    rois = FrameIndex(inputROIDir, ".exr")
+    neurons = FrameIndex(inputNeuronsDir, ".exr")
+    pngs = FrameIndex(outputDir, ".png")
+    roisToInput = [f for f in rois.frames_in_range(args.start, args.end) if f not in pngs]
+
+    tasks = []
+    for frame in roisToInput:
+        if args.requireBoth and not frame in neurons:
+            continue
+        roiPath = rois.path(frame)
+        neuronPath = neurons.path(frame) if frame in neurons else None
+        pngPath = os.path.join(outputDir, rois.names[frame] + ".png")
+        tasks.append((roiPath, neuronPath, pngPath, args.useOctane, args.viewTransform, args.ocioConfig))
+
+    workers = args.workers if args.workers else os.cpu_count()
+    print("Compositing {} frames with {} workers".format(len(tasks), workers))
+
+    begin_phase("frames")
+    missing = []
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        results = executor.map(comp_frame, tasks) if executor else map(comp_frame, tasks)
+        for i, pngPath in enumerate(results):
+            trace_count("frames")
+            if not os.path.isfile(pngPath):
+                print("*** missing {}".format(pngPath))
+                missing.append(pngPath)
+            if (i + 1) % 100 == 0 or i + 1 == len(tasks):
+                print("{} of {}, {:.2f}%".format(i + 1, len(tasks), 100 * (i + 1) / len(tasks)))
+    finally:
+        if executor:
+            executor.shutdown()
+    end_phase()
+    trace_count("frames_missing", len(missing))
+    end_trace()
+
+    if len(missing) > 0:
+        print("Frames missing from the final composite: {}".format(missing))
+
+    timeEnd = datetime.datetime.now()
+    print("Compositing started at {}".format(timeStart))
+    print("Compositing ended at {}".format(timeEnd))
@@ -10,9 +10,13 @@ import tempfile
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from utilsColors import colors, getColor
+from utilsFrames import FrameIndex, get_frame_indices
 from utilsGeneral import newObject, report_version
 from utilsJson import guess_extraneous_comma, removeComments
 from utilsMaterials import insertMaterialKeyframe, new_shadeless_material, setMaterialValue
+from utilsOverlays import OverlayCache, pass_through
+from utilsParallel import run_frame_workers
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count, trace_phase
     
 def get_image_size(input):
     for f in os.listdir(input):
@@ -267,39 +271,11 @@ def setup_comp_scene(output):
 
     return scene
 
-def get_image_paths(dir):
-    paths = [os.path.splitext(f)[0] for f in os.listdir(dir) if os.path.splitext(f)[1] == ".png"]
-    paths.sort()
-    return paths
-
 def apply_image_size(labels_scene, comp_scene, image_size):
     for scene in [labels_scene, comp_scene]:
         scene.render.resolution_x = image_size[0]
         scene.render.resolution_y = image_size[1]
 
-def get_frame_indices(start_frame, end_frame, images):
-    if not start_frame:
-        i0 = 0
-    else:
-        for i in range(len(images)):
-            base = os.path.splitext(os.path.basename(images[i]))[0]
-            base_int = int(base)
-            if start_frame >= base_int:
-                i0 = i
-            else:
-                break
-    if not end_frame:
-        i1 = len(images) - 1
-    else:
-        for i in range(len(images)-1, 0-1, -1):
-            base = os.path.splitext(os.path.basename(images[i]))[0]
-            base_int = int(base)
-            if end_frame <= base_int:
-                i1 = i
-            else:
-                break
-    return i0, i1
-
 def render_label(labels_scene, frame):
     labels_scene.frame_set(frame)
     filepath_base = labels_scene.render.filepath
@@ -343,18 +319,44 @@ def comp_label(comp_scene, label_image, rendered_image, frame):
     if image_node2.image:
         bpy.data.images.remove(image_node2.image)
 
-def comp_labels(labels_scene, comp_scene, input, image_size, start_frame, end_frame):
-    rendered_frames = get_image_paths(input)
+def comp_labels(labels_scene, comp_scene, input, output, image_size, start_frame, end_frame):
+    rendered_frames = FrameIndex(input, ".png")
     apply_image_size(labels_scene, comp_scene, image_size)
-    i0, i1 = get_frame_indices(start_frame, end_frame, rendered_frames)
+    i0, i1 = get_frame_indices(start_frame, end_frame, rendered_frames.frames)
+    # Render the overlay only when its animated values change, and skip it when it is transparent.
+    overlays = OverlayCache([m for m in bpy.data.materials if m.name.startswith("Material.Text")])
     for i in range(i0, i1 + 1):
         progress = round((i - i0) / (i1 - i0 + 1) * 100, 1)
-        rendered_image = os.path.join(input, f"{rendered_frames[i]}.png")
-        frame = int(rendered_frames[i])
+        frame = rendered_frames.frames[i]
+        rendered_image = rendered_frames.path(frame)
         print(f"{progress}%: {rendered_image}\n")
 
-        label_image = render_label(labels_scene, frame)
-        comp_label(comp_scene, label_image, rendered_image, frame)
+        if overlays.is_transparent(frame):
+            with trace_phase("pass_through"):
+                pass_through(rendered_image, output, frame)
+            trace_count("frames_passed_through")
+        else:
+            with trace_phase("label"):
+                label_image, reused = overlays.get(frame, lambda f: render_label(labels_scene, f))
+            if reused:
+                trace_count("overlays_reused")
+            with trace_phase("comp"):
+                comp_label(comp_scene, label_image, rendered_image, frame)
+        trace_count("frames")
+
+# Runs this script as `workers` Blender processes, each on a contiguous range of the frames.
+# Returns the paths of the output frames that are missing afterwards.
+def comp_labels_parallel(argv, input, output, start_frame, end_frame, workers):
+    rendered_frames = FrameIndex(input, ".png")
+    if len(rendered_frames) == 0:
+        return []
+    i0, i1 = get_frame_indices(start_frame, end_frame, rendered_frames.frames)
+    frames = rendered_frames.frames[i0:i1 + 1]
+    failed = run_frame_workers(bpy.app.binary_path, os.path.realpath(__file__), argv, frames, workers, "--frame-start", "--frame-end")
+    if failed > 0:
+        print(f"Error: {failed} worker(s) failed")
+    output_paths = [os.path.join(output, f"{str(frame).zfill(4)}.png") for frame in frames]
+    return [path for path in output_paths if not os.path.isfile(path)]
 
 if __name__ == "__main__":
     report_version()
@@ -381,6 +383,8 @@ if __name__ == "__main__":
     parser.add_argument("--frame-end", "-e", type=int, dest="end", help="last frame to composite")
     parser.set_defaults(threads=None)
     parser.add_argument("--threads", "-t", dest="threads", type=int, help="thread count for Cycles (default: let Cycles choose)")
+    parser.set_defaults(workers=1)
+    parser.add_argument("--workers", "-w", dest="workers", type=int, help="number of Blender processes, each compositing a contiguous range of frames")
     args = parser.parse_args(argv)
 
     print(f"Using JSON: {args.input_json_file}")
@@ -398,20 +402,34 @@ if __name__ == "__main__":
 
     runtime0 = datetime.datetime.now()
 
-    image_size = get_image_size(input)
-    print(f"Using final image size: {image_size}")
+    start_trace("compLabels")
+    if args.workers > 1:
+        print(f"Using worker count: {args.workers}")
+        with trace_phase("workers"):
+            missing = comp_labels_parallel(argv, input, output, args.start, args.end, args.workers)
+        trace_count("frames_missing", len(missing))
+        if len(missing) > 0:
+            print(f"Frames missing from the labeled frames: {missing}")
+    else:
+        begin_phase("setup")
+        image_size = get_image_size(input)
+        print(f"Using final image size: {image_size}")
+
+        labels = parse_labels(args.input_json_file, image_size)
+        labels_scene = setup_labels_scene(labels)
+        comp_scene = setup_comp_scene(output)
 
-    labels = parse_labels(args.input_json_file, image_size)
-    labels_scene = setup_labels_scene(labels)
-    comp_scene = setup_comp_scene(output)
+        if args.threads != None:
+            for scene in [comp_scene, labels_scene]:
+                scene.render.threads_mode = "FIXED"
+                scene.render.threads = args.threads
+            print("Using thread count: {}".format(args.threads))
 
-    if args.threads != None:
-        for scene in [comp_scene, labels_scene]:
-            scene.render.threads_mode = "FIXED"
-            scene.render.threads = args.threads
-        print("Using thread count: {}".format(args.threads))
+        end_phase()
 
-    comp_labels(labels_scene, comp_scene, input, image_size, args.start, args.end)
+        with trace_phase("frames"):
+            comp_labels(labels_scene, comp_scene, input, output, image_size, args.start, args.end)
+    end_trace()
 
     runtime1 = datetime.datetime.now()
     print(f"Compositing started at {runtime0}")
@@ -0,0 +1,219 @@
+# Denoises the noisy frames from `render.py --denoiseLater` as a separate stage, so the rendering can
+# use fewer samples.  Each frame's color is first blended with the colors of its neighboring frames
+# where their albedo and normal passes match the frame's (so only the same surfaces are blended), which
+# reduces the flicker from denoising each frame independently.  There is no motion compensation, so a
+# neighboring frame is blended only if neither the camera nor any object moves between it and the frame
+# (as listed by render.py).  Then each frame is denoised by OpenImageDenoise, guided by the albedo and
+# normal passes.  Worker processes denoise runs of consecutive frames in parallel, reading each frame
+# once for all its neighbors in the run.
+
+# Run with plain Python, e.g.:
+# $ python denoiseFrames.py -i movie/frames --ocioConfig <blender>/<version>/datafiles/colormanagement/config.ocio
+# Requires the OpenEXR Python bindings, the oidnDenoise executable from OpenImageDenoise
+# (https://www.openimagedenoise.org/downloads.html), and for view transforms other than "Standard",
+# PyOpenColorIO (see utilsImages.py):
+# $ pip install OpenEXR opencolorio
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import datetime
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsFrames import MOTION_FRAMES_NAME, FrameIndex, read_motion_frames
+from utilsGeneral import report_version
+from utilsImages import apply_view_transform, read_exr_passes, read_pfm, to_uint8, write_pfm, write_png
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count
+
+# The most consecutive frames denoised by one task.
+CHUNK_FRAMES = 24
+
+# The largest differences in the albedo and normal passes for a neighboring frame's pixel to be blended.
+ALBEDO_TOLERANCE = 0.02
+NORMAL_TOLERANCE = 0.05
+
+# The frame's noisy color blended with the colors of the `neighbors` (passes of other frames) where
+# their albedo and normal match the frame's, with each matching neighbor having the relative `weight`.
+def blend_temporal(passes, neighbors, weight):
+    albedo = passes["Denoising Albedo"]
+    normal = passes["Denoising Normal"]
+    total = passes["Combined"][..., :3].copy()
+    weights = np.ones(total.shape[:2] + (1, ), dtype=np.float32)
+    for neighbor in neighbors:
+        match = (np.abs(neighbor["Denoising Albedo"] - albedo).max(axis=-1) <= ALBEDO_TOLERANCE) & \
+            (np.abs(neighbor["Denoising Normal"] - normal).max(axis=-1) <= NORMAL_TOLERANCE)
+        w = np.where(match, weight, 0).astype(np.float32)[..., None]
+        total += w * neighbor["Combined"][..., :3]
+        weights += w
+    return total / weights
+
+def run_oidn(oidn, color, albedo, normal, threads, tmp):
+    color_path, albedo_path, normal_path, output_path = [os.path.join(tmp, n + ".pfm") for n in ["color", "albedo", "normal", "output"]]
+    write_pfm(color_path, color)
+    write_pfm(albedo_path, albedo)
+    write_pfm(normal_path, normal)
+    cmd = [oidn, "--hdr", color_path, "--alb", albedo_path, "--nrm", normal_path, "-o", output_path]
+    if threads:
+        cmd += ["--threads", str(threads)]
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+    return read_pfm(output_path)
+
+# Whether anything moves from frame `f0` to `f1`, given the frames with motion since their previous frames.
+def moves_between(motion_frames, f0, f1):
+    return any([f in motion_frames for f in range(min(f0, f1) + 1, max(f0, f1) + 1)])
+
+def denoise_frames(task):
+    exr_paths, frames, indices, png_paths, motion_frames, radius, weight, oidn, threads, view_transform, ocio_config = task
+    cache = {}
+    def get_passes(i):
+        if not i in cache:
+            cache[i] = read_exr_passes(exr_paths[i])
+        return cache[i]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, png_path in zip(indices, png_paths):
+            try:
+                passes = get_passes(i)
+                neighbors = [get_passes(j) for j in range(max(0, i - radius), min(len(exr_paths), i + radius + 1))
+                    if j != i and not moves_between(motion_frames, frames[i], frames[j])]
+                color = blend_temporal(passes, neighbors, weight) if len(neighbors) > 0 else passes["Combined"][..., :3]
+                result = passes["Combined"].copy()
+                result[..., :3] = run_oidn(oidn, color, passes["Denoising Albedo"], passes["Denoising Normal"], threads, tmp)
+                result = apply_view_transform(result, view_transform, ocio_config)
+                write_png(png_path, to_uint8(result))
+            except (OSError, KeyError, RuntimeError, ValueError, subprocess.CalledProcessError) as e:
+                # Reported as missing by the caller.
+                print("Error: cannot denoise '{}': {}".format(exr_paths[i], str(e)))
+            # Frames before the window of the next frame are no longer needed.
+            for j in [j for j in cache.keys() if j <= i - radius]:
+                del cache[j]
+    return png_paths
+
+if __name__ == "__main__":
+    timeStart = datetime.datetime.now()
+    report_version()
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(start=1)
+    parser.set_defaults(end=999999)
+    parser.add_argument("--start", "-s", dest="start", type=int, help="first frame to denoise")
+    parser.add_argument("--end", "-e", dest="end", type=int, help="last frame to denoise")
+    parser.add_argument("--input", "-i", dest="input", help="directory of the EXR frames from render.py --denoiseLater, or the JSON file to infer it")
+    parser.add_argument("--output", "-o", dest="output", help="directory for output of PNG files (default: the input directory)")
+    parser.set_defaults(radius=1)
+    parser.add_argument("--radius", "-r", type=int, dest="radius", help="frames on each side to blend with each frame (0 for no temporal blending)")
+    parser.set_defaults(weight=0.5)
+    parser.add_argument("--weight", "-wt", type=float, dest="weight", help="weight of a neighboring frame relative to the frame itself")
+    parser.set_defaults(viewTransform="Filmic")
+    parser.add_argument("--viewTransform", "-vt", dest="viewTransform", help="view transform, as in Blender (default: Filmic, the default for Blender 2.80 to 3.6; use AgX for Blender 4, and Standard for render.py --white)")
+    parser.set_defaults(ocioConfig=None)
+    parser.add_argument("--ocioConfig", "-oc", dest="ocioConfig", help="path to Blender's OpenColorIO config.ocio, needed unless the view transform is Standard (default: the OCIO environment variable)")
+    parser.set_defaults(oidn=None)
+    parser.add_argument("--oidn", dest="oidn", help="path to the oidnDenoise executable (default: oidnDenoise from the PATH)")
+    parser.set_defaults(workers=2)
+    parser.add_argument("--workers", "-w", type=int, help="number of worker processes")
+    parser.set_defaults(threads=None)
+    parser.add_argument("--threads", "-t", type=int, dest="threads", help="threads for each oidnDenoise (default: the CPU count divided by the workers)")
+    args = parser.parse_args()
+
+    inputDir = args.input
+    if inputDir == None:
+        print("Missing -i")
+        sys.exit()
+    input, ext = os.path.splitext(inputDir)
+    if ext.lower() == ".json":
+        inputDir = input + "-frames"
+    print("Using input directory: '{}'".format(inputDir))
+
+    outputDir = args.output
+    if outputDir == None:
+        outputDir = inputDir
+    os.makedirs(outputDir, exist_ok=True)
+
+    oidn = shutil.which(args.oidn if args.oidn else "oidnDenoise")
+    if not oidn:
+        print("Error: cannot find oidnDenoise; use --oidn to give its path")
+        sys.exit()
+    try:
+        import OpenEXR
+    except ImportError:
+        print("Error: reading OpenEXR files requires the OpenEXR Python bindings (pip install OpenEXR)")
+        sys.exit()
+    if args.viewTransform != "Standard":
+        try:
+            import PyOpenColorIO
+        except ImportError:
+            print("Error: the '{}' view transform requires PyOpenColorIO (pip install opencolorio), or use --viewTransform Standard".format(args.viewTransform))
+            sys.exit()
+        if not args.ocioConfig and not os.environ.get("OCIO"):
+            print("Error: the '{}' view transform requires --ocioConfig with the path to Blender's config.ocio".format(args.viewTransform))
+            sys.exit()
+    print("Using view transform: {}".format(args.viewTransform))
+
+    motionFrames = read_motion_frames(inputDir)
+    radius = args.radius
+    if motionFrames == None and radius > 0:
+        print("No {} in the input directory (from render.py --denoiseLater), so no blending of neighboring frames".format(MOTION_FRAMES_NAME))
+        radius = 0
+
+    start_trace("denoiseFrames")
+
+    exrs = FrameIndex(inputDir, ".exr")
+    pngs = FrameIndex(outputDir, ".png")
+    framesToDenoise = set([f for f in exrs.frames_in_range(args.start, args.end) if f not in pngs])
+
+    # Runs of consecutive frames to denoise, each with the neighboring frames for blending.
+    tasks = []
+    workers = max(1, args.workers)
+    threads = args.threads if args.threads else max(1, os.cpu_count() // workers)
+    run = []
+    for i, frame in enumerate(exrs.frames + [None]):
+        if frame in framesToDenoise and len(run) < CHUNK_FRAMES:
+            run.append(i)
+            continue
+        if len(run) > 0:
+            i0 = max(0, run[0] - radius)
+            i1 = min(len(exrs.frames), run[-1] + radius + 1)
+            frames = exrs.frames[i0:i1]
+            exrPaths = [exrs.path(f) for f in frames]
+            pngPaths = [os.path.join(outputDir, exrs.names[exrs.frames[j]] + ".png") for j in run]
+            motion = set([f for f in motionFrames if frames[0] < f and f <= frames[-1]]) if motionFrames else set()
+            tasks.append((exrPaths, frames, [j - i0 for j in run], pngPaths, motion, radius, args.weight, oidn, threads,
+                args.viewTransform, args.ocioConfig))
+        run = [i] if frame in framesToDenoise else []
+
+    print("Denoising {} frames with {} workers, {} threads each".format(len(framesToDenoise), workers, threads))
+
+    begin_phase("frames")
+    missing = []
+    done = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        results = executor.map(denoise_frames, tasks) if executor else map(denoise_frames, tasks)
+        for pngPaths in results:
+            for pngPath in pngPaths:
+                trace_count("frames")
+                if not os.path.isfile(pngPath):
+                    print("*** missing {}".format(pngPath))
+                    missing.append(pngPath)
+            done += len(pngPaths)
+            print("{} of {}, {:.2f}%".format(done, len(framesToDenoise), 100 * done / len(framesToDenoise)))
+    finally:
+        if executor:
+            executor.shutdown()
+    end_phase()
+    trace_count("frames_missing", len(missing))
+    end_trace()
+
+    if len(missing) > 0:
+        print("Frames missing from the denoised output: {}".format(missing))
+
+    timeEnd = datetime.datetime.now()
+    print("Denoising started at {}".format(timeStart))
+    print("Denoising ended at {}".format(timeEnd))
+    print("Elapsed time: {}".format(timeEnd - timeStart))
@@ -30,6 +30,7 @@ from utilsGeneral import report_version
 from utilsJson import decode_id, guess_extraneous_comma, parseNeuronsIds, parseRoiNames, removeComments
 from utilsNg import dir_name_from_ng_source, is_ng_source, source_to_url
 from utilsSynapses import download_synapses
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count
 
 report_version()
 
@@ -106,6 +107,8 @@ def fetch_with_cloudvolume(source, ids, decim_fraction, input_json_dir, force):
             print(f"[{percent:.1f}%] Exporting {output} ...")
             mesh_smooth_decim.export(output)
             print("Done")
+            trace_count("meshes")
+            trace_count("faces", face_count_decim)
 
             j += 1
 
@@ -205,6 +208,7 @@ def fetch_directly(source, mesh_info, ids, lod, decim_fraction, input_json_dir,
                     if lod_byte_offset[idx] != lod_byte_offset[idx + 1]:
                         # Nonempty chunk.
                         response = requests.get(f'{url_base}/{id}', headers={"range": f"bytes={lod_byte_offset[idx]}-{lod_byte_offset[idx+1]}"})
+                        trace_count("bytes_downloaded", len(response.content))
                         drc_mesh = DracoPy.decode(response.content)
                         points = np.asarray(drc_mesh.points, dtype=np.float64).reshape(-1, 3)
 
@@ -239,6 +243,8 @@ def fetch_directly(source, mesh_info, ids, lod, decim_fraction, input_json_dir,
 
                 output = os.path.join(download_dir, str(id) + ".obj")
                 mesh_smooth_decim.export(output)
+                trace_count("meshes")
+                trace_count("faces", face_count_decim)
 
                 j += 1
 
@@ -293,6 +299,8 @@ if __name__ == "__main__":
     print(f"Using input file: {args.input_json_file}")
     print(f"Using decimation fraction: {args.decim_fraction}")
 
+    start_trace("fetchMeshes")
+
     input_json_dir = os.path.dirname(os.path.realpath(args.input_json_file))
 
     try:
@@ -325,17 +333,23 @@ if __name__ == "__main__":
                     source = neuron_sources[i]
 
                     if is_ng_source(source):
+                        begin_phase(category)
                         print(f"Fetching {len(ids[i])} {category} meshes from source {source}")
                         mesh_info = get_mesh_info(source)
                         if is_cloudvolume_accessible(mesh_info):
                             fetch_with_cloudvolume(source, ids[i], args.decim_fraction, input_json_dir, args.force)
                         else:
                             fetch_directly(source, mesh_info, ids[i], args.lod, args.decim_fraction, input_json_dir, args.force)
+                        end_phase()
 
 
     if "synapses" in json_data:
         json_synapses = json_data["synapses"]
+        begin_phase("synapses")
         fetch_synapses(json_synapses)
+        end_phase()
+
+    end_trace()
 
     time_end = datetime.datetime.now()
     print()
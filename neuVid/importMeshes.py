@@ -11,6 +11,7 @@ import datetime
 import json
 import math
 import mathutils
+import numpy as np
 import os
 import sys
 
@@ -20,8 +21,11 @@ sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from utilsColors import colors, getColor, shuffledColorsForSmallDataSets
 from utilsGeneral import newObject, report_version
 from utilsJson import decode_id, guess_extraneous_comma, parseNeuronsIds, parseRoiNames, removeComments
-from utilsMaterials import newBasicMaterial, newGlowingMaterial, newSilhouetteMaterial
-from utilsMeshes import fileToImportForRoi, fileToImportForNeuron, fileToImportForSynapses, get_bounding_box_np, get_bounding_sphere_np, get_vertices_np
+from utilsMaterials import SHARED_NEURON_MATERIAL_NAME, newBasicMaterial, newGlowingMaterial, newSharedBasicMaterial, newSilhouetteMaterial, setupObjectAttributes, supportsSharedMaterials
+from utilsMeshes import fileToImportForRoi, fileToImportForNeuron, fileToImportForSynapses, get_bounding_box_np, get_bounding_sphere_np, get_vertices_np, import_obj, import_objs
+from utilsMeshes import add_lod_meshes, supports_lod_meshes
+from utilsTrace import begin_phase, end_phase, end_trace, start_trace, trace_count
+from sortByBbox import get_bbox_index_path, get_indexed_rows, partition_bbox_arrays, read_bbox_index, update_bbox_index, write_bbox_index
 
 report_version()
 
@@ -42,6 +46,8 @@ parser.set_defaults(swcAxonRadiusFactor=2*5)
 parser.add_argument("--swcar", dest="swcAxonRadiusFactor", type=float, help="for SWC files, multipliciative factor for axon radii")
 parser.set_defaults(swcDendriteRadiusFactor=3*5)
 parser.add_argument("--swcdr", dest="swcDendriteRadiusFactor", type=float, help="for SWC files, multipliciative factor for dendrite radii")
+parser.set_defaults(swcTube=False)
+parser.add_argument("--swctube", dest="swcTube", action="store_true", help="for SWC files, build continuous tubes with shared rings instead of separate cones")
 parser.set_defaults(skipExisting=False)
 parser.add_argument("--skipExisting", "-sk", dest="skipExisting", action="store_true", help="skip downloading existing neurons/rois/synapses, already downloaded")
 parser.set_defaults(split=None)
@@ -49,6 +55,19 @@ parser.add_argument("--split", "-sp", dest="split", nargs='*', type=int, help="'
 # A limit of 0 means no limit.
 parser.set_defaults(limit=0)
 parser.add_argument("--limit", "-l", type=int, dest="limit", help="limit to the number of IDs from each separate neurons file")
+# A budget of 0 means no automatic partitioning.
+parser.set_defaults(chunkTriangles=0)
+parser.add_argument("--chunkTriangles", "-ct", type=int, dest="chunkTriangles", help="partition neuron groups with more triangles into separate .blend files")
+parser.set_defaults(partitionFile=None)
+parser.add_argument("--partitionFile", "-pf", dest="partitionFile", help="JSON file for the partitions from --chunkTriangles, read if it exists and otherwise written (needed with --split)")
+parser.set_defaults(partitionOnly=False)
+parser.add_argument("--partitionOnly", "-po", dest="partitionOnly", action="store_true", help="stop after writing the --partitionFile")
+parser.set_defaults(sharedMaterials=False)
+parser.add_argument("--sharedMaterials", "-sm", dest="sharedMaterials", action="store_true", help="share one material among neurons, with color and alpha as object attributes")
+parser.set_defaults(lodRatios=[])
+parser.add_argument("--lodRatios", "-lr", dest="lodRatios", nargs="*", type=float, help="decimation ratios for level-of-detail variants of neuron meshes (e.g., 0.25 0.05)")
+parser.set_defaults(reportFile=None)
+parser.add_argument("--report", "-rp", dest="reportFile", help="path for a JSON file listing the missing meshes (e.g., for parallelImportMeshes.py)")
 parser.set_defaults(strict=False)
 parser.add_argument("--strict", dest="strict", action="store_true", help="use strict behavior (e.g., stop when a download fails)")
 
@@ -68,6 +87,7 @@ print("Using output Blender file: '{}'".format(outputFile))
 print("Using SWC cross-sectional vertex count: {}".format(args.swcCapVertexCount))
 print("Using SWC axon radius factor: {}".format(args.swcAxonRadiusFactor))
 print("Using SWC dendrite radius factor: {}".format(args.swcDendriteRadiusFactor))
+print("Using SWC continuous tubes: {}".format(args.swcTube))
 
 if args.skipExisting:
     print("Skipping downloading of existing neurons/rois/synapses")
@@ -75,6 +95,23 @@ if args.split:
     if len(args.split) != 2:
         print("Usage: `--split i n` splits the source indices into n groups, writes the separate files for group i")
     print("Only writing the separate files for source subgroup {} of {}".format(args.split[0], args.split[1]))
+if args.sharedMaterials and not supportsSharedMaterials():
+    print("Shared materials need Blender 2.93 or later, so using a material per neuron")
+    args.sharedMaterials = False
+print("Using shared materials for neurons: {}".format(args.sharedMaterials))
+if args.lodRatios:
+    args.lodRatios = sorted([r for r in args.lodRatios if 0 < r < 1], reverse=True)
+    if not supports_lod_meshes():
+        print("Level-of-detail meshes need Blender 2.81 or later, so skipping them")
+        args.lodRatios = []
+    print("Using level-of-detail ratios for neurons: {}".format(args.lodRatios))
+if args.chunkTriangles > 0:
+    print("Partitioning neuron groups with more than {} triangles".format(args.chunkTriangles))
+if args.partitionOnly and (args.chunkTriangles <= 0 or not args.partitionFile):
+    print("Error: `--partitionOnly` needs `--chunkTriangles` and `--partitionFile`")
+    sys.exit()
+
+start_trace("importMeshes")
 
 inputJsonDir = os.path.dirname(os.path.realpath(args.inputJsonFile))
 
@@ -99,6 +136,10 @@ if jsonData == None:
 def deleteObjects():
     for obj in bpy.data.objects:
         if obj.name != "Camera":
+            if "lodMeshes" in obj.keys():
+                for meshName in obj["lodMeshes"][1:]:
+                    if meshName in bpy.data.meshes:
+                        bpy.data.meshes.remove(bpy.data.meshes[meshName], do_unlink=True)
             matName = "Material." + obj.name
             if matName in bpy.data.materials:
                 mat = bpy.data.materials[matName]
@@ -157,6 +198,60 @@ def finish(timeStart, missingNeuronObjs, missingRoiObjs, missingSynapseSetObjs):
             print(x)
         print("NOTE: run buildSynapses.py to generate synapse mesh .obj files")
 
+    if args.reportFile:
+        report = {
+            "missingNeurons": missingNeuronObjs,
+            "missingRois": missingRoiObjs,
+            "missingSynapses": missingSynapseSetObjs,
+            "elapsedSecs": (timeEnd - timeStart).total_seconds()
+        }
+        with open(args.reportFile, "w") as f:
+            json.dump(report, f, indent=2)
+
+    trace_count("missing_meshes", len(missingNeuronObjs) + len(missingRoiObjs) + len(missingSynapseSetObjs))
+    end_trace()
+
+def unionBounds(boundDataMap):
+    limit = sys.float_info.max
+    bboxMin = [ limit,  limit,  limit]
+    bboxMax = [-limit, -limit, -limit]
+    for (key, data) in boundDataMap.items():
+        for i in range(3):
+            bboxMin[i] = min(bboxMin[i], data["min"][i])
+            bboxMax[i] = max(bboxMax[i], data["max"][i])
+    bboxCenter = [(bboxMin[i] + bboxMax[i]) / 2 for i in range(3)]
+
+    # Approximate the sphere, since the individual vertices are no longer available.
+    radius = 0
+    for (key, data) in boundDataMap.items():
+        offset = (data["center"] - mathutils.Vector(bboxCenter)).length
+        approxRadius = offset + data["radius"]
+        radius = max(radius, approxRadius)
+    return { "center" : bboxCenter, "min" : bboxMin, "max" : bboxMax, "radius" : radius }
+
+def getMeshStats(objPaths):
+    # Use the bounding box index from `sortByBbox.py`, so the mesh files need to be scanned only
+    # the first time, or when they change.  Scan in this process, not with a pool of processes,
+    # for simplicity when running in Blender.
+    mins = np.zeros((len(objPaths), 3))
+    maxs = np.zeros((len(objPaths), 3))
+    faceCounts = np.zeros(len(objPaths), dtype=np.int64)
+    dirToIndices = {}
+    for j in range(len(objPaths)):
+        dirToIndices.setdefault(os.path.dirname(objPaths[j]), []).append(j)
+    for dir, indices in dirToIndices.items():
+        filenames = [os.path.basename(objPaths[j]) for j in indices]
+        indexPath = get_bbox_index_path(dir)
+        index = read_bbox_index(indexPath)
+        index, changed = update_bbox_index(index, filenames, dir, 1)
+        if changed:
+            write_bbox_index(index, indexPath)
+        rows = get_indexed_rows(index, filenames)
+        mins[indices] = rows["min"]
+        maxs[indices] = rows["max"]
+        faceCounts[indices] = rows["face_count"]
+    return mins, maxs, faceCounts
+
 groupToBBox = {}
 meshesSourceIndexToBBox = {}
 
@@ -235,28 +330,173 @@ print("Done")
 
 #
 
-separateNeuronFiles = []
+# Groups partitioned automatically, mapping to the indices of the partitions' separate files
+# (treated as additional sources), and to the partitions' IDs, in the groups' orders.
+groupToPartitionSourceIndices = {}
+groupToPartitionIds = {}
+neuronIdToObjPath = {}
+
+def computePartitionIds():
+    result = {}
+    for groupName in sorted(groupToNeuronIds.keys()):
+        groupNeuronIds = groupToNeuronIds[groupName]
+        i = groupToMeshesSourceIndex[groupName]
+
+        foundIds = []
+        objPaths = []
+        for neuronId in groupNeuronIds:
+            if not neuronId in neuronIdToObjPath:
+                neuronIdToObjPath[neuronId] = fileToImportForNeuron(neuronSources[i], decode_id(neuronId), parentForDownloadDir, args.swcCapVertexCount,
+                    args.swcAxonRadiusFactor, args.swcDendriteRadiusFactor, args.skipExisting, args.swcTube)
+            objPath = neuronIdToObjPath[neuronId]
+            if objPath and os.path.isfile(objPath):
+                foundIds.append(neuronId)
+                objPaths.append(objPath)
+
+        mins, maxs, faceCounts = getMeshStats(objPaths)
+        triangles = int(faceCounts.sum())
+        print("Group '{}': {} neurons, {} triangles".format(groupName, len(groupNeuronIds), triangles))
+        if triangles <= args.chunkTriangles:
+            continue
+
+        n = math.ceil(triangles / args.chunkTriangles)
+        parts = partition_bbox_arrays(mins, maxs, faceCounts, n)
+        partIds = [[foundIds[j] for j in sorted(part)] for part in parts if len(part) > 0]
+        # Neurons with missing meshes go in the first partition, so they are reported as usual.
+        foundIdsSet = set(foundIds)
+        partIds[0] += [id for id in groupNeuronIds if not id in foundIdsSet]
+        result[groupName] = partIds
+    return result
+
+def writePartitionIds(groupToPartitionIds, path):
+    data = { "chunkTriangles": args.chunkTriangles, "groups": sorted(groupToNeuronIds.keys()), "partitions": groupToPartitionIds }
+    try:
+        with open(path, "w") as f:
+            json.dump(data, f)
+    except OSError as e:
+        print("Error: cannot write partition file '{}': {}".format(path, str(e)))
+        sys.exit()
+
+def readPartitionIds(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print("Error: cannot read partition file '{}': {}".format(path, str(e)))
+        sys.exit()
+    result = data.get("partitions", {})
+    # A file from an earlier run with a different JSON file or budget would assign neurons to the wrong files.
+    valid = data.get("chunkTriangles") == args.chunkTriangles and data.get("groups") == sorted(groupToNeuronIds.keys())
+    for groupName, partIds in result.items():
+        valid = valid and set([id for ids in partIds for id in ids]) == set(groupToNeuronIds[groupName])
+    if not valid:
+        print("Error: partition file '{}' does not match the JSON file and --chunkTriangles; delete it to partition again".format(path))
+        sys.exit()
+    return result
+
+if args.chunkTriangles > 0 and len(neuronSources) > 0:
+    if args.partitionFile and os.path.exists(args.partitionFile):
+        print("Reading partitions of large neuron groups from '{}'...".format(args.partitionFile))
+        groupToPartitionIds = readPartitionIds(args.partitionFile)
+    elif args.split:
+        # Split runs partitioning on their own could disagree (e.g., if one scans a mesh file while
+        # another is still downloading it), so they must share the partitions from one earlier run.
+        print("Error: `--split` with `--chunkTriangles` needs the `--partitionFile` written by an earlier run (e.g., with `--partitionOnly`)")
+        sys.exit()
+    else:
+        print("Partitioning large neuron groups...")
+        groupToPartitionIds = computePartitionIds()
+        if args.partitionFile:
+            print("Writing partitions to '{}'".format(args.partitionFile))
+            writePartitionIds(groupToPartitionIds, args.partitionFile)
+
+    originalSourceCount = len(neuronSources)
+    # Sorted, so the partitions get the same source indices in every run.
+    for groupName in sorted(groupToPartitionIds.keys()):
+        i = groupToMeshesSourceIndex[groupName]
+        partIds = groupToPartitionIds[groupName]
+        groupToPartitionSourceIndices[groupName] = []
+        for ids in partIds:
+            groupToPartitionSourceIndices[groupName].append(len(neuronSources))
+            neuronSources.append(neuronSources[i])
+            # Sorted, as in `parseNeuronsIds`, for faster importing.
+            neuronIds.append(sorted(set(ids)))
+        print("Partitioned group '{}' into {} separate files".format(groupName, len(partIds)))
+
+    if len(groupToPartitionSourceIndices) > 0:
+        # The original sources keep only the IDs of the groups that were not partitioned.
+        for i in range(originalSourceCount):
+            keep = set()
+            for groupName, groupNeuronIds in groupToNeuronIds.items():
+                if not groupName in groupToPartitionSourceIndices and groupToMeshesSourceIndex[groupName] == i:
+                    keep.update(groupNeuronIds)
+            neuronIds[i] = [id for id in neuronIds[i] if id in keep]
+        for groupName in groupToPartitionSourceIndices.keys():
+            groupToMeshesSourceIndex[groupName] = None
+
+    print("Done")
+
+# The sources written to separate .blend files: all of them with `"separate": true` in the JSON file,
+# or otherwise just the partitions of large groups, with the other groups' neurons in the main file.
+if useSeparateNeuronFiles:
+    separateSourceIndices = list(range(len(neuronSources)))
+else:
+    separateSourceIndices = sorted([i for indices in groupToPartitionSourceIndices.values() for i in indices])
+if len(groupToPartitionSourceIndices) > 0:
+    print("Using separate .blend files for {} of {} neuron sources".format(len(separateSourceIndices), len(neuronSources)))
+
+#
+
+separateNeuronFiles = {}
 missingNeuronObjs = []
 missingRoiObjs = []
 missingSynapseSetObjs = []
 
+if args.partitionOnly:
+    print("Stopping after partitioning, for `--partitionOnly`")
+    finish(timeStart, missingNeuronObjs, missingRoiObjs, missingSynapseSetObjs)
+    sys.exit()
+
+if args.split and len(separateSourceIndices) == 0:
+    # Without separate files, each split run would write the same overall .blend file.
+    print("Nothing to do for `--split` without separate .blend files for neurons")
+    finish(timeStart, missingNeuronObjs, missingRoiObjs, missingSynapseSetObjs)
+    sys.exit()
+
 deleteObjects()
 
-for i in range(len(neuronSources)):
+begin_phase("neurons")
+# The separate files come first, each written from an otherwise empty scene, followed by the neurons
+# that stay in the main file.
+sourceOrder = separateSourceIndices + [i for i in range(len(neuronSources)) if not i in separateSourceIndices]
+previousSeparate = False
+for i in sourceOrder:
+    separate = i in separateSourceIndices
     if len(neuronSources) == 1:
         print("Importing {} neuron meshes".format(len(neuronIds[i])))
     else:
         print("Importing {} neuron meshes for index {} ({})".format(len(neuronIds[i]), i, neuronSources[i]))
 
-    if useSeparateNeuronFiles:
+    if separate or previousSeparate:
         deleteObjects()
+    previousSeparate = separate
 
-    if not inSplit(i, neuronSources, args.split):
+    if len(groupToPartitionSourceIndices) > 0 and not i in groupToMeshesSourceIndex.values() and len(neuronIds[i]) == 0:
+        # All of this source's groups were partitioned into other separate files.
+        print("Skipping source {}, with no neurons after partitioning".format(i))
+        continue
+
+    if args.split and not separate:
+        # The neurons in the main file are imported by the final run without `--split`.
+        print("Skipping source {}, for the main file".format(i))
+        continue
+
+    if separate and not inSplit(separateSourceIndices.index(i), separateSourceIndices, args.split):
         print("Skipping source {}".format(i))
         continue
 
     useExistingSeparate = False
-    if useSeparateNeuronFiles:
+    if separate:
         outputFileSeparate = os.path.splitext(outputFile)[0] + "_neurons_" + str(i) + ".blend"
         if args.skipExisting:
             if os.path.exists(outputFileSeparate):
@@ -264,10 +504,15 @@ for i in range(len(neuronSources)):
 
     j = 0
     neuronIdsToImport = neuronIds[i] if not useExistingSeparate else []
+    objPaths = []
+    objNames = []
     for neuronId in neuronIdsToImport:
         id = decode_id(neuronId)
-        objPath = fileToImportForNeuron(neuronSources[i], id, parentForDownloadDir, args.swcCapVertexCount, args.swcAxonRadiusFactor, args.swcDendriteRadiusFactor,
-                                        args.skipExisting)
+        if neuronId in neuronIdToObjPath:
+            objPath = neuronIdToObjPath[neuronId]
+        else:
+            objPath = fileToImportForNeuron(neuronSources[i], id, parentForDownloadDir, args.swcCapVertexCount, args.swcAxonRadiusFactor, args.swcDendriteRadiusFactor,
+                                            args.skipExisting, args.swcTube)
 
         timeNow = datetime.datetime.now()
         elapsedSecs = (timeNow - timeStart).total_seconds()
@@ -281,49 +526,48 @@ for i in range(len(neuronSources)):
             missingNeuronObjs.append(neuronId)
             continue
 
-        try:
-            objs0 = bpy.data.objects.keys()
-
-            # Follow the conventions of NeuTu/Neu3:
-            # positive X points right, positive Y points out, positive Z points down.
-            # Note that this is different from the convention in the first FlyEM movies:
-            # positive X pointed down, positive Y pointed right, positive Z pointed out,
-            # implemented with a call like the following:
-            # bpy.ops.import_scene.obj(filepath=objPath, axis_up="Y", axis_forward="X")
-            if bpy.app.version < (4, 0, 0):
-                bpy.ops.import_scene.obj(filepath=objPath, axis_up="Z", axis_forward="Y")
-            else:
-                bpy.ops.wm.obj_import(filepath=objPath, up_axis="Z", forward_axis="Y")
-
-            obj = bpy.context.selected_objects[0]
-            obj.name = "Neuron." + neuronId
+        objPaths.append(objPath)
+        objNames.append("Neuron." + neuronId)
 
-            print("Added object '{}'".format(obj.name))
+    # Import the meshes one file at a time, each created directly through the data API when possible
+    # (see `import_obj`), collecting the files that fail instead of stopping at the first one.
+    for objPath, (objName, obj, error) in zip(objPaths, import_objs(objPaths, objNames)):
+        if error:
+            neuronId = objName[len("Neuron."):]
+            print("\nERROR: cannot import neuron file '{}' for ID {}:\n\n{}".format(objPath, neuronId, str(error)))
+            if args.strict:
+                sys.exit()
+            missingNeuronObjs.append(neuronId)
+            continue
 
-            # Is there a bug in Blender that sometimes adds an extra object when importing?
-            objs1 = bpy.data.objects.keys()
-            extra = [o for o in objs1 if not o in objs0 and o != obj.name]
-            for name in extra:
-                o = bpy.data.objects[name]
-                print("Removing extra object '{}'".format(o.name))
-                bpy.data.objects.remove(o, do_unlink=True)
+        print("Added object '{}'".format(obj.name))
+        trace_count("meshes")
+        trace_count("vertices", len(obj.data.vertices))
 
+        color = getColor(neuronToColorIndex[obj.name], colors)
+        if args.sharedMaterials:
+            # One material for all neurons, reading each neuron's color and alpha from its attributes.
+            if SHARED_NEURON_MATERIAL_NAME in bpy.data.materials:
+                mat = bpy.data.materials[SHARED_NEURON_MATERIAL_NAME]
+            else:
+                mat = newSharedBasicMaterial(SHARED_NEURON_MATERIAL_NAME)
+            setupObjectAttributes(obj, color)
+            matName = mat.name
+        else:
             matName = "Material." + obj.name
-            color = getColor(neuronToColorIndex[obj.name], colors)
             mat = newBasicMaterial(matName, color)
-            obj.data.materials.clear()
-            obj.data.materials.append(mat)
+        obj.data.materials.clear()
+        obj.data.materials.append(mat)
 
-            # Make the object appear transparent in the interactive viewport rendering.
-            obj.show_transparent = True
+        # Make the object appear transparent in the interactive viewport rendering.
+        obj.show_transparent = True
 
-            print("Added material '{}'".format(matName))
+        print("Added material '{}'".format(matName))
 
-        except Exception as e:
-            print("\nERROR: cannot import neuron file '{}' for ID {}:\n\n{}".format(objPath, neuronId, str(e)))
-            if args.strict:
-                sys.exit()
-            missingNeuronObjs.append(neuronId)
+        if args.lodRatios:
+            lodNames = add_lod_meshes(obj, args.lodRatios)
+            if lodNames:
+                print("Added level-of-detail meshes '{}'".format("', '".join(lodNames)))
 
     print("Done")
 
@@ -351,26 +595,36 @@ for i in range(len(neuronSources)):
         bboxCenter, bboxMin, bboxMax = get_bounding_box_np(vertices)
         radius = get_bounding_sphere_np(vertices, bboxCenter)
         meshesSourceIndexToBBox[i] = { "center" : bboxCenter, "min" : bboxMin, "max" : bboxMax, "radius" : radius }
-        addBoundObj("neurons", meshesSourceIndexToBBox[i])
+        if separate or len(separateSourceIndices) == 0:
+            # A main file with separate files too gets its "Bound.neurons" for all the neurons, below.
+            addBoundObj("neurons", meshesSourceIndexToBBox[i])
     else:
         meshesSourceIndexToBBox[i] = retrieveBoundObj("neurons", outputFileSeparate)
 
-    if useSeparateNeuronFiles:
-        separateNeuronFiles.append(outputFileSeparate)
+    if separate:
+        separateNeuronFiles[i] = outputFileSeparate
         if not useExistingSeparate:
             print("Writing file {}...".format(outputFileSeparate))
+            begin_phase("save")
             bpy.ops.wm.save_mainfile(filepath=outputFileSeparate)
+            end_phase()
 
     print("Done")
+end_phase()
 
-if useSeparateNeuronFiles:
+if previousSeparate:
     deleteObjects()
-    if args.split:
-        finish(timeStart, missingNeuronObjs, missingRoiObjs, missingSynapseSetObjs)
-        sys.exit()
+if args.split:
+    finish(timeStart, missingNeuronObjs, missingRoiObjs, missingSynapseSetObjs)
+    sys.exit()
+
+for groupName, partitionSourceIndices in groupToPartitionSourceIndices.items():
+    groupToBBox[groupName] = unionBounds({i: meshesSourceIndexToBBox[i] for i in partitionSourceIndices})
 
 #
 
+begin_phase("rois")
+
 roiExponents = {}
 roiThresholds = {}
 
@@ -423,6 +677,8 @@ if "rois" in jsonData:
         else:
             print("Importing {} ROI meshes for index {}".format(len(roiNames[i]), i))
 
+        objPaths = []
+        objNames = []
         for roiName in roiNames[i]:
             objPath = fileToImportForRoi(roiSources[i], roiName, parentForDownloadDir, args.skipExisting)
             if not objPath or not os.path.isfile(objPath):
@@ -431,28 +687,20 @@ if "rois" in jsonData:
                     sys.exit()
                 missingRoiObjs.append(roiName)
                 continue
+            objPaths.append(objPath)
+            objNames.append("Roi." + roiName)
 
-            try:
-                # Follow the conventions of NeuTu/Neu3:
-                # positive X points right, positive Y points out, positive Z points down.
-                # Note that this is different from the convention in the first FlyEM movies:
-                # positive X pointed down, positive Y pointed right, positive Z pointed out,
-                # implemented with a call like the following:
-                # bpy.ops.import_scene.obj(filepath=objPath, axis_up="Y", axis_forward="X")
-                if bpy.app.version < (4, 0, 0):
-                    bpy.ops.import_scene.obj(filepath=objPath, axis_up="Z", axis_forward="Y")
-                else:
-                    bpy.ops.wm.obj_import(filepath=objPath, up_axis="Z", forward_axis="Y")
-
-                obj = bpy.context.selected_objects[0]
-                obj.name = "Roi." + roiName
-
-                print("Added object '{}'".format(obj.name))
-            except Exception as e:
-                print("\nERROR: cannot import ROI file '{}' for ID {}:\n\n{}".format(objPath, roiName, str(e)))
+        for objPath, (objName, obj, error) in zip(objPaths, import_objs(objPaths, objNames)):
+            if error:
+                roiName = objName[len("Roi."):]
+                print("\nERROR: cannot import ROI file '{}' for ID {}:\n\n{}".format(objPath, roiName, str(error)))
                 if args.strict:
                     sys.exit()
                 missingRoiObjs.append(roiName)
+                continue
+            print("Added object '{}'".format(obj.name))
+            trace_count("meshes")
+            trace_count("vertices", len(obj.data.vertices))
 
 #
 
@@ -486,7 +734,10 @@ for roi in rois:
 
 #
 
+end_phase()
+
 print("Importing synapse meshes...")
+begin_phase("synapses")
 
 if "synapses" in jsonData:
     jsonSynapses = jsonData["synapses"]
@@ -508,21 +759,10 @@ if "synapses" in jsonData:
             continue
 
         try:
-            # Follow the conventions of NeuTu/Neu3:
-            # positive X points right, positive Y points out, positive Z points down.
-            # Note that this is different from the convention in the first FlyEM movies:
-            # positive X pointed down, positive Y pointed right, positive Z pointed out,
-            # implemented with a call like the following:
-            # bpy.ops.import_scene.obj(filepath=objPath, axis_up="Y", axis_forward="X")
-            if bpy.app.version < (4, 0, 0):
-                bpy.ops.import_scene.obj(filepath=objPath, axis_up="Z", axis_forward="Y")
-            else:
-                bpy.ops.wm.obj_import(filepath=objPath, up_axis="Z", forward_axis="Y")
-
-            obj = bpy.context.selected_objects[0]
-            obj.name = "Synapses." + synapseSetName
-
+            obj = import_obj(objPath, "Synapses." + synapseSetName)
             print("Added object '{}'".format(obj.name))
+            trace_count("meshes")
+            trace_count("vertices", len(obj.data.vertices))
         except Exception as e:
             print("\nERROR: cannot import synapse file '{}' for ID {}:\n\n{}".format(objPath, synapseSetName, str(e)))
             if args.strict:
@@ -553,6 +793,7 @@ for synapseSet in synapseSets:
     obj.show_transparent = True
 
 print("Done")
+end_phase()
 
 #
 
@@ -592,25 +833,7 @@ if "synapses" in jsonData:
 
 # Some overall bounds, useful for placing lights.
 
-def unionBounds(boundDataMap):
-    limit = sys.float_info.max
-    bboxMin = [ limit,  limit,  limit]
-    bboxMax = [-limit, -limit, -limit]
-    for (key, data) in boundDataMap.items():
-        for i in range(3):
-            bboxMin[i] = min(bboxMin[i], data["min"][i])
-            bboxMax[i] = max(bboxMax[i], data["max"][i])
-    bboxCenter = [(bboxMin[i] + bboxMax[i]) / 2 for i in range(3)]
-
-    # Approximate the sphere, since the individual vertices are no longer available.
-    radius = 0
-    for (key, data) in boundDataMap.items():
-        offset = (data["center"] - mathutils.Vector(bboxCenter)).length
-        approxRadius = offset + data["radius"]
-        radius = max(radius, approxRadius)
-    return { "center" : bboxCenter, "min" : bboxMin, "max" : bboxMax, "radius" : radius }
-
-if useSeparateNeuronFiles:
+if len(separateSourceIndices) > 0:
     allNeuronsData = unionBounds(meshesSourceIndexToBBox)
 else:
     allNeurons = [o for o in bpy.data.objects if o.name.startswith("Neuron.")]
@@ -632,18 +855,22 @@ print("Done")
 
 #
 
-if useSeparateNeuronFiles:
+if len(separateSourceIndices) > 0:
     print("Adding proxies...")
 
-    for (group, boundData) in groupToBBox.items():
+    def addProxy(name, group, ids, neuronFile, boundData):
         r = boundData["radius"] / 8
         bpy.ops.mesh.primitive_cone_add(vertices=4, radius1=r, depth=2*r)
         proxy = bpy.context.object
-        proxy.name = "Neuron.proxy." + group
+        proxy.name = name
         proxy.location = boundData["center"]
 
-        proxy["ids"] = groupToNeuronIds[group]
-        proxy["neuronFile"] = separateNeuronFiles[groupToMeshesSourceIndex[group]]
+        proxy["ids"] = ids
+        proxy["neuronFile"] = neuronFile
+        proxy["group"] = group
+        # For render.py to cull the proxy when its neurons are out of view.
+        proxy["boundCenter"] = list(boundData["center"])
+        proxy["boundRadius"] = boundData["radius"]
 
         matName = "Material." + proxy.name
         mat = newBasicMaterial(matName)
@@ -651,6 +878,18 @@ if useSeparateNeuronFiles:
         proxy.data.materials.append(mat)
         proxy.show_transparent = True
 
+    for (group, boundData) in groupToBBox.items():
+        if group in groupToPartitionSourceIndices:
+            # A partitioned group has a proxy for each partition, which render.py expands
+            # independently.
+            partitionSourceIndices = groupToPartitionSourceIndices[group]
+            width = len(str(len(partitionSourceIndices) - 1))
+            for k, i in enumerate(partitionSourceIndices):
+                name = "Neuron.proxy.{}.{:0{}}".format(group, k, width)
+                addProxy(name, group, groupToPartitionIds[group][k], separateNeuronFiles[i], meshesSourceIndexToBBox[i])
+        elif useSeparateNeuronFiles:
+            addProxy("Neuron.proxy." + group, group, groupToNeuronIds[group], separateNeuronFiles[groupToMeshesSourceIndex[group]], boundData)
+
     print("Done")
 
 #
@@ -680,6 +919,7 @@ bpy.context.scene.render.resolution_percentage = 100
 bpy.context.scene.render.pixel_aspect_x = 1
 bpy.context.scene.render.pixel_aspect_y = 1
 
+begin_phase("save")
 if bpy.app.version < (3, 1, 0):
     print("Writing {}".format(outputFile))
     bpy.ops.wm.save_as_mainfile(filepath=outputFile)
@@ -687,5 +927,6 @@ else:
     outputAbsPath = os.path.join(os.getcwd(), outputFile)
     print("Writing {}".format(outputAbsPath))
     bpy.ops.wm.save_as_mainfile(filepath=outputAbsPath)
+end_phase()
 
 finish(timeStart, missingNeuronObjs, missingRoiObjs, missingSynapseSetObjs)
@@ -0,0 +1,254 @@
+# Runs importMeshes.py as several local Blender processes, each building some of the separate
+# .blend files for neurons (with `--split i n`), followed by a final importMeshes.py run that
+# reuses those files, gathers their bounds, and adds the ROIs, synapses and proxies.  With
+# `--chunkTriangles`, a first importMeshes.py run partitions the large neuron groups, and all the
+# other runs use its partitions.
+
+# Can be run in two ways:
+# $ blender --background --python parallelImportMeshes.py -- -i movieScript.json etc
+# Or:
+# $ python parallelImportMeshes.py --blender /path/to/blender -i movieScript.json etc
+# Arguments not recognized by this script are passed to importMeshes.py.
+
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsGeneral import report_version
+from utilsJson import guess_extraneous_comma, parseNeuronsIds, removeComments
+from utilsParallel import make_blender_cmd, read_log_tail, run_workers
+
+# Matches the progress lines printed by importMeshes.py, like "3: 120 / 2000 (15.21 secs)".
+PROGRESS_LINE = re.compile(r"^(\d+): (\d+) / (\d+) ")
+
+def get_available_memory():
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def get_worker_count(worker_memory_gb):
+    cores = os.cpu_count() or 1
+    memory = get_available_memory()
+    if not memory or not worker_memory_gb:
+        return cores
+    by_memory = int(memory / (worker_memory_gb * 1024**3))
+    return max(1, min(cores, by_memory))
+
+def get_import_args(unused_args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputJson", "-ij", "-i", dest="input_json_file", required=True, help="path to the JSON file describing the input")
+    parser.add_argument("--output", "-o", dest="output_file", help="path for the output .blend file")
+    parser.add_argument("--skipExisting", "-sk", dest="skip_existing", action="store_true")
+    parser.add_argument("--split", "-sp", dest="split", nargs="*", type=int)
+    parser.add_argument("--report", "-rp", dest="report_file")
+    parser.set_defaults(chunk_triangles=0)
+    parser.add_argument("--chunkTriangles", "-ct", dest="chunk_triangles", type=int)
+    parser.add_argument("--partitionFile", "-pf", dest="partition_file")
+    parser.add_argument("--partitionOnly", "-po", dest="partition_only", action="store_true")
+    args, _ = parser.parse_known_args(unused_args)
+    return args
+
+def get_separate_source_count(input_json_file):
+    try:
+        json_data = json.loads(removeComments(input_json_file))
+    except json.JSONDecodeError as exc:
+        print("Error reading JSON, line {}, column {}: {}".format(exc.lineno, exc.colno, exc.msg))
+        guess_extraneous_comma(input_json_file)
+        sys.exit()
+    if not "neurons" in json_data:
+        return 0
+    json_neurons = json_data["neurons"]
+    _, _, _, use_separate_neuron_files = parseNeuronsIds(json_neurons)
+    if not use_separate_neuron_files or not "source" in json_neurons:
+        return 0
+    # There is a separate file for each source.
+    source = json_neurons["source"]
+    return len(source) if isinstance(source, list) else 1
+
+def get_partition_count(partition_file):
+    try:
+        with open(partition_file) as f:
+            partitions = json.load(f)["partitions"]
+    except (OSError, KeyError, json.JSONDecodeError) as e:
+        print(f"Error: cannot read partition file '{partition_file}': {str(e)}")
+        sys.exit()
+    return sum([len(part_ids) for part_ids in partitions.values()])
+
+def make_import_cmd(blender_exe, unused_args, extra_args):
+    neuVid_dir = os.path.dirname(os.path.realpath(__file__))
+    import_script = os.path.join(neuVid_dir, "importMeshes.py")
+    return make_blender_cmd(blender_exe, import_script, unused_args, extra_args)
+
+def get_progress(log_path):
+    for line in reversed(read_log_tail(log_path)):
+        match = PROGRESS_LINE.match(line)
+        if match:
+            source, j, n = match.groups()
+            return f"source {source}: {j} / {n}"
+    return None
+
+def read_reports(report_paths):
+    missing = {"missingNeurons": [], "missingRois": [], "missingSynapses": []}
+    for path in report_paths:
+        if not os.path.exists(path):
+            print(f"Warning: missing report '{path}'")
+            continue
+        with open(path) as f:
+            report = json.load(f)
+        for key in missing.keys():
+            for x in report.get(key, []):
+                if not x in missing[key]:
+                    missing[key].append(x)
+    return missing
+
+def print_missing(missing):
+    if len(missing["missingNeurons"]) > 0:
+        print()
+        print("ERROR: could not download/find mesh .obj files for the following neurons:")
+        print([int(x) if x.isnumeric() else x for x in missing["missingNeurons"]])
+    if len(missing["missingRois"]) > 0:
+        print()
+        print("ERROR: could not download/find mesh .obj files for the following rois:")
+        print(missing["missingRois"])
+    if len(missing["missingSynapses"]) > 0:
+        print()
+        print("ERROR: could not find mesh .obj files for the following synapses:")
+        for x in missing["missingSynapses"]:
+            print(x)
+
+if __name__ == "__main__":
+    report_version()
+
+    argv = sys.argv
+    if "--" in argv:
+        # Running as `blender --background --python parallelImportMeshes.py -- <more arguments>`
+        blender_exe = sys.argv[0]
+        argv = argv[argv.index("--") + 1:]
+    else:
+        # Running as `python parallelImportMeshes.py <more arguments>`
+        blender_exe = "blender"
+        argv = argv[1:]
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(blender=None)
+    parser.add_argument("--blender", "-b", help="path to the Blender executable (default: the running Blender, or 'blender')")
+    parser.set_defaults(workers=None)
+    parser.add_argument("--workers", "-w", type=int, help="number of Blender processes at once (default: based on CPU cores and memory)")
+    parser.set_defaults(worker_memory=4)
+    parser.add_argument("--workermemory", "-wm", dest="worker_memory", type=float, help="memory in GB to assume for each Blender process, for the default worker count")
+    parser.set_defaults(splits=None)
+    parser.add_argument("--splits", "-ns", type=int, help="number of splits of the separate files (default: the worker count)")
+    parser.set_defaults(keep_logs=False)
+    parser.add_argument("--keeplogs", "-kl", dest="keep_logs", action="store_true", help="keep the log files of the split runs that succeeded")
+    args, unused_args = parser.parse_known_args(argv)
+
+    if args.blender:
+        blender_exe = args.blender
+    import_args = get_import_args(unused_args)
+    if import_args.split:
+        print("Error: do not use `--split`, which is set for each importMeshes.py run")
+        sys.exit()
+    if import_args.report_file:
+        print("Error: do not use `--report`, which is set for each importMeshes.py run")
+        sys.exit()
+    if import_args.partition_file or import_args.partition_only:
+        print("Error: do not use `--partitionFile` or `--partitionOnly`, which are set for the importMeshes.py runs")
+        sys.exit()
+
+    workers = args.workers if args.workers else get_worker_count(args.worker_memory)
+    splits = args.splits if args.splits else workers
+
+    output_file = import_args.output_file
+    if not output_file:
+        output_file = os.path.splitext(import_args.input_json_file)[0] + ".blend"
+    output_root = os.path.splitext(output_file)[0]
+
+    print(f"Using Blender executable: {blender_exe}")
+    print(f"Using worker count: {workers}")
+    print(f"Using importMeshes.py arguments: {' '.join(unused_args)}")
+
+    time_start = datetime.datetime.now()
+
+    report_dir = tempfile.mkdtemp()
+    report_paths = []
+
+    # The separate files are the JSON's sources with `"separate": true`, plus any partitions.
+    separate_count = get_separate_source_count(import_args.input_json_file)
+    partition_args = []
+    partition_log_paths = []
+    if import_args.chunk_triangles > 0:
+        # Partition once, before the split runs, so they all agree on the neurons in each separate file
+        # and do not download and scan the same mesh files at the same time.
+        print("Running the importMeshes.py pass to partition large neuron groups...")
+        partition_file = os.path.join(report_dir, "partitions.json")
+        partition_args = ["--partitionFile", partition_file]
+        partition_log_paths = [f"{output_root}_import_partition_log.txt"]
+        cmd = make_import_cmd(blender_exe, unused_args, partition_args + ["--partitionOnly"])
+        failed = run_workers([cmd], ["partition pass"], partition_log_paths, 1, get_progress)
+        if len(failed) > 0 or not os.path.exists(partition_file):
+            print("Error: the partition pass failed")
+            sys.exit()
+        separate_count += get_partition_count(partition_file)
+
+    if separate_count == 0:
+        print("No separate .blend files for neurons, so running just one importMeshes.py")
+        splits = 0
+    else:
+        splits = min(splits, separate_count)
+    print(f"Using split count: {splits}")
+
+    cmds = []
+    names = []
+    log_paths = []
+    for i in range(splits):
+        report_path = os.path.join(report_dir, f"split_{i + 1}.json")
+        report_paths.append(report_path)
+        cmds.append(make_import_cmd(blender_exe, unused_args, ["--split", str(i + 1), str(splits), "--report", report_path] + partition_args))
+        names.append(f"split {i + 1} of {splits}")
+        log_paths.append(f"{output_root}_import_{i + 1}_of_{splits}_log.txt")
+    failed = run_workers(cmds, names, log_paths, workers, get_progress)
+
+    if len(failed) > 0:
+        print(f"Error: {len(failed)} of {splits} splits failed, so skipping the final pass")
+        sys.exit()
+
+    # The final pass reuses the separate files, appending their "Bound.*" objects to get the bounds.
+    print("Running the final importMeshes.py pass...")
+    report_path = os.path.join(report_dir, "final.json")
+    report_paths.append(report_path)
+    final_args = ["--report", report_path] + partition_args
+    if splits > 0 and not import_args.skip_existing:
+        final_args.append("--skipExisting")
+    final_log_path = f"{output_root}_import_final_log.txt"
+    failed = run_workers([make_import_cmd(blender_exe, unused_args, final_args)], ["final pass"], [final_log_path], 1, get_progress)
+
+    if len(failed) > 0:
+        print("Error: the final pass failed")
+        sys.exit()
+
+    missing = read_reports(report_paths)
+    print_missing(missing)
+
+    if not args.keep_logs:
+        for path in partition_log_paths + log_paths + [final_log_path]:
+            os.remove(path)
+    for path in report_paths + partition_args[1:]:
+        if os.path.exists(path):
+            os.remove(path)
+    os.rmdir(report_dir)
+
+    time_end = datetime.datetime.now()
+    print()
+    print("Importing started at {}".format(time_start))
+    print("Importing ended at {}".format(time_end))
+    print("Elapsed time: {}".format(time_end - time_start))
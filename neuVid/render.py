@@ -7,21 +7,36 @@
 
 import argparse
 import bpy
+from bpy_extras.object_utils import world_to_camera_view
+import csv
 import datetime
 import json
 import math
 import mathutils
+import numpy as np
 import os
 import os.path
 import platform
+import re
 import shutil
 import sys
 import tempfile
+import time
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsEncode import encode_frame_entries, find_ffmpeg
+from utilsFrames import FrameIndex, write_motion_frames
 from utilsGeneral import newObject, report_version
-from utilsMaterials import insertMaterialKeyframe, getMaterialFcurve, getMaterialValue, setMaterialValue
+from utilsImages import to_uint8, write_png
+from utilsMeshes import choose_lod, set_lod_mesh
+from utilsTrace import begin_phase, end_phase, end_trace, peak_rss_mb, start_trace, trace_count
+from utilsMaterials import getMaterialFcurve, getMaterialValue, setMaterialValue
+from utilsMaterials import SHARED_NEURON_MATERIAL_NAME, OBJECT_ATTRIBUTES, getObjectFcurve, insertObjectKeyframe, setObjectValue, usesObjectAttributes
 from utilsJson import guess_extraneous_comma, parseFov, removeComments
+from utilsManifest import ManifestWriter, frame_path
+from utilsIntervals import DEFAULT_SAMPLES_POLICY, addRestIntervals, addSamplesPerInterval, choosePreviewFrames, clipRenderIntervals, estimateRenderCost
+from utilsIntervals import findFadingIntervals, findHideRenderFrames, findHideRenderTrueFrames, findRenderIntervals, hideRenderTrueAtFrame
+from utilsIntervals import keysChangeBetween, keysChangeFrames, keysFromFcurve, parseSamplesPolicy, previewFrameCounts, splitRenderIntervals
 
 USE_OPTIX1 = "--optix"
 USE_OPTIX2 = "-optix"
@@ -94,9 +109,11 @@ parser.add_argument(USE_PERSISTENT_DATA1, USE_PERSISTENT_DATA2, dest="usePersist
 parser.set_defaults(threads=None)
 parser.add_argument("--threads", "-t", dest="threads", type=int, help="thread count for Cycles (default: let Cycles choose)")
 
-parser.add_argument("--samples", "-sa", type=int, dest="numSamples", help="number of samples per pixel for the Octane renderer")
+parser.add_argument("--samples", "-sa", type=int, dest="numSamples", help="number of samples per pixel for Octane, Cycles and Eevee, and the starting count for the Cycles samplesPolicy")
 parser.set_defaults(denoise=True)
 parser.add_argument("--nodenoise", "-ndn", dest="denoise", action="store_false", help="skip final denoising")
+parser.set_defaults(denoiseLater=False)
+parser.add_argument("--denoiseLater", "-dnl", dest="denoiseLater", action="store_true", help="skip denoising, and write EXR frames with the albedo and normal passes for denoiseFrames.py")
 parser.set_defaults(filterSizeFactor=1.0)
 parser.add_argument("--filter", "-f", type=float, dest="filterSizeFactor", help="filter size factor")
 parser.set_defaults(onlyAmbient=False)
@@ -112,6 +129,34 @@ parser.add_argument("--resY", "-ry", type=int, dest="resY", help="output image Y
 parser.set_defaults(skipExisting=False)
 parser.add_argument("--skipExisting", "-sk", dest="skipExisting", action="store_true", help="skip existing frames, already rendered")
 
+parser.set_defaults(cull=False)
+parser.add_argument("--cull", "-cu", dest="cull", action="store_true", help="hide neurons outside the camera's view for a whole render interval")
+parser.set_defaults(cullStep=5)
+parser.add_argument("--cullStep", "-cs", type=int, dest="cullStep", help="frames between the camera positions tested for culling")
+parser.set_defaults(statsLog=None)
+parser.add_argument("--statsLog", "-sl", dest="statsLog", help="path for a log of per-frame render statistics (.csv or .jsonl)")
+parser.set_defaults(manifest=False)
+parser.add_argument("--manifest", "-mf", dest="manifest", action="store_true", help="list each frame in the output directory's manifest.jsonl when complete, for streamFrames.py")
+parser.set_defaults(regions=False)
+parser.add_argument("--regions", "-rg", dest="regions", action="store_true", help="with a static camera, rerender only the screen region of the changing objects")
+parser.set_defaults(regionMaxArea=0.5)
+parser.add_argument("--regionMaxArea", "-rma", type=float, dest="regionMaxArea", help="largest fraction of the image for --regions to apply")
+parser.set_defaults(regionMargin=16)
+parser.add_argument("--regionMargin", "-rm", type=int, dest="regionMargin", help="pixels added around the changing objects for --regions")
+parser.set_defaults(preview=False)
+parser.add_argument("--preview", "-pv", dest="preview", action="store_true", help="render a quick, low-quality preview movie, interpolating most frames")
+parser.set_defaults(previewScale=0.25)
+parser.add_argument("--previewScale", "-ps", type=float, dest="previewScale", help="fraction of the resolution for --preview")
+parser.set_defaults(previewSamples=8)
+parser.add_argument("--previewSamples", "-psa", type=int, dest="previewSamples", help="samples per pixel for --preview")
+parser.set_defaults(previewStep=12)
+parser.add_argument("--previewStep", "-pst", type=int, dest="previewStep", help="most frames between rendered frames for --preview")
+parser.set_defaults(ffmpeg=None)
+parser.add_argument("--ffmpeg", dest="ffmpeg", help="path to the ffmpeg executable for --preview (default: ffmpeg from the PATH)")
+# A value of 0 means always use the full meshes, ignoring level-of-detail meshes from `importMeshes.py --lodRatios`.
+parser.set_defaults(lodPixels=400)
+parser.add_argument("--lodPixels", "-lp", type=float, dest="lodPixels", help="screen diameter (pixels) of a neuron needing its full-detail mesh")
+
 # TODO: Improve on this temporary solution for data sets (e.g., FAFB) that have unit that are orders of magnitude different
 # from the original FlyEM units.
 parser.set_defaults(rescaleFactor=1.0)
@@ -133,13 +178,42 @@ print("Using fps: {}".format(bpy.context.scene.render.fps))
 if args.skipExisting:
     print("Skipping rerendering of existing frames")
 
+if args.preview:
+    if args.useOctane:
+        print("Error: --preview is not supported with --octane")
+        sys.exit()
+    if args.previewScale <= 0 or args.previewScale > 1 or args.previewStep < 1:
+        print("Error: --previewScale must be in (0, 1] and --previewStep must be at least 1")
+        sys.exit()
+    if args.step != None or args.manifest:
+        print("Error: --preview does not support --frame-jump (use --previewStep) or --manifest")
+        sys.exit()
+    # A lower resolution also makes chooseLods use coarser level-of-detail meshes, if any.
+    # Even sizes suit the H.264 encoding of the preview movie.
+    args.resX = max(2, 2 * round(args.resX * args.previewScale / 2))
+    args.resY = max(2, 2 * round(args.resY * args.previewScale / 2))
+    args.numSamples = args.previewSamples
+    args.willComp = False
+    print("Rendering preview: {} samples per pixel, at most {} frames between rendered frames".format(args.numSamples, args.previewStep))
+
+if args.denoiseLater:
+    if args.useOctane or not args.useCycles or args.doRois or args.preview or bpy.app.version < (2, 81, 0):
+        print("Error: --denoiseLater requires Cycles and Blender 2.81 or later, without --roi or --preview")
+        sys.exit()
+    args.denoise = False
+
+if args.regions:
+    if args.useOctane or args.preview or args.step != None or bpy.app.version < (2, 83, 0):
+        print("Error: --regions requires Cycles or Eevee and Blender 2.83 or later, without --preview or --frame-jump")
+        sys.exit()
+
 if args.output != None:
     output = args.output
 else:
     input = args.inputJsonFile
     if not input:
         input = args.inputBlenderFile
-    output = os.path.splitext(input)[0] + "-frames"
+    output = os.path.splitext(input)[0] + ("-preview" if args.preview else "-frames")
 
     # Necesary in some cases on Windows.
     output = os.path.abspath(output)
@@ -156,6 +230,9 @@ if args.useOctane or args.doRois:
 if not args.willComp:
     willComp = False
 print("Rendering for compositing: {}".format(willComp))
+if args.regions and (willComp or args.denoiseLater):
+    print("Error: --regions requires PNG output (--nocomp, and not --denoiseLater)")
+    sys.exit()
 
 print("Input JSON file: {}".format(args.inputJsonFile))
 
@@ -168,7 +245,11 @@ if inputBlenderFile == None:
         quit()
 print("Opening input Blender file '{}'...".format(inputBlenderFile))
 
+start_trace("render")
+
+begin_phase("open")
 bpy.ops.wm.open_mainfile(filepath=inputBlenderFile)
+end_phase()
 
 timeEndOpen = datetime.datetime.now()
 print("Done (elapsed time: {:.2f} sec)".format((timeEndOpen - timeStart).total_seconds()))
@@ -176,10 +257,10 @@ print("Done (elapsed time: {:.2f} sec)".format((timeEndOpen - timeStart).total_s
 print("Using output width: {} px".format(args.resX))
 print("Using output height: {} px".format(args.resY))
 
-useSeparateNeuronFiles = False
-if any(map(lambda x: x.name.startswith("Neuron"), bpy.data.objects)):
-    useSeparateNeuronFiles = all(map(lambda x: not x.name.startswith("Neuron") or
-        x.name.startswith("Neuron.proxy"), bpy.data.objects))
+# Neurons in separate files are represented by proxies.  There may also be neurons in the main file,
+# for the groups not partitioned by `importMeshes.py --chunkTriangles`.
+useSeparateNeuronFiles = any(map(lambda x: x.name.startswith("Neuron.proxy"), bpy.data.objects))
+mainNeuronNames = set([o.name for o in bpy.data.objects if o.name.startswith("Neuron.") and not o.name.startswith("Neuron.proxy")])
 
 hasSynapses = any(map(lambda x: x.name.startswith("Synapses."), bpy.data.objects))
 
@@ -194,6 +275,7 @@ jsonUseSpecular = True
 jsonLightRotationZ = 0.0
 jsonLightRotationY = 0.0
 jsonLightRotationX = 0.0
+jsonSamplesPolicy = None
 
 if args.inputJsonFile:
     try:
@@ -230,6 +312,9 @@ if args.inputJsonFile:
     if "lightRotationX" in jsonData:
         jsonLightRotationX = jsonData["lightRotationX"]
         print("Using lightRotationX: {}".format(jsonLightRotationX))
+    if "samplesPolicy" in jsonData:
+        jsonSamplesPolicy = parseSamplesPolicy(jsonData["samplesPolicy"])
+        print("Using samplesPolicy: {}".format(jsonSamplesPolicy))
 
 if args.white and not useOctane:
     print("Using white background")
@@ -239,9 +324,14 @@ if args.white and not useOctane:
 print("Rescaling/recentering to improve numerical precision...")
 
 timeStartRescale = datetime.datetime.now()
+begin_phase("rescale")
 
 def rescaleRecenter(obj, overallCenter, overallScale):
     if obj.name.startswith("Neuron.") or obj.name.startswith("Roi.") or obj.name.startswith("Synapses."):
+        if "boundRadius" in obj.keys():
+            # The bounding sphere of the neurons a proxy represents, for culling.
+            obj["boundCenter"] = (mathutils.Vector(obj["boundCenter"]) - overallCenter) * overallScale
+            obj["boundRadius"] *= overallScale
         # Meshes for neurons and ROIs have location at the origin and
         # world position in the vertex coordinates.
         for vert in obj.data.vertices:
@@ -305,6 +395,11 @@ print("Using overall scale: {}".format(overallScale))
 if args.doRois:
     useOctane = False
 
+useSharedMaterials = SHARED_NEURON_MATERIAL_NAME in bpy.data.materials
+if useOctane and useSharedMaterials:
+    print("Error: Octane rendering does not support shared materials (from `importMeshes.py --sharedMaterials`)")
+    sys.exit()
+
 if useOctane:
     # For a test cube, this change to `ray_epsilon` eliminated ringing.
     bpy.data.scenes["Scene"].octane.ray_epsilon *= 10
@@ -325,6 +420,10 @@ print("Rescaled/recentered camera clip_end: {}".format(camera.clip_end))
 
 timeEndRescale = datetime.datetime.now()
 print("Done (elapsed time: {:.2f} sec)".format((timeEndRescale - timeStartRescale).total_seconds()))
+end_phase()
+
+# Everything else before the rendering: materials, lights, render intervals, etc.
+begin_phase("setup")
 
 #
 
@@ -388,8 +487,12 @@ def addOctaneMaterial(obj, animMat=None):
 
 def copyToCyclesMaterial(obj, animMat):
     matName = "Material." + obj.name
-    mat = bpy.data.materials[matName]
-    mat.cycles.use_transparent_shadow = True
+    if matName in bpy.data.materials:
+        mat = bpy.data.materials[matName]
+        mat.cycles.use_transparent_shadow = True
+    elif obj.active_material:
+        # The shared material, appended along with the object.
+        obj.active_material.cycles.use_transparent_shadow = True
     alphaFcurves = []
     if "alpha-fcurves" in animMat:
         key = obj.name.split(".")[1]
@@ -401,8 +504,8 @@ def copyToCyclesMaterial(obj, animMat):
         for i in range(len(keyframes)):
             alphaFcurves.append((keyframes[i].co[1], keyframes[i].co[0]))
     for v, f in alphaFcurves:
-        setMaterialValue(mat, "alpha", v)
-        insertMaterialKeyframe(mat, "alpha", f)
+        setObjectValue(obj, "alpha", v)
+        insertObjectKeyframe(obj, "alpha", f)
 
 if args.doRois:
     for obj in bpy.data.objects:
@@ -440,7 +543,7 @@ else:
                     mat = bpy.data.materials[matName]
                     bpy.data.materials.remove(mat, do_unlink=True)
                 bpy.data.objects.remove(obj, do_unlink=True)
-            elif obj.name.startswith("Neuron.") and not useSeparateNeuronFiles:
+            elif obj.name in mainNeuronNames:
                 addOctaneMaterial(obj)
         print("Done")
     else:
@@ -450,6 +553,8 @@ else:
                 if matName in bpy.data.materials:
                     mat = bpy.data.materials[matName]
                     mat.cycles.use_transparent_shadow = True
+            if useSharedMaterials:
+                bpy.data.materials[SHARED_NEURON_MATERIAL_NAME].cycles.use_transparent_shadow = True
             # With the default transparent_max_bounces (8), some complex scenes with many bodies having alpha below one
             # max have black patches, when the maximum is reached too soon.  So raise the maximum.
             bpy.data.scenes["Scene"].cycles.transparent_max_bounces = args.transparentMaxBounces
@@ -465,8 +570,10 @@ else:
                 bpy.data.scenes["Scene"].eevee.use_soft_shadows = jsonUseShadows
                 bpy.data.scenes["Scene"].eevee.use_shadow_high_bitdepth = True
         print("Updating Blender materials...")
+        if useSharedMaterials and not jsonUseSpecular:
+            setMaterialValue(bpy.data.materials[SHARED_NEURON_MATERIAL_NAME], "specular_intensity", 0)
         for obj in bpy.data.objects:
-            if obj.name.startswith("Neuron.") and not useSeparateNeuronFiles:
+            if obj.name in mainNeuronNames:
                 matName = "Material." + obj.name
                 if matName in bpy.data.materials:
                     mat = bpy.data.materials[matName]
@@ -789,6 +896,10 @@ elif args.useCycles:
 
         compNode = compNodes["Composite"]
         compLinks.new(denoiseNode.outputs["Image"], compNode.inputs["Image"])
+    elif args.denoiseLater:
+        # The noisy image, and the passes that guide the denoising by denoiseFrames.py.
+        bpy.context.scene.cycles.use_denoising = False
+        bpy.context.view_layer.cycles.denoising_store_passes = True
 
 if willComp:
     # Save depth with the output image
@@ -812,6 +923,9 @@ if willComp:
         bpy.context.scene.world.mist_settings.start = 0
         bpy.context.scene.world.mist_settings.depth = camera.clip_end
         bpy.context.scene.render.image_settings.color_depth = '32'
+elif args.denoiseLater:
+    bpy.context.scene.render.image_settings.file_format = "OPEN_EXR_MULTILAYER"
+    bpy.context.scene.render.image_settings.color_depth = '32'
 else:
     bpy.context.scene.render.image_settings.file_format = "PNG"
 
@@ -853,34 +967,23 @@ def getMaterialFcurves():
 
     return result
 
-def addRestIntervals(namesAndFcurves):
+# Fcurves for the "alpha" and "diffuse_color" of objects using shared materials.
+def getObjectAttributeFcurves():
+    result = []
+    for obj in bpy.data.objects:
+        if usesObjectAttributes(obj):
+            for data_path in OBJECT_ATTRIBUTES:
+                fc = getObjectFcurve(obj, data_path)
+                if fc:
+                    result.append((obj.name, fc))
+    return result
+
+def addFcurveRestIntervals(namesAndFcurves):
     global restIntervals, numCurves
     for name, fc in namesAndFcurves:
         numCurves += 1
         id = name + "." + fc.data_path + "." + str(fc.array_index)
-        fStart = 1
-        # The value for the first resting interval is not known until the first key,
-        # with its value.
-        vStart = None
-        fEnd = None
-        for key in fc.keyframe_points:
-            f = int(key.co[0])
-            v = key.co[1]
-            if (vStart == None or v == vStart) and f != fStart:
-                # The first key define the value of the first resting interval.
-                vStart = v
-                fEnd = f
-            else:
-                if fEnd:
-                    restIntervals.append((fStart, "s", id))
-                    restIntervals.append((fEnd, "e", id))
-                vStart = v
-                fStart = f
-                fEnd = None
-        fEnd = bpy.data.scenes["Scene"].frame_end
-        if fStart != fEnd:
-            restIntervals.append((fStart, "s", id))
-            restIntervals.append((fEnd, "e", id))
+        addRestIntervals(restIntervals, id, keysFromFcurve(fc), bpy.data.scenes["Scene"].frame_end)
 
 def addTextureRestIntervals():
     global restIntervals, numCurves
@@ -907,36 +1010,13 @@ def addTextureRestIntervals():
         restIntervals.append((iu.frame_start + iu.frame_duration, "s", id))
         restIntervals.append((bpy.data.scenes["Scene"].frame_end, "e", id))
 
-addRestIntervals(getObjectFcurves())
-addRestIntervals(getMaterialFcurves())
+addFcurveRestIntervals(getObjectFcurves())
+addFcurveRestIntervals(getMaterialFcurves())
+addFcurveRestIntervals(getObjectAttributeFcurves())
 addTextureRestIntervals()
-restIntervals.sort()
 
-restingCurves = set()
-renderIntervals = []
-fStartRendering = bpy.data.scenes["Scene"].frame_start
-allResting = False
-
-for pt in restIntervals:
-    if pt[1] == "s":
-        restingCurves.add(pt[2])
-    else:
-        restingCurves.remove(pt[2])
-    if len(restingCurves) == numCurves:
-        allResting = True
-        fEndRendering = pt[0] + 1
-        renderIntervals.append((fStartRendering, fEndRendering))
-    elif allResting:
-        allResting = False
-        fStartRendering = pt[0] - 1
-
-if fStartRendering < bpy.data.scenes["Scene"].frame_end:
-    fEndRendering = bpy.data.scenes["Scene"].frame_end
-    renderIntervals.append((fStartRendering, fEndRendering))
-
-# If there is no animation, add an interval anyway, or nothing will render.
-if len(renderIntervals) == 0:
-    renderIntervals.append((1, 1))
+renderIntervals = findRenderIntervals(restIntervals, numCurves, bpy.data.scenes["Scene"].frame_start,
+    bpy.data.scenes["Scene"].frame_end)
 
 fStartOverall = bpy.data.scenes["Scene"].frame_start
 if args.start != None:
@@ -949,165 +1029,33 @@ if args.end != None:
 if args.step != None:
     bpy.context.scene.frame_step = args.step
 
-renderIntervalsClipped = []
-for ri in renderIntervals:
-    fStart = int(ri[0])
-    fEnd = int(ri[1])
-
-    if fEnd < fStartOverall:
-        continue
-    if fEndOverall < fStart:
-        break
-    if fStart < fStartOverall and fStartOverall < fEnd:
-        fStart = fStartOverall
-    if fStart <= fEndOverall and fEndOverall < fEnd:
-        fEnd = fEndOverall
-
-    renderIntervalsClipped.append((fStart, fEnd))
-
-# TODO: There is a problem if fStartOverall is bewteen render intervals:
-# we need to render one frame at the end of the preceding render interval,
-# then copy.  The following is only a partial fix.
-if len(renderIntervalsClipped) == 0:
-    renderIntervalsClipped.append((fStartOverall, fEndOverall))
-
-def findHideRenderFrames(materials):
-    hideRenderAtFrame = {}
-    for mat in materials:
+renderIntervalsClipped = clipRenderIntervals(renderIntervals, fStartOverall, fEndOverall)
+
+# The objects' names and their alpha fcurves' keys, from their own materials or their attributes.
+def getAlphaKeys():
+    result = []
+    for mat in bpy.data.materials:
         name = mat.name[mat.name.find(".")+1:]
         fc = getMaterialFcurve(mat, "alpha")
-        if fc:
-            # Go through the keys, looking for keys i and i+1 both setting alpha to 0
-            # and i+2 setting alpha > 0.  Then hideRenderAtFrame is True for the
-            # key i's frame (fStartHidden), and  False for key i+1's frame (fAlpha0).
-            fAlpha0 = None
-            fStartHidden = None
-            firstKey = True
-            for key in fc.keyframe_points:
-                f = int(key.co[0])
-                v = key.co[1]
-                if v == 0.0:
-                    if not fStartHidden:
-                        if firstKey:
-                            fStartHidden = 1
-                        else:
-                            fStartHidden = f
-                    fAlpha0 = f
-                else:
-                    if fStartHidden and fAlpha0 and fStartHidden < fAlpha0:
-                        if not fStartHidden in hideRenderAtFrame:
-                            hideRenderAtFrame[fStartHidden] = []
-                        hideRenderAtFrame[fStartHidden].append((name, True))
-                        if not fAlpha0 in hideRenderAtFrame:
-                            hideRenderAtFrame[fAlpha0] = []
-                        hideRenderAtFrame[fAlpha0].append((name, False))
-                    elif firstKey:
-                        if not 1 in hideRenderAtFrame:
-                            hideRenderAtFrame[1] = []
-                        hideRenderAtFrame[1].append((name, False))
-                    fAlpha0 = None
-                    fStartHidden = None
-                firstKey = False
-            if fStartHidden != None:
-                if not fStartHidden in hideRenderAtFrame:
-                    hideRenderAtFrame[fStartHidden] = []
-                hideRenderAtFrame[fStartHidden].append((name, True))
-    return hideRenderAtFrame
-
-def hideRenderTrueAtFrame(f, hideRenderTrueFrames):
-    hrtfPrev = None
-    for hrtf in hideRenderTrueFrames:
-        if f == hrtf[0]:
-            return hrtf[1]
-        elif f < hrtf[0] and hrtfPrev:
-            return hrtfPrev[1]
-        hrtfPrev = hrtf
-    return []
+        result.append((name, keysFromFcurve(fc) if fc else None))
+    for obj in bpy.data.objects:
+        if usesObjectAttributes(obj):
+            fc = getObjectFcurve(obj, "alpha")
+            result.append((obj.name, keysFromFcurve(fc) if fc else None))
+    return result
 
 hideRenderTrueFrames = []
 
 if not args.doRois:
-    hideRenderChangesAtFrame = findHideRenderFrames(bpy.data.materials)
-
-    # Sorted list of keys, i.e., the frame numbers at which hide_render must change.
-    hideRenderFramesSorted = sorted(hideRenderChangesAtFrame)
+    hideRenderChangesAtFrame = findHideRenderFrames(getAlphaKeys())
 
     # Make sure that renderIntervalsClipped has a new interval starting at each
     # frame where hide_render must change.
-    i = 0
-    while i < len(renderIntervalsClipped):
-        ri = renderIntervalsClipped[i]
-        fStart = int(ri[0])
-        fEnd = int(ri[1])
-        for f in hideRenderFramesSorted:
-            if fStart < f and f < fEnd:
-                renderIntervalsClipped[i] = (fStart, f - 1)
-                renderIntervalsClipped.insert(i + 1, (f, fEnd))
-                break
-        i += 1
+    renderIntervalsClipped = splitRenderIntervals(renderIntervalsClipped, sorted(hideRenderChangesAtFrame))
 
     # Make hideRenderTrueFrames[(f, s)] be the set of objects, s, to be given hide_render = True
     # at frame f.
-    hideRenderTrueFrames = []
-    hideRenderTrue = set()
-    for f in hideRenderFramesSorted:
-        pairs = hideRenderChangesAtFrame[f]
-        for pair in pairs:
-            if pair[1]:
-                hideRenderTrue.add(pair[0])
-            elif pair[0] in hideRenderTrue:
-                hideRenderTrue.remove(pair[0])
-        hideRenderTrueFrames.append((f, hideRenderTrue.copy()))
-
-    # Put a sentinel at the last frame of the animation, to simplfy the rendering
-    # of intervals.
-    hideRenderTrueFrames.append((bpy.context.scene.frame_end, hideRenderTrue.copy()))
-
-    hideRenderTrueFrames.sort()
-
-def findFadingIntervals(hideRenderTrueFrames):
-    fadingIntervalsRaw = []
-    for mat in bpy.data.materials:
-        fc = getMaterialFcurve(mat, "alpha")
-        if fc:
-            fPrev = None
-            vPrev = None
-            for key in fc.keyframe_points:
-                f = int(key.co[0])
-                v = key.co[1]
-                if vPrev != None:
-                    if (vPrev == 0 and v > 0) or (vPrev > 0 and v == 0):
-                        fadingIntervalsRaw.append((fPrev, f))
-                fPrev = f
-                vPrev = v
-    fadingIntervalsRaw.sort()
-    fadingIntervals = []
-    fStart = None
-    fEnd = None
-    n = 0
-    for i in range(len(fadingIntervalsRaw)):
-        fi = fadingIntervalsRaw[i]
-        if not fStart:
-            fStart = fi[0]
-            fEnd = fi[1]
-        else:
-            if fi[0] == fStart:
-                fEnd = max(fEnd, fi[1])
-                n += 1
-            if (fi[0] != fStart) or (i == len(fadingIntervalsRaw) - 1):
-                hidden = hideRenderTrueAtFrame(fStart, hideRenderTrueFrames)
-                p = n / (len(bpy.data.materials) - len(hidden))
-
-                if args.debug:
-                    print("fading from {} to {}; {} / {} or p {}".
-                        format(fStart, fEnd, n, (len(bpy.data.materials) - len(hidden)), p))
-
-                if p > 0.5:
-                    fadingIntervals.append((fStart, fEnd))
-                    print("significant fading {} from {} to {}".format(p, fStart, fEnd))
-                fStart = None
-                n = 0
-    return fadingIntervals
+    hideRenderTrueFrames = findHideRenderTrueFrames(hideRenderChangesAtFrame, bpy.context.scene.frame_end)
 
 def findDollyIntervals():
     frames = []
@@ -1143,98 +1091,39 @@ def findDollyIntervals():
 
     return dollyIntervals
 
-def combineRenderIntervals(renderIntervalsA, renderIntervalsB):
-    # Priority given to renderIntervalsA.
-    # Both should be sorted on the first element of the interval tuple.
-    result = []
-    renderIntervalsA2 = [x for x in renderIntervalsA]
-    renderIntervalsB2 = [x for x in renderIntervalsB]
-    iA = 0
-    iB = 0
-    while iA < len(renderIntervalsA2) or iB < len(renderIntervalsB2):
-        if iB >= len(renderIntervalsB2):
-            result.append(renderIntervalsA2[iA])
-            iA += 1
-        elif iA >= len(renderIntervalsA2):
-            result.append(renderIntervalsB2[iB])
-            iB += 1
-        else:
-            riA = renderIntervalsA2[iA]
-            riB = renderIntervalsB2[iB]
-            if riA[0] < riB[0] and riA[1] <= riB[0]:
-                result.append(riA)
-                iA += 1
-            elif riB[0] < riA[1] and riB[1] <= riA[0]:
-                result.append(riB)
-                iB += 1
-            else:
-                if riA[0] <= riB[0]:
-                    if riB[1] <= riA[1]:
-                        if riA[0] < riB[0] - 1:
-                            result.append((riA[0], riB[0] - 1, riA[2]))
-                        result.append((riB[0], riB[1], riA[2]))
-                        if riB[1] + 1 < riA[1]:
-                            renderIntervalsA2[iA] = (riB[1] + 1, riA[1], riA[2])
-                        else:
-                            iA += 1
-                        iB += 1
-                    else: # riA[1] < riB[1]
-                        result.append(riA)
-                        iA += 1
-                        if riA[1] + 1 < riB[1]:
-                            renderIntervalsB2[iB] = (riA[1] + 1, riB[1], riB[2])
-                        else:
-                            iB += 1
-                else: # riB[0] < riA[0]
-                    result.append((riB[0], riA[0] - 1, riB[2]))
-                    if riB[1] <= riA[1]:
-                        if riA[0] < riB[1]:
-                            renderIntervalsB2[iB] = (riA[0], riB[1], riB[2])
-                        else:
-                            iB += 1
-                    else: # riA[1] < riB[1]
-                        result.append(riA)
-                        iA += 1
-                        if riA[1] + 1 < riB[1]:
-                            renderIntervalsB2[iB] = (riA[1] + 1, riB[1], riB[2])
-                        else:
-                            iB += 1
-    return result
-
 DefaultNumSamples = 100
 if useSeparateNeuronFiles:
     DefaultNumSamples = 150
 
-def addSamplesPerInterval(renderIntervals, fadingIntervals, dollyIntervals):
-    renderIntervals2 = [ri + (DefaultNumSamples, ) for ri in renderIntervals]
-    fadingIntervals2 = [fi + (int(DefaultNumSamples / 2), ) for fi in fadingIntervals]
-
-    # Using 5x samples here seems like overkill, but as of Octane Blender 2019/11/06,
-    # it seems to be the only way to be sure there is no flicker from the denoiser.
-    dollyIntervals2 = [di + (int(5 * DefaultNumSamples), ) for di in dollyIntervals]
-
-    # Increases due to dollying have the highest priority.  Then decreases due to fading.
-    renderIntervals3 = combineRenderIntervals(dollyIntervals2, fadingIntervals2)
-
-    # Both of those changes have priority over the normal sampling rate.
-    renderIntervals4 = combineRenderIntervals(renderIntervals3, renderIntervals2)
-
-    # Then clip renderIntervals4 so there is nothing before the start of
-    # renderIntervals or after its end.
-    start = renderIntervals[0][0]
-    end = renderIntervals[-1][1]
-    renderIntervals5 = []
-    for ri in renderIntervals4:
-        if start <= ri[0] and ri[1] <= end:
-            renderIntervals5.append(ri)
-
-    return renderIntervals5
+# With a "samplesPolicy" in the input JSON, Cycles also varies its sample count per render interval,
+# starting from the count set above.
+CyclesNumSamples = bpy.data.scenes["Scene"].cycles.samples if args.useCycles else None
+
+def setCyclesSamples(numSamples, policy):
+    bpy.context.scene.cycles.samples = numSamples
+    if "adaptiveThreshold" in policy and bpy.app.version >= (2, 83, 0):
+        # Noise falls with the square root of the sample count, so more samples get a lower threshold.
+        bpy.context.scene.cycles.use_adaptive_sampling = True
+        bpy.context.scene.cycles.adaptive_threshold = policy["adaptiveThreshold"] * math.sqrt(CyclesNumSamples / numSamples)
+
+def printRenderCost(renderIntervals, numSamples):
+    frameStep = bpy.context.scene.frame_step
+    numFrames, totalSamples = estimateRenderCost(renderIntervals, numSamples, frameStep)
+    numFramesAll = len(range(fStartOverall, fEndOverall + 1, frameStep))
+    print("Estimated render cost: {} of {} frames rendered, the rest copied".format(numFrames, numFramesAll))
+    if numFramesAll > 0 and numSamples:
+        print("  {} samples per pixel in total, {:.0f}% of rendering every frame at {} samples".
+            format(totalSamples, 100 * totalSamples / (numFramesAll * numSamples), numSamples))
 
 def separateNeuronFilesHideRender(obj, hideRenderTrue, useOctane, useCycles):
     matName = "Material." + obj.name
     if not matName in bpy.data.materials:
-        return
-    mat = bpy.data.materials[matName]
+        if not usesObjectAttributes(obj) or obj.name.startswith("Roi"):
+            return
+        # An appended neuron using the shared material, so it has no material of its own.
+        mat = None
+    else:
+        mat = bpy.data.materials[matName]
     if obj.name.startswith("Neuron.proxy"):
         if not obj.name in hideRenderTrue:
             # Append and render the real neurons referenced by the proxy
@@ -1244,15 +1133,32 @@ def separateNeuronFilesHideRender(obj, hideRenderTrue, useOctane, useCycles):
             print("Expanding {} with {} IDs".format(obj.name, len(obj["ids"])))
             for id in obj["ids"]:
                 referencedObjName = "Neuron." + str(id)
+                if referencedObjName in mainNeuronNames:
+                    # Also in a group that was not partitioned, so it is animated in the main file.
+                    continue
                 bpy.ops.wm.append(filename=referencedObjName, directory=objsDir)
-                referencedMatName = "Material." + referencedObjName
-                bpy.ops.wm.append(filename=referencedMatName, directory=matsDir)
 
                 if not referencedObjName in bpy.data.objects:
                     print(f"Skipping referenced but missing {referencedObjName}")
                     continue
                 
                 referencedObj = bpy.data.objects[referencedObjName]
+                if "lodMeshes" in referencedObj.keys():
+                    for meshName in referencedObj["lodMeshes"][1:]:
+                        if not meshName in bpy.data.meshes:
+                            bpy.ops.wm.append(filename=meshName, directory=neuronFile + "/Mesh")
+                if usesObjectAttributes(referencedObj):
+                    # The shared material, appended with the object, is not in the main file, so
+                    # it was not set up with the materials there.
+                    if useOctane:
+                        print("Error: Octane rendering does not support shared materials (from `importMeshes.py --sharedMaterials`)")
+                        sys.exit()
+                    if not jsonUseSpecular and referencedObj.active_material:
+                        setMaterialValue(referencedObj.active_material, "specular_intensity", 0)
+                else:
+                    # A shared material is appended with the object, but not a material of its own.
+                    referencedMatName = "Material." + referencedObjName
+                    bpy.ops.wm.append(filename=referencedMatName, directory=matsDir)
                 rescaleRecenter(referencedObj, overallCenter, overallScale)
                 if useOctane:
                     addOctaneMaterial(referencedObj, mat)
@@ -1265,19 +1171,249 @@ def separateNeuronFilesHideRender(obj, hideRenderTrue, useOctane, useCycles):
     elif not obj.name.startswith("Roi"):
         # Remove all neurons appended previously.
         try:
-            bpy.data.materials.remove(mat, do_unlink=True)
+            if mat:
+                bpy.data.materials.remove(mat, do_unlink=True)
             bpy.data.objects.remove(obj, do_unlink=True)
         except:
             pass
 
+def getBoundingSphere(obj):
+    corners = [obj.matrix_world @ mathutils.Vector(c) for c in obj.bound_box]
+    center = sum(corners, mathutils.Vector((0, 0, 0))) / len(corners)
+    radius = max([(c - center).length for c in corners])
+    return center, radius
+
+# Gives each visible neuron with level-of-detail meshes the coarsest mesh adequate for its largest
+# diameter on the screen at the start, middle and end of the render interval.
+def chooseLods(fStart, fEnd):
+    objs = [o for o in bpy.data.objects if "lodMeshes" in o.keys() and not o.hide_render]
+    if args.lodPixels <= 0 or len(objs) == 0:
+        return
+    for obj in objs:
+        set_lod_mesh(obj, 0)
+    cameraObj = bpy.data.objects["Camera"]
+    resolution = max(args.resX, args.resY)
+    maxPixels = {}
+    for f in sorted(set([fStart, (fStart + fEnd) // 2, fEnd])):
+        bpy.context.scene.frame_set(f)
+        cameraPos = cameraObj.matrix_world.translation
+        # The tangent of half the field of view along the larger dimension of the image.
+        tanHalfFov = math.tan(camera.angle / 2)
+        for obj in objs:
+            center, radius = getBoundingSphere(obj)
+            distance = (center - cameraPos).length
+            if distance <= radius:
+                pixels = float("inf")
+            else:
+                pixels = radius / (distance * tanHalfFov) * resolution
+            maxPixels[obj.name] = max(maxPixels.get(obj.name, 0), pixels)
+    counts = {}
+    for obj in objs:
+        lod = choose_lod(obj["lodRatios"], maxPixels[obj.name], args.lodPixels)
+        set_lod_mesh(obj, lod)
+        if args.useOctane:
+            obj.data.octane.mesh_type = "1"
+        counts[lod] = counts.get(lod, 0) + 1
+    print("Level-of-detail meshes used (level: count): {}".format(dict(sorted(counts.items()))))
+
+def getSampleFrames(fStart, fEnd, step):
+    return sorted(set(list(range(fStart, fEnd, max(step, 1))) + [fEnd]))
+
+# The planes bounding the camera's view, as (normal, point) pairs with the normals pointing inward.
+def getFrustumPlanes():
+    cameraObj = bpy.data.objects["Camera"]
+    mw = cameraObj.matrix_world
+    origin = mw.translation.copy()
+    forward = (mw.to_3x3() @ mathutils.Vector((0, 0, -1))).normalized()
+    corners = [mw @ c for c in camera.view_frame(scene=bpy.context.scene)]
+    planes = []
+    for i in range(len(corners)):
+        normal = (corners[i] - origin).cross(corners[(i + 1) % len(corners)] - origin).normalized()
+        if normal.dot(forward) < 0:
+            normal = -normal
+        planes.append((normal, origin))
+    planes.append((-forward, origin + forward * camera.clip_end))
+    return planes
+
+def sphereOutside(center, radius, planes):
+    return any([normal.dot(center - point) < -radius for normal, point in planes])
+
+# Finds which of `objs` are outside the camera's view at all the sampled frames of the interval.
+# A proxy is tested with the bounding sphere of the neurons it represents.
+def findCulled(objs, fStart, fEnd):
+    spheres = {}
+    for obj in objs:
+        if "boundRadius" in obj.keys():
+            spheres[obj.name] = (mathutils.Vector(obj["boundCenter"]), obj["boundRadius"])
+        else:
+            spheres[obj.name] = getBoundingSphere(obj)
+    culled = set(spheres.keys())
+    for f in getSampleFrames(fStart, fEnd, args.cullStep):
+        if len(culled) == 0:
+            break
+        bpy.context.scene.frame_set(f)
+        planes = getFrustumPlanes()
+        culled = set([name for name in culled if sphereOutside(spheres[name][0], spheres[name][1], planes)])
+    return culled
+
+def cullingApplies():
+    return args.cull and not args.doRois and camera.type == "PERSP" and bpy.app.version >= (2, 80, 0)
+
+# The frames with keys on the fcurves that define the render intervals, for choosing preview frames.
+def getPreviewKeyFrames():
+    result = set()
+    for _, fc in getObjectFcurves() + getMaterialFcurves() + getObjectAttributeFcurves():
+        result.update([f for f, _ in keysFromFcurve(fc)])
+    return result
+
+TRANSFORM_DATA_PATHS = ["location", "rotation_euler", "rotation_quaternion", "scale"]
+
+# The objects that change from frame `fStart` to `fEnd`, as a dictionary from name to whether the
+# object moves, or None if something else changes (e.g., the camera, a light or a movie texture).
+def getChangingObjects(fStart, fEnd):
+    for data in list(bpy.data.cameras) + list(bpy.data.lights):
+        if data.animation_data and data.animation_data.action:
+            if any([keysChangeBetween(keysFromFcurve(fc), fStart, fEnd) for fc in data.animation_data.action.fcurves]):
+                return None
+    if any([image.source == "MOVIE" for image in bpy.data.images]):
+        return None
+    result = {}
+    for obj in bpy.data.objects:
+        if obj.animation_data and obj.animation_data.action:
+            for fc in obj.animation_data.action.fcurves:
+                if keysChangeBetween(keysFromFcurve(fc), fStart, fEnd):
+                    # E.g., the camera, or an empty parent of other objects.
+                    if obj.type != "MESH":
+                        return None
+                    moves = fc.data_path in TRANSFORM_DATA_PATHS
+                    result[obj.name] = result.get(obj.name, False) or moves
+    matUsers = {}
+    for obj in bpy.data.objects:
+        for slot in obj.material_slots:
+            if slot.material:
+                matUsers.setdefault(slot.material.name, []).append(obj.name)
+    for name, fc in getMaterialFcurves():
+        if keysChangeBetween(keysFromFcurve(fc), fStart, fEnd):
+            for objName in matUsers.get(name, []):
+                result.setdefault(objName, False)
+    return result
+
+# The rectangle of pixels (xMin, yMin, xMax, yMax), with y increasing upward as in Blender's render
+# border, covering the projected bounding spheres of the objects that change from frame `fStart` to
+# `fEnd`, plus the margin.  None if the region rendering does not apply.
+def findChangeRegion(fStart, fEnd, hideRenderTrue):
+    changing = getChangingObjects(fStart, fEnd)
+    if changing == None:
+        return None
+    scene = bpy.context.scene
+    cameraObj = bpy.data.objects["Camera"]
+    names = [name for name in changing.keys() if not name in hideRenderTrue]
+    frames = range(fStart, fEnd + 1) if any([changing[name] for name in names]) else [fStart]
+    corners = [mathutils.Vector((x, y, z)) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+    xMin = yMin = math.inf
+    xMax = yMax = -math.inf
+    for f in frames:
+        bpy.context.scene.frame_set(f)
+        for name in names:
+            obj = bpy.data.objects[name]
+            if "boundRadius" in obj.keys():
+                center, radius = mathutils.Vector(obj["boundCenter"]), obj["boundRadius"]
+            else:
+                center, radius = getBoundingSphere(obj)
+            for corner in corners:
+                p = world_to_camera_view(scene, cameraObj, center + corner * radius)
+                if p.z <= 0:
+                    # Partly behind the camera.
+                    return None
+                xMin, xMax = min(xMin, p.x), max(xMax, p.x)
+                yMin, yMax = min(yMin, p.y), max(yMax, p.y)
+    m = args.regionMargin
+    x0, x1 = max(0, math.floor(xMin * args.resX) - m), min(args.resX, math.ceil(xMax * args.resX) + m)
+    y0, y1 = max(0, math.floor(yMin * args.resY) - m), min(args.resY, math.ceil(yMax * args.resY) + m)
+    if x1 <= x0 or y1 <= y0:
+        # Nothing visible changes.
+        return (0, 0, 0, 0)
+    if (x1 - x0) * (y1 - y0) > args.regionMaxArea * args.resX * args.resY:
+        return None
+    return (x0, y0, x1, y1)
+
+# The pixels of a PNG file, as 8-bit RGBA with the bottom row first.
+def loadPngPixels(path):
+    image = bpy.data.images.load(path)
+    width, height = image.size
+    pixels = np.empty(width * height * image.channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    bpy.data.images.remove(image)
+    return to_uint8(pixels.reshape(height, width, -1))
+
+# Renders the first frame of the interval completely, and for the other frames renders only the
+# `region` and pastes it into a copy of the first frame.  The region is rendered with extra margin,
+# which is discarded because filtering and denoising differ near the edges of a render border.
+def renderRegion(fStart, fEnd, region):
+    scene = bpy.context.scene
+    scene.frame_start = fStart
+    scene.frame_end = fStart
+    bpy.ops.render.render(animation=True)
+    base = loadPngPixels(frame_path(output, fStart, ".png"))
+
+    x0, y0, x1, y1 = region
+    m = args.regionMargin
+    cx0, cy0 = max(0, x0 - m), max(0, y0 - m)
+    cx1, cy1 = min(args.resX, x1 + m), min(args.resY, y1 + m)
+    frames = list(range(fStart + 1, fEnd + 1))
+    if args.skipExisting:
+        # Existing frames (e.g., from an earlier session) are neither rendered again nor rewritten.
+        existing = FrameIndex(output, ".png")
+        frames = [f for f in frames if not f in existing]
+    tmp = tempfile.mkdtemp()
+    if x1 > x0 and len(frames) > 0:
+        filepath = scene.render.filepath
+        scene.render.filepath = os.path.join(tmp, "")
+        scene.render.use_border = True
+        scene.render.use_crop_to_border = True
+        # The half-pixel offsets make Blender's truncation to pixels give exactly these bounds.
+        scene.render.border_min_x = (cx0 + 0.5) / args.resX
+        scene.render.border_max_x = min(1.0, (cx1 + 0.5) / args.resX)
+        scene.render.border_min_y = (cy0 + 0.5) / args.resY
+        scene.render.border_max_y = min(1.0, (cy1 + 0.5) / args.resY)
+        # Render each run of consecutive missing frames.
+        runStart = frames[0]
+        for f, fNext in zip(frames, frames[1:] + [None]):
+            if fNext != f + 1:
+                scene.frame_start = runStart
+                scene.frame_end = f
+                bpy.ops.render.render(animation=True)
+                runStart = fNext
+        scene.render.use_border = False
+        scene.render.filepath = filepath
+
+    for f in frames:
+        pixels = base.copy()
+        if x1 > x0:
+            crop = loadPngPixels(frame_path(tmp, f, ".png"))
+            pixels[y0:y1, x0:x1] = crop[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+        write_png(frame_path(output, f, ".png"), pixels[::-1])
+        if manifest:
+            manifest.add_frame(f)
+    shutil.rmtree(tmp)
+
 def render(renderIntervalsClipped, hideRenderTrueFrames, justPrint=False):
     global args
 
+    samplesPolicy = jsonSamplesPolicy if jsonSamplesPolicy else DEFAULT_SAMPLES_POLICY
+    useSamplesSchedule = not args.doRois and not args.preview and (args.useOctane or (args.useCycles and jsonSamplesPolicy != None))
+    baseNumSamples = DefaultNumSamples if args.useOctane else CyclesNumSamples
+
     renderIntervals = renderIntervalsClipped
-    if args.useOctane and not args.doRois:
-        fadingIntervals = findFadingIntervals(hideRenderTrueFrames)
+    if useSamplesSchedule:
+        fadingIntervals = findFadingIntervals([keys for _, keys in getAlphaKeys()], hideRenderTrueFrames, args.debug)
         dollyIntervals = findDollyIntervals()
-        renderIntervals = addSamplesPerInterval(renderIntervalsClipped, fadingIntervals, dollyIntervals)
+        renderIntervals = addSamplesPerInterval(renderIntervalsClipped, fadingIntervals, dollyIntervals, baseNumSamples, samplesPolicy)
+
+    previewKeyFrames = getPreviewKeyFrames() if args.preview else None
+    numPreviewFrames = 0
+    numRegionFrames = 0
+    regionArea = 0
 
     numFramesCopied = 0
     j = 0
@@ -1291,43 +1427,106 @@ def render(renderIntervalsClipped, hideRenderTrueFrames, justPrint=False):
         if bpy.context.scene.frame_step > 1 and fEnd - fStart < 2:
             continue
 
-        if args.useOctane and not args.doRois:
-            numSamples = DefaultNumSamples
+        if useSamplesSchedule:
+            numSamples = baseNumSamples
             if len(ri) == 3:
                 numSamples = int(ri[2])
-            if args.numSamples:
-                numSamples = args.numSamples
-            bpy.context.scene.octane.max_samples = numSamples
+            if args.useOctane:
+                if args.numSamples:
+                    numSamples = args.numSamples
+                bpy.context.scene.octane.max_samples = numSamples
+            else:
+                setCyclesSamples(numSamples, samplesPolicy)
 
         hideRenderTrue = hideRenderTrueAtFrame(fStart, hideRenderTrueFrames)
 
+        if cullingApplies() and useSeparateNeuronFiles:
+            # Skip loading the neurons of proxies that are out of view.
+            proxies = [o for o in bpy.data.objects if o.name.startswith("Neuron.proxy") and
+                "boundRadius" in o.keys() and not o.name in hideRenderTrue]
+            culledProxies = findCulled(proxies, fStart, fEnd)
+            if len(culledProxies) > 0:
+                print("Culled {} of {} visible proxies".format(len(culledProxies), len(proxies)))
+                hideRenderTrue = set(hideRenderTrue) | culledProxies
+                if not justPrint:
+                    for name in culledProxies:
+                        bpy.data.objects[name].hide_render = True
+
+        # For a preview, only some frames are rendered, and the rest are interpolated.
+        previewFrames = None
+        if args.preview:
+            previewFrames = choosePreviewFrames([ri], previewKeyFrames, fStart, fEnd, args.previewStep)
+            numPreviewFrames += len(previewFrames)
+
+        # Frames after the first in an interval with only localized changes are rendered only in that region.
+        region = None
+        if args.regions and fEnd > fStart:
+            region = findChangeRegion(fStart, fEnd, hideRenderTrue)
+            if region:
+                areaFraction = (region[2] - region[0]) * (region[3] - region[1]) / (args.resX * args.resY)
+                numRegionFrames += fEnd - fStart
+                regionArea += (fEnd - fStart) * areaFraction
+
         if justPrint:
-            if args.useOctane and not args.doRois:
+            if region:
+                print("rendering from frame {} to {}, after the first frame only {:.1f}% of the image".
+                    format(fStart, fEnd, 100 * areaFraction))
+            elif previewFrames:
+                print("rendering {} preview frames from frame {} to {}".format(len(previewFrames), fStart, fEnd))
+            elif useSamplesSchedule:
                 print("rendering from frame {} to {}, with {} objects hidden, {} samples".
-                    format(fStart, fEnd, len(hideRenderTrue), bpy.context.scene.octane.max_samples))
+                    format(fStart, fEnd, len(hideRenderTrue), numSamples))
             else:
                 print("rendering from frame {} to {}".format(fStart, fEnd))
         else:
             print("Preparing to render from frame {} to {}".format(fStart, fEnd))
+            begin_phase("prepare")
             if not args.doRois:
                 for obj in bpy.data.objects:
                     if args.useCycles or obj.name.startswith("Neuron"):
-                        if useSeparateNeuronFiles:
+                        if useSeparateNeuronFiles and not obj.name in mainNeuronNames:
                             separateNeuronFilesHideRender(obj, hideRenderTrue, args.useOctane, args.useCycles)
                         else:
                             # Path-traced renderers (e.g., Octane or Cycles) produce dark artifacts for
                             # fully transparent objects (alpha == 0), so such objects must be explicitly
                             # excluded from the rendering.
                             obj.hide_render = (obj.name in hideRenderTrue)
+                if cullingApplies():
+                    neurons = [o for o in bpy.data.objects if o.name.startswith("Neuron.") and
+                        not o.name.startswith("Neuron.proxy") and not o.hide_render]
+                    culled = findCulled(neurons, fStart, fEnd)
+                    for obj in neurons:
+                        if obj.name in culled:
+                            obj.hide_render = True
+                    print("Culled {} of {} visible neurons".format(len(culled), len(neurons)))
+                chooseLods(fStart, fEnd)
             print("Done")
+            end_phase()
             print("Rendering from frame {} to {}".format(fStart, fEnd))
-            bpy.context.scene.frame_start = fStart
-            bpy.context.scene.frame_end = fEnd
-            bpy.ops.render.render(animation=True)
+            begin_phase("frames")
+            if previewFrames:
+                for f in previewFrames:
+                    bpy.context.scene.frame_start = f
+                    bpy.context.scene.frame_end = f
+                    bpy.ops.render.render(animation=True)
+            elif region:
+                renderRegion(fStart, fEnd, region)
+                trace_count("frames_region", fEnd - fStart)
+            else:
+                bpy.context.scene.frame_start = fStart
+                bpy.context.scene.frame_end = fEnd
+                bpy.ops.render.render(animation=True)
+            end_phase()
+            trace_count("intervals")
+            if previewFrames:
+                trace_count("frames_rendered", len(previewFrames))
+            else:
+                trace_count("frames_rendered", len(range(fStart, fEnd + 1, bpy.context.scene.frame_step)))
         ext = ".png"
-        if willComp:
+        if willComp or args.denoiseLater:
             ext = ".exr"
-        if i < len(renderIntervals) - 1:
+        # A preview shows the last rendered frame through a resting interval, without copies.
+        if i < len(renderIntervals) - 1 and not args.preview:
             # TODO: Instead of skipping over the resting intervals when frame_step > 1,
             # add a way to do the stepping within those intervals.
             if bpy.context.scene.frame_step == 1:
@@ -1343,6 +1542,21 @@ def render(renderIntervalsClipped, hideRenderTrueFrames, justPrint=False):
                             dst = output + str(j).zfill(4) + ext
                             shutil.copy(src, dst)
                             numFramesCopied += 1
+                            trace_count("frames_copied")
+                            if manifest:
+                                manifest.add_frame(j)
+
+    if justPrint:
+        if numRegionFrames > 0:
+            print("Region rendering: {} frames, {:.1f}% of the image on average".format(numRegionFrames, 100 * regionArea / numRegionFrames))
+        if args.preview:
+            print("Preview: rendering {} of {} frames".format(numPreviewFrames, fEndOverall - fStartOverall + 1))
+        elif args.useOctane and args.numSamples:
+            printRenderCost([ri[0:2] for ri in renderIntervals], args.numSamples)
+        elif useSamplesSchedule:
+            printRenderCost(renderIntervals, baseNumSamples)
+        else:
+            printRenderCost(renderIntervals, getSamples(bpy.context.scene))
     return numFramesCopied
 
 bpy.context.scene.render.resolution_x = args.resX
@@ -1410,14 +1624,183 @@ if args.useCycles:
     print("Cycles device: {} {}".format(bpy.context.scene.cycles.device, cyclesPrefs.compute_device_type))
 
 
+# Per-frame render statistics, gathered by render handlers.  The time from the start of a frame
+# until the first progress of sampling is the scene synchronization time, and the rest is the
+# rendering (e.g., path tracing) time.
+
+RENDER_STATS_FIELDS = ["frame", "interval_start", "interval_end", "wall_secs", "sync_secs", "render_secs", "samples",
+    "visible_objects", "peak_mem_mb", "peak_rss_mb", "engine", "persistent_data", "threads"]
+RENDER_STATS_SAMPLING = re.compile(r"Sample|samples|Path Tracing")
+RENDER_STATS_PEAK_MEMORY = re.compile(r"Peak[: ]+([\d.]+)M")
+
+frameStats = {}
+statsLogFile = None
+statsLogWriter = None
+
+def getSamples(scene):
+    if scene.render.engine == "CYCLES":
+        return scene.cycles.samples
+    elif scene.render.engine == "octane":
+        return scene.octane.max_samples
+    elif bpy.app.version >= (2, 80, 0):
+        return scene.eevee.taa_render_samples
+    return None
+
+def onRenderPre(scene, *unused):
+    frameStats.clear()
+    frameStats["frame"] = scene.frame_current
+    frameStats["t0"] = time.perf_counter()
+    frameStats["tSampling"] = None
+    frameStats["peakMem"] = None
+    frameStats["visible"] = len([o for o in scene.objects if o.type == "MESH" and not o.hide_render])
+
+def onRenderStats(stats, *unused):
+    if not isinstance(stats, str) or not "t0" in frameStats:
+        return
+    if frameStats["tSampling"] == None and RENDER_STATS_SAMPLING.search(stats):
+        frameStats["tSampling"] = time.perf_counter()
+    for mem in RENDER_STATS_PEAK_MEMORY.findall(stats):
+        frameStats["peakMem"] = max(frameStats["peakMem"] or 0, float(mem))
+
+def onRenderPost(scene, *unused):
+    if not "t0" in frameStats:
+        return
+    t1 = time.perf_counter()
+    tSampling = frameStats["tSampling"]
+    row = {
+        "frame": frameStats["frame"],
+        "interval_start": scene.frame_start,
+        "interval_end": scene.frame_end,
+        "wall_secs": round(t1 - frameStats["t0"], 3),
+        "sync_secs": round(tSampling - frameStats["t0"], 3) if tSampling else None,
+        "render_secs": round(t1 - tSampling, 3) if tSampling else None,
+        "samples": getSamples(scene),
+        "visible_objects": frameStats["visible"],
+        "peak_mem_mb": frameStats["peakMem"],
+        "peak_rss_mb": peak_rss_mb(),
+        "engine": scene.render.engine,
+        "persistent_data": scene.render.use_persistent_data if bpy.app.version >= (2, 93, 0) else False,
+        "threads": scene.render.threads
+    }
+    if statsLogWriter:
+        statsLogWriter.writerow(row)
+    else:
+        statsLogFile.write(json.dumps(row) + "\n")
+    statsLogFile.flush()
+    frameStats.clear()
+
+# The manifest of completed frames, for processing frames while rendering continues.
+
+manifest = None
+
+def onRenderWrite(scene, *unused):
+    # Frames rendered in a region are listed once they are pasted into complete frames.
+    if not scene.render.use_border:
+        manifest.add_frame(scene.frame_current)
+
+def startManifest():
+    global manifest
+    ext = ".exr" if willComp or args.denoiseLater else ".png"
+    try:
+        os.makedirs(output, exist_ok=True)
+        manifest = ManifestWriter(output, fStartOverall, fEndOverall, bpy.context.scene.frame_step, ext)
+    except OSError as e:
+        print("Error: cannot write manifest in '{}': {}".format(output, str(e)))
+        sys.exit()
+    if args.skipExisting:
+        # Existing frames are not rendered again, so list them now.
+        existing = [os.path.splitext(f)[0] for f in os.listdir(output) if os.path.splitext(f)[1] == ext]
+        for f in sorted([int(f) for f in existing if f.isdigit()]):
+            if fStartOverall <= f and f <= fEndOverall:
+                manifest.add_frame(f)
+    bpy.app.handlers.render_write.append(onRenderWrite)
+    print("Listing completed frames in '{}'".format(manifest.file.name))
+
+# Encodes the preview movie next to the preview frames, showing each rendered frame until the next one,
+# blended into the next one by ffmpeg's interpolation.  Without ffmpeg, copies each rendered frame
+# until the next one, for assembleFrames.py.
+def assemblePreview():
+    frames = FrameIndex(output, ".png").frames_in_range(fStartOverall, fEndOverall)
+    if len(frames) == 0:
+        print("Error: no preview frames in '{}'".format(output))
+        return
+    counts = previewFrameCounts(frames, fEndOverall)
+    ffmpeg = find_ffmpeg(args.ffmpeg)
+    if not ffmpeg:
+        for f, count in zip(frames, counts):
+            for j in range(f + 1, f + count):
+                shutil.copy(frame_path(output, f, ".png"), frame_path(output, j, ".png"))
+        print("No ffmpeg, so assemble the preview with: blender --background --python assembleFrames.py -- -i {} -iw {} -ih {} --fps {}".
+            format(output, args.resX, args.resY, bpy.context.scene.render.fps))
+        return
+    movie = os.path.normpath(output) + ".mp4"
+    entries = [(frame_path(output, f, ".png"), count) for f, count in zip(frames, counts)]
+    begin_phase("encode")
+    returncode = encode_frame_entries(entries, movie, bpy.context.scene.render.fps, ffmpeg,
+        width=args.resX, height=args.resY, interpolate=True)
+    end_phase()
+    if returncode != 0:
+        print("Error: ffmpeg failed with exit code {}".format(returncode))
+    else:
+        print("Wrote preview movie {}".format(movie))
+
+# For denoiseFrames.py, the frames where the camera or an object moves, since blending neighboring
+# frames is valid only when nothing moves between them.
+def writeMotionFrames():
+    frames = set()
+    for data in list(bpy.data.objects) + list(bpy.data.cameras):
+        if data.animation_data and data.animation_data.action:
+            for fc in data.animation_data.action.fcurves:
+                if isinstance(data, bpy.types.Camera) or fc.data_path in TRANSFORM_DATA_PATHS:
+                    frames |= keysChangeFrames(keysFromFcurve(fc))
+    try:
+        os.makedirs(output, exist_ok=True)
+        write_motion_frames(output, frames)
+    except OSError as e:
+        print("Error: cannot write the frames with motion in '{}': {}".format(output, str(e)))
+        sys.exit()
+
+def startStatsLog(path):
+    global statsLogFile, statsLogWriter
+    try:
+        statsLogFile = open(path, "w", newline="")
+    except OSError as e:
+        print("Error: cannot write render statistics log '{}': {}".format(path, str(e)))
+        sys.exit()
+    if os.path.splitext(path)[1].lower() != ".jsonl":
+        statsLogWriter = csv.DictWriter(statsLogFile, fieldnames=RENDER_STATS_FIELDS)
+        statsLogWriter.writeheader()
+    bpy.app.handlers.render_pre.append(onRenderPre)
+    bpy.app.handlers.render_stats.append(onRenderStats)
+    bpy.app.handlers.render_post.append(onRenderPost)
+    print("Writing per-frame render statistics to '{}'".format(path))
+
 render(renderIntervalsClipped, hideRenderTrueFrames, justPrint=True)
 
 if args.debug:
     print("Debugging, so quitting")
     quit()
 
+end_phase()
+
+if args.statsLog:
+    startStatsLog(args.statsLog)
+if args.manifest:
+    startManifest()
+if args.denoiseLater:
+    writeMotionFrames()
+
 numFramesTotal = fEndOverall - fStartOverall + 1
+begin_phase("render")
 numFramesCopied = render(renderIntervalsClipped, hideRenderTrueFrames)
+end_phase()
+if statsLogFile:
+    statsLogFile.close()
+if manifest:
+    manifest.close()
+if args.preview:
+    assemblePreview()
+end_trace()
 
 #
 
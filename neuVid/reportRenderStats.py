@@ -0,0 +1,147 @@
+# Reports on the per-frame render statistics written by `render.py --statsLog`: the slowest
+# render intervals, how the time divides between scene synchronization and rendering, and
+# suggestions for the `render.py` options.
+
+# Run with plain Python, e.g.:
+# $ python reportRenderStats.py renderStats.csv
+# $ python reportRenderStats.py renderStats.jsonl --top 20
+
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsGeneral import report_version
+
+# Scene synchronization taking more than this fraction of the time suggests `--persist`.
+SYNC_FRACTION_FOR_PERSIST = 0.25
+
+# An interval rendering this much slower per frame than the median suggests fewer samples.
+SLOW_FACTOR_FOR_SAMPLES = 2.0
+
+MIN_SUGGESTED_SAMPLES = 16
+
+def to_number(value):
+    if value == None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value) if "." in value else int(value)
+    except ValueError:
+        return value
+
+def read_stats(path):
+    rows = []
+    try:
+        with open(path, newline="") as f:
+            if os.path.splitext(path)[1].lower() == ".jsonl":
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                rows = list(csv.DictReader(f))
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error: cannot read render statistics '{path}': {str(e)}")
+        sys.exit()
+    for row in rows:
+        for key in row.keys():
+            if key in ["persistent_data"]:
+                row[key] = row[key] in [True, "True", "true", "1"]
+            elif key != "engine":
+                row[key] = to_number(row[key])
+    return rows
+
+def total(rows, key):
+    return sum([row[key] for row in rows if row[key] != None])
+
+def summarize_intervals(rows):
+    intervals = {}
+    for row in rows:
+        intervals.setdefault((row["interval_start"], row["interval_end"]), []).append(row)
+    result = []
+    for (start, end), interval_rows in intervals.items():
+        wall = total(interval_rows, "wall_secs")
+        result.append({
+            "start": start,
+            "end": end,
+            "frames": len(interval_rows),
+            "wall_secs": wall,
+            "secs_per_frame": wall / len(interval_rows),
+            "sync_secs": total(interval_rows, "sync_secs"),
+            "render_secs": total(interval_rows, "render_secs"),
+            "samples": interval_rows[0]["samples"],
+            "visible_objects": max([r["visible_objects"] or 0 for r in interval_rows]),
+            "peak_mem_mb": max([r["peak_mem_mb"] or 0 for r in interval_rows]) or None
+        })
+    return result
+
+def print_intervals(intervals, top):
+    print(f"Slowest {min(top, len(intervals))} of {len(intervals)} render intervals, by total time:")
+    print(f"  {'frames':>13} {'count':>6} {'secs':>9} {'secs/frame':>11} {'sync %':>7} {'samples':>8} {'objects':>8} {'peak MB':>8}")
+    for i in sorted(intervals, key=lambda x: x["wall_secs"], reverse=True)[:top]:
+        frames = f"{i['start']}-{i['end']}"
+        sync = f"{100 * i['sync_secs'] / i['wall_secs']:6.1f}%" if i["wall_secs"] > 0 else f"{'-':>7}"
+        mem = f"{i['peak_mem_mb']:8.0f}" if i["peak_mem_mb"] else f"{'-':>8}"
+        samples = i["samples"] if i["samples"] != None else "-"
+        print(f"  {frames:>13} {i['frames']:6} {i['wall_secs']:9.1f} {i['secs_per_frame']:11.2f} {sync} {samples:>8} {i['visible_objects']:8} {mem}")
+    print()
+
+def print_suggestions(rows, intervals):
+    suggestions = []
+    wall = total(rows, "wall_secs")
+    sync = total(rows, "sync_secs")
+    engines = set([row["engine"] for row in rows])
+    persistent = all([row["persistent_data"] for row in rows])
+    if "CYCLES" in engines and not persistent and wall > 0 and sync / wall > SYNC_FRACTION_FOR_PERSIST:
+        peak = max([row["peak_mem_mb"] or 0 for row in rows])
+        memory = f" (peak memory was {peak:.0f} MB, and will be higher)" if peak else ""
+        suggestions.append(f"Scene synchronization took {100 * sync / wall:.0f}% of the time: try `render.py --persist`, if memory allows{memory}")
+
+    per_frame = [i["secs_per_frame"] for i in intervals]
+    if len(per_frame) > 1:
+        median = statistics.median(per_frame)
+        for i in sorted(intervals, key=lambda x: x["secs_per_frame"], reverse=True):
+            if i["secs_per_frame"] < SLOW_FACTOR_FOR_SAMPLES * median or not i["samples"]:
+                break
+            if i["render_secs"] < i["sync_secs"]:
+                continue
+            # Rendering time is roughly proportional to the sample count.
+            samples = max(MIN_SUGGESTED_SAMPLES, int(i["samples"] * median / i["secs_per_frame"]))
+            if samples < i["samples"]:
+                suggestions.append(f"Frames {i['start']}-{i['end']} took {i['secs_per_frame']:.1f} secs/frame, vs. a median of {median:.1f}: " +
+                    f"try `render.py --frame-start {i['start']} --frame-end {i['end']} --samples {samples}` (instead of {i['samples']})")
+
+    if len(suggestions) == 0:
+        print("No suggestions")
+    else:
+        print("Suggestions:")
+        for suggestion in suggestions:
+            print(f"  . {suggestion}")
+
+if __name__ == "__main__":
+    report_version()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stats", help="path to the log from `render.py --statsLog`")
+    parser.set_defaults(top=10)
+    parser.add_argument("--top", "-t", type=int, help="number of slowest render intervals to list")
+    args = parser.parse_args()
+
+    rows = read_stats(args.stats)
+    if len(rows) == 0:
+        print("No frames in the render statistics")
+        sys.exit()
+
+    wall = total(rows, "wall_secs")
+    sync = total(rows, "sync_secs")
+    rendering = total(rows, "render_secs")
+    print(f"Rendered {len(rows)} frames in {wall:.1f} secs, {wall / len(rows):.2f} secs/frame")
+    if wall > 0:
+        print(f"  synchronization {sync:.1f} secs ({100 * sync / wall:.1f}%), rendering {rendering:.1f} secs ({100 * rendering / wall:.1f}%)")
+    print()
+
+    intervals = summarize_intervals(rows)
+    print_intervals(intervals, args.top)
+    print_suggestions(rows, intervals)
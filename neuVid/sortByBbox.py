@@ -5,14 +5,13 @@
 # $ python sortByBbox.py -i ids.txt etc
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 import os
 import numpy as np
+import re
 import sys
 
-# Not actually very helpful
-from concurrent.futures import ThreadPoolExecutor
-
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from utilsGeneral import report_version
 from utilsJson import get_ids_from_file
@@ -46,18 +45,83 @@ def read_obj_verts(filenames, dir):
         result.append(verts)
     return result
 
-# Does not seem to be any faster in practice.
-def read_obj_verts_parallel(filenames, dir):
-    def read(filename):
-        path = os.path.join(dir, filename)
-        verts = read_obj_verts_np(path)
-        return verts
-    
+# Matches the values of a vertex line (but not "vn" or "vt" lines).  Matching on the preceding
+# newline instead of using `re.MULTILINE` is significantly faster.
+OBJ_VERTEX_VALUES = re.compile(rb"\nv[ \t]([^\n]*)")
+# Matches just the X, Y and Z values, for the rare vertex lines with extra values like W or colors.
+OBJ_VERTEX_XYZ = re.compile(rb"\nv[ \t]+(\S+[ \t]+\S+[ \t]+\S+)")
+
+OBJ_SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+def parse_obj_verts(data):
+    lines = OBJ_VERTEX_VALUES.findall(data)
+    if not lines:
+        return None
+    values = np.fromstring(b" ".join(lines), sep=" ")
+    if len(values) != 3 * len(lines):
+        lines = OBJ_VERTEX_XYZ.findall(data)
+        values = np.fromstring(b" ".join(lines), sep=" ")
+    return values.reshape(-1, 3)
+
+# Computes the bounding box of an OBJ file without building Python objects for each vertex:
+# the "v" lines are found with a regular expression over large byte chunks, and their values are
+# parsed in bulk by NumPy.  Only a running minimum and maximum are kept, so memory use is bounded
+# by the chunk size, not the file size.  Also returns the vertex count and face count.
+def read_obj_bbox(path, chunk_size=OBJ_SCAN_CHUNK_SIZE):
+    mini = np.full(3, np.inf)
+    maxi = np.full(3, -np.inf)
+    count = 0
+    face_count = 0
+    with open(path, "rb") as f:
+        # Each piece of data to be parsed starts with a newline, for `OBJ_VERTEX_VALUES`.
+        remainder = b"\n"
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk:
+                data = remainder + chunk
+                # Process only complete lines, saving the partial last line for the next chunk.
+                i = data.rfind(b"\n")
+                if i <= 0:
+                    remainder = data
+                    continue
+                remainder = data[i:]
+                data = data[:i]
+            else:
+                data = remainder
+            verts = parse_obj_verts(data)
+            if verts is not None:
+                mini = np.minimum(mini, verts.min(axis=0))
+                maxi = np.maximum(maxi, verts.max(axis=0))
+                count += len(verts)
+            face_count += data.count(b"\nf ") + data.count(b"\nf\t")
+            if not chunk:
+                break
+    return mini, maxi, count, face_count
+
+# Threads do not help here, because the parsing is bound by the Python global interpreter lock,
+# so use processes.
+def read_obj_bboxes_parallel(filenames, dir, workers=None):
+    if not workers:
+        workers = os.cpu_count()
+    paths = [os.path.join(dir, filename) for filename in filenames]
     results = []
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = [executor.submit(read, filename) for filename in filenames]
-        for future in futures:
-            results.append(future.result())
+    if workers == 1:
+        results_iter = map(read_obj_bbox, paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # Batching the paths amortizes the interprocess communication overhead.
+        chunksize = max(1, min(64, len(paths) // (4 * workers)))
+        results_iter = executor.map(read_obj_bbox, paths, chunksize=chunksize)
+    try:
+        for i, result in enumerate(results_iter):
+            results.append(result)
+            if (i + 1) % 1000 == 0 or i + 1 == len(paths):
+                percent = (i + 1) / len(paths) * 100
+                print(f"{i + 1} / {len(paths)} ({percent:.1f}%)")
+    finally:
+        if executor:
+            executor.shutdown()
     return results
 
 def get_bboxes(objs_verts):
@@ -68,37 +132,206 @@ def get_bboxes(objs_verts):
         result.append((mini, maxi))    
     return result
 
-def sort_bboxes(bboxes, which, axis, ascending=True):
-    def size(bbox):
-        mi, ma = bbox
-        d = [ma[j] - mi[j] for j in range(3)]
-        return d[0] * d[1] * d[2]
-    def mini(bbox, axis):
-        mi, ma = bbox
-        return mi[axis]
-    def maxi(bbox, axis):
-        mi, ma = bbox
-        return ma[axis]
-    def mid(bbox, axis):
-        mi, ma = bbox
-        c = [(mi[j] + ma[j]) / 2 for j in range(3)]
-        return c[axis]
+# The on-disk index of mesh bounding boxes, so later runs need to read only new or changed meshes.
+BBOX_INDEX_DTYPE = np.dtype([
+    ("name", "U256"),
+    ("mtime_ns", np.int64),
+    ("size", np.int64),
+    ("min", np.float64, (3,)),
+    ("max", np.float64, (3,)),
+    ("vertex_count", np.int64),
+    ("face_count", np.int64)
+])
+
+# The index is written next to the mesh directory, e.g., "neuVidNeuronMeshes.bboxindex.npy"
+# for the "neuVidNeuronMeshes" directory.
+def get_bbox_index_path(dir):
+    return os.path.normpath(dir) + ".bboxindex.npy"
+
+def read_bbox_index(path):
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=BBOX_INDEX_DTYPE)
+    try:
+        index = np.load(path, allow_pickle=False)
+        if index.dtype == BBOX_INDEX_DTYPE:
+            return index
+        print(f"Ignoring bounding box index '{path}' with an outdated format")
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable bounding box index '{path}': {str(e)}")
+    return np.zeros(0, dtype=BBOX_INDEX_DTYPE)
+
+def write_bbox_index(index, path):
+    # Write to a temporary file and rename it, so an interrupted run cannot leave a corrupt index.
+    # The temporary file is unique to this process, in case other processes update the same index.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, index, allow_pickle=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error: cannot write bounding box index '{path}': {str(e)}")
+
+def update_bbox_index(index, filenames, dir, workers=None):
+    name_to_row = {name: i for i, name in enumerate(index["name"])}
+    stats = []
+    stale = []
+    for filename in filenames:
+        path = os.path.join(dir, filename)
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            print(f"Error: cannot read mesh file '{path}': {str(e)}")
+            sys.exit()
+        stats.append(stat)
+        i = name_to_row.get(filename)
+        if i == None or index["mtime_ns"][i] != stat.st_mtime_ns or index["size"][i] != stat.st_size:
+            stale.append(len(stats) - 1)
+
+    print(f"Using {len(filenames) - len(stale)} indexed bounding boxes, reading {len(stale)} new or changed meshes")
+    if len(stale) == 0:
+        return index, False
+
+    # Deduplicate, in case an ID is listed more than once.
+    stale_filenames = list(dict.fromkeys([filenames[j] for j in stale]))
+    bboxes = read_obj_bboxes_parallel(stale_filenames, dir, workers)
+    filename_to_stat = {filenames[j]: stats[j] for j in stale}
+
+    rows = np.zeros(len(stale_filenames), dtype=BBOX_INDEX_DTYPE)
+    for k, (filename, (mini, maxi, count, face_count)) in enumerate(zip(stale_filenames, bboxes)):
+        stat = filename_to_stat[filename]
+        rows[k] = (filename, stat.st_mtime_ns, stat.st_size, mini, maxi, count, face_count)
+
+    stale_set = set(stale_filenames)
+    keep = np.array([name not in stale_set for name in index["name"]], dtype=bool)
+    return np.concatenate([index[keep], rows]), True
 
+def get_indexed_rows(index, filenames):
+    name_to_row = {name: i for i, name in enumerate(index["name"])}
+    rows = np.array([name_to_row[filename] for filename in filenames], dtype=np.int64)
+    return index[rows]
+
+def get_indexed_bboxes(index, filenames):
+    rows = get_indexed_rows(index, filenames)
+    return rows["min"], rows["max"], rows["face_count"]
+
+# The number of bits per axis for quantized bounding box centers, so the three axes' bits
+# fit in a 64-bit space-filling curve code.
+CURVE_BITS = 21
+
+def quantize_centers(minis, maxis, bits=CURVE_BITS):
+    centers = (minis + maxis) / 2
+    lo = centers.min(axis=0) if len(centers) > 0 else np.zeros(3)
+    extent = (centers.max(axis=0) - lo) if len(centers) > 0 else np.zeros(3)
+    # Use the same scale on all axes, so the curve does not stretch thin dimensions.
+    scale = extent.max()
+    if scale == 0:
+        return np.zeros(centers.shape, dtype=np.uint64)
+    q = np.floor((centers - lo) / scale * ((1 << bits) - 1))
+    return q.astype(np.uint64)
+
+def interleave_bits(x, y, z, bits=CURVE_BITS):
+    code = np.zeros(x.shape, dtype=np.uint64)
+    one = np.uint64(1)
+    for b in range(bits):
+        b64 = np.uint64(b)
+        code |= ((x >> b64) & one) << np.uint64(3 * b + 2)
+        code |= ((y >> b64) & one) << np.uint64(3 * b + 1)
+        code |= ((z >> b64) & one) << np.uint64(3 * b)
+    return code
+
+def morton_codes(q, bits=CURVE_BITS):
+    return interleave_bits(q[:, 0], q[:, 1], q[:, 2], bits)
+
+# Uses John Skilling's algorithm, "Programming the Hilbert curve" (2004), converting the
+# coordinates to the "transposed" Hilbert index, whose interleaved bits are the index.
+def hilbert_codes(q, bits=CURVE_BITS):
+    x = [q[:, 0].copy(), q[:, 1].copy(), q[:, 2].copy()]
+    m = 1 << (bits - 1)
+
+    # Inverse undo.
+    b = m
+    while b > 1:
+        p = np.uint64(b - 1)
+        for i in range(3):
+            is_set = (x[i] & np.uint64(b)) != 0
+            if i == 0:
+                x[0] = np.where(is_set, x[0] ^ p, x[0])
+            else:
+                t = (x[0] ^ x[i]) & p
+                x[0] = np.where(is_set, x[0] ^ p, x[0] ^ t)
+                x[i] = np.where(is_set, x[i], x[i] ^ t)
+        b >>= 1
+
+    # Gray encode.
+    x[1] ^= x[0]
+    x[2] ^= x[1]
+    t = np.zeros(x[0].shape, dtype=np.uint64)
+    b = m
+    while b > 1:
+        t = np.where((x[2] & np.uint64(b)) != 0, t ^ np.uint64(b - 1), t)
+        b >>= 1
+    for i in range(3):
+        x[i] ^= t
+
+    return interleave_bits(x[0], x[1], x[2], bits)
+
+# Returns the sorting order for bounding boxes given as NumPy arrays of minimums and maximums,
+# each with shape (N, 3).
+def sort_bbox_arrays(minis, maxis, which, axis, ascending=True):
     match which:
         case "size":
-            keyed = [(size(bboxes[i]), i) for i in range(len(bboxes))]
+            keys = np.prod(maxis - minis, axis=1)
         case "min":
-            keyed = [(mini(bboxes[i], axis), i) for i in range(len(bboxes))]
+            keys = minis[:, axis]
         case "max":
-            keyed = [(maxi(bboxes[i], axis), i) for i in range(len(bboxes))]
+            keys = maxis[:, axis]
         case "mid":
-            keyed = [(mid(bboxes[i], axis), i) for i in range(len(bboxes))]
+            keys = (minis[:, axis] + maxis[:, axis]) / 2
+        case "morton":
+            keys = morton_codes(quantize_centers(minis, maxis))
+        case "hilbert":
+            keys = hilbert_codes(quantize_centers(minis, maxis))
 
-    keyed.sort()
-    indices = [k[1] for k in keyed]
+    # A stable sort breaks ties by the original order.
+    indices = np.argsort(keys, kind="stable")
     if not ascending:
-        indices.reverse()
-    return indices
+        indices = indices[::-1]
+    return indices.tolist()
+
+# Splits the bounding boxes into `n` spatially compact parts with nearly equal total weight,
+# by recursively splitting the box centers at the weighted median along the longest axis.
+# Returns a list of arrays of indices.
+def partition_bbox_arrays(minis, maxis, weights, n):
+    centers = (minis + maxis) / 2
+    weights = np.maximum(np.asarray(weights, dtype=np.float64), 1)
+    result = []
+    stack = [(np.arange(len(centers)), n)]
+    while len(stack) > 0:
+        indices, parts = stack.pop()
+        if parts == 1 or len(indices) <= 1:
+            result.append(indices)
+            # Leave empty parts, so there are always `n` results.
+            result.extend([np.zeros(0, dtype=indices.dtype)] * (parts - 1))
+            continue
+        c = centers[indices]
+        axis = np.argmax(c.max(axis=0) - c.min(axis=0))
+        order = indices[np.argsort(c[:, axis], kind="stable")]
+        parts_left = parts // 2
+        cumulative = np.cumsum(weights[order])
+        target = cumulative[-1] * parts_left / parts
+        split = int(np.searchsorted(cumulative, target)) + 1
+        # Make sure each side has at least one item per part, if possible.
+        split = max(min(split, len(order) - (parts - parts_left)), parts_left)
+        split = min(max(split, 1), len(order) - 1)
+        # Push the right side first, so the parts come out in order along the splitting axes.
+        stack.append((order[split:], parts - parts_left))
+        stack.append((order[:split], parts_left))
+    return result
+
+def get_partition_path(path, i, n):
+    root, ext = os.path.splitext(path)
+    width = len(str(n))
+    return f"{root}-{i + 1:0{width}}{ext}"
 
 def write_obj_filenames(filenames, path):
     ids = [os.path.splitext(f)[0] for f in filenames]
@@ -123,11 +356,19 @@ if __name__ == "__main__":
     parser.add_argument("--inputmeshes", "-im", dest="input_meshes", help="path to directory of input obj meshes")
     parser.add_argument("--output", "-o", help="path to output file for sorted list")
     parser.set_defaults(sort="size")
-    parser.add_argument("--sort", help="sorting type: 'size', 'min', 'max', 'mid'")
+    parser.add_argument("--sort", help="sorting type: 'size', 'min', 'max', 'mid', 'morton', 'hilbert'")
     parser.set_defaults(axis=0)
     parser.add_argument("--axis", type=int, help="sorting axis")
     parser.set_defaults(descending=False)
     parser.add_argument("--descending", action="store_true", help="sort descending")
+    parser.set_defaults(partitions=0)
+    parser.add_argument("--partitions", "-p", type=int, help="split into this many spatially compact files, balanced by face count")
+    parser.set_defaults(workers=None)
+    parser.add_argument("--workers", "-w", type=int, help="number of processes for reading meshes (default: CPU count)")
+    parser.set_defaults(index=None)
+    parser.add_argument("--index", help="path to the bounding box index (default: next to the mesh directory)")
+    parser.set_defaults(use_index=True)
+    parser.add_argument("--noindex", dest="use_index", action="store_false", help="do not read or write a bounding box index")
     args = parser.parse_args(argv)
 
     output = args.output
@@ -136,7 +377,7 @@ if __name__ == "__main__":
         output = root + "-ascending" + ext
 
     which = args.sort
-    if not which in ["size", "min", "max", "mid"]:
+    if not which in ["size", "min", "max", "mid", "morton", "hilbert"]:
         which = "size"
 
     print(f"Using input file listing obj files: '{args.input}")
@@ -145,15 +386,43 @@ if __name__ == "__main__":
     print(f"Using sort type: '{which}'")
     print(f"Using sort axis: {args.axis}")
     print(f"Sorting descending: {args.descending}")
+    if args.partitions > 1:
+        print(f"Using partitions: {args.partitions}")
+    print(f"Using worker processes: {args.workers if args.workers else os.cpu_count()}")
+    index_path = None
+    if args.use_index:
+        index_path = args.index if args.index else get_bbox_index_path(args.input_meshes)
+    print(f"Using bounding box index: {index_path}")
 
     time_start = datetime.datetime.now()
 
     obj_filenames = read_obj_filenames(args.input)
-    obj_verts = read_obj_verts(obj_filenames, args.input_meshes)
-    bboxes = get_bboxes(obj_verts)
-    sorted_indices = sort_bboxes(bboxes, which, args.axis, not args.descending)
-    obj_filenames_sorted = [obj_filenames[i] for i in sorted_indices]
-    write_obj_filenames(obj_filenames_sorted, output)
+    if index_path:
+        index = read_bbox_index(index_path)
+        index, changed = update_bbox_index(index, obj_filenames, args.input_meshes, args.workers)
+        if changed:
+            write_bbox_index(index, index_path)
+        minis, maxis, counts = get_indexed_bboxes(index, obj_filenames)
+    else:
+        bboxes = read_obj_bboxes_parallel(obj_filenames, args.input_meshes, args.workers)
+        minis = np.array([bbox[0] for bbox in bboxes], dtype=np.float64).reshape(-1, 3)
+        maxis = np.array([bbox[1] for bbox in bboxes], dtype=np.float64).reshape(-1, 3)
+        counts = np.array([bbox[3] for bbox in bboxes], dtype=np.int64)
+    sorted_indices = sort_bbox_arrays(minis, maxis, which, args.axis, not args.descending)
+
+    if args.partitions > 1:
+        # Each partition's file keeps the sorting order of the whole list.
+        rank = np.empty(len(sorted_indices), dtype=np.int64)
+        rank[sorted_indices] = np.arange(len(sorted_indices))
+        parts = partition_bbox_arrays(minis, maxis, counts, args.partitions)
+        for i, part in enumerate(parts):
+            part_sorted = part[np.argsort(rank[part], kind="stable")]
+            path = get_partition_path(output, i, len(parts))
+            print(f"Writing {len(part)} IDs ({counts[part].sum()} faces) to '{path}'")
+            write_obj_filenames([obj_filenames[j] for j in part_sorted], path)
+    else:
+        obj_filenames_sorted = [obj_filenames[i] for i in sorted_indices]
+        write_obj_filenames(obj_filenames_sorted, output)
 
     time_end = datetime.datetime.now()
     print("Sorting started at {}".format(time_start))
@@ -0,0 +1,240 @@
+# Composites and encodes frames while render.py is still rendering, so the final movie is ready soon
+# after the last frame is rendered.  Run render.py with `--manifest`, so it lists each frame when it
+# is complete, and meanwhile run this script, which waits for batches of consecutive completed frames,
+# runs compFrames.py (for separate ROI and neuron renderings), compAxes.py and compLabels.py on each
+# batch, and pipes the finished frames to ffmpeg.  Without ffmpeg, assembleFrames.py runs at the end.
+
+# Can be run in two ways, e.g.:
+# $ blender --background --python streamFrames.py -- -i movieScript.json --axes --labels
+# Or:
+# $ python streamFrames.py --blender /path/to/blender -i movieScript.json --axes --labels
+# With render.py running at the same time, e.g.:
+# $ blender --background --python render.py -- -i movieScript.json --manifest
+
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsEncode import FfmpegEncoder, find_ffmpeg
+from utilsGeneral import report_version
+from utilsManifest import ManifestReader, frame_path
+from utilsParallel import make_blender_cmd, run_workers
+from utilsTrace import end_trace, start_trace, trace_count, trace_phase
+
+# The frames from all the renderings that are ready, after `next_frame`: consecutive frames while the
+# rendering continues, or all the rest when it is done.
+def get_ready_frames(readers, next_frame):
+    # Separate ROI and neuron renderings are composited with just the ROI frame if the neuron frame is missing.
+    def is_ready(frame):
+        return frame in readers[0].frames and all([frame in r.frames or r.done for r in readers[1:]])
+
+    if all([r.done for r in readers]):
+        return sorted([f for f in readers[0].frames if f >= next_frame])
+    if readers[0].header["frame_step"] != 1:
+        # With stepping, the frames that will exist are not known until the end.
+        return []
+    ready = []
+    frame = next_frame
+    while is_ready(frame):
+        ready.append(frame)
+        frame += 1
+    return ready
+
+def run_stage(blender_exe, script, stage_args, log_dir, batch_name):
+    neuVid_dir = os.path.dirname(os.path.realpath(__file__))
+    cmd = make_blender_cmd(blender_exe, os.path.join(neuVid_dir, script), stage_args)
+    name = f"{script} for {batch_name}"
+    log_path = os.path.join(log_dir, f"{os.path.splitext(script)[0]}_{batch_name.replace(' ', '_')}_log.txt")
+    failed = run_workers([cmd], [name], [log_path], 1)
+    if len(failed) == 0:
+        os.remove(log_path)
+    return len(failed) == 0
+
+if __name__ == "__main__":
+    report_version()
+
+    argv = sys.argv
+    if "--" in argv:
+        blender_exe = sys.argv[0]
+        argv = argv[argv.index("--") + 1:]
+    else:
+        blender_exe = "blender"
+        argv = argv[1:]
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(blender=None)
+    parser.add_argument("--blender", "-b", help="path to the Blender executable (default: the running Blender, or 'blender')")
+    parser.set_defaults(input_json_file=None)
+    parser.add_argument("--input", "-i", dest="input_json_file", help="path to the JSON file describing the video")
+    parser.set_defaults(input_frames=None)
+    parser.add_argument("--inputFrames", "-if", dest="input_frames", help="path to the frames from render.py, or from compFrames.py with separate renderings")
+    parser.set_defaults(input_rois=None)
+    parser.add_argument("--inputRois", "-ir", dest="input_rois", help="path to the ROI frames from render.py, to be composited with compFrames.py")
+    parser.set_defaults(input_neurons=None)
+    parser.add_argument("--inputNeurons", "-in", dest="input_neurons", help="path to the neuron frames from render.py, to be composited with compFrames.py")
+    parser.set_defaults(octane=False)
+    parser.add_argument("--octane", "-oct", dest="octane", action="store_true", help="neurons were rendered with Octane")
+    parser.set_defaults(axes=False)
+    parser.add_argument("--axes", "-ax", dest="axes", action="store_true", help="add axes with compAxes.py")
+    parser.set_defaults(labels=False)
+    parser.add_argument("--labels", "-la", dest="labels", action="store_true", help="add labels with compLabels.py")
+    parser.set_defaults(output=None)
+    parser.add_argument("--output", "-o", help="path for the output movie (default: the JSON file with extension .mp4)")
+    parser.set_defaults(width=1920)
+    parser.add_argument("--width", "-iw", type=int, dest="width", help="final video frame width")
+    parser.set_defaults(height=1080)
+    parser.add_argument("--height", "-ih", type=int, dest="height", help="final video frame height")
+    parser.set_defaults(stretch=1)
+    parser.add_argument("--stretch", "-s", type=int, dest="stretch", help="stretch factor (e.g., 2 means twice as long)")
+    parser.set_defaults(padding=0)
+    parser.add_argument("--pad", "-p", type=int, dest="padding", help="pad with this many copies of the last frame")
+    parser.set_defaults(fps=24)
+    parser.add_argument("--fps", type=int, dest="fps", help="frames per second of the movie")
+    parser.set_defaults(batch=48)
+    parser.add_argument("--batch", "-ba", type=int, dest="batch", help="number of completed frames to wait for before processing them")
+    parser.set_defaults(poll=5)
+    parser.add_argument("--poll", type=float, dest="poll", help="seconds between checks for completed frames")
+    parser.set_defaults(workers=1)
+    parser.add_argument("--workers", "-w", type=int, dest="workers", help="number of Blender processes for each compositing step")
+    parser.set_defaults(ffmpeg=None)
+    parser.add_argument("--ffmpeg", dest="ffmpeg", help="path to the ffmpeg executable (default: ffmpeg from the PATH)")
+    args = parser.parse_args(argv)
+
+    if args.blender:
+        blender_exe = args.blender
+    if (args.axes or args.labels) and not args.input_json_file:
+        print("Error: --axes and --labels require the JSON file, -i")
+        sys.exit()
+
+    comp = args.input_rois != None or args.input_neurons != None
+    if comp and (args.input_rois == None or args.input_neurons == None):
+        print("Error: compositing separate renderings requires both -ir and -in")
+        sys.exit()
+
+    frames_dir = args.input_frames
+    if not frames_dir:
+        if not args.input_json_file:
+            print("Error: missing -if, or -i to infer it")
+            sys.exit()
+        frames_dir = f"{os.path.splitext(args.input_json_file)[0]}-frames"
+    render_dirs = [args.input_rois, args.input_neurons] if comp else [frames_dir]
+
+    # The same output directories as the scripts use by default.
+    stage_dirs = [frames_dir]
+    if args.axes:
+        stage_dirs.append(f"{stage_dirs[-1]}-axes")
+    if args.labels:
+        stage_dirs.append(f"{stage_dirs[-1]}-labeled")
+    final_dir = stage_dirs[-1]
+
+    output = args.output
+    if not output:
+        output = os.path.splitext(args.input_json_file if args.input_json_file else final_dir)[0] + ".mp4"
+
+    ffmpeg = find_ffmpeg(args.ffmpeg)
+
+    print(f"Using Blender executable: {blender_exe}")
+    print(f"Watching the manifests of: {', '.join(render_dirs)}")
+    print(f"Using final frames: {final_dir}")
+    if ffmpeg:
+        print(f"Encoding movie with {ffmpeg}: {output}")
+    else:
+        print("No ffmpeg, so running assembleFrames.py when the rendering is done")
+
+    time_start = datetime.datetime.now()
+    start_trace("streamFrames")
+
+    readers = [ManifestReader(d) for d in render_dirs]
+    encoder = None
+    log_dir = tempfile.mkdtemp()
+    missing = []
+    next_frame = None
+    last_encoded = None
+    failed = False
+    while not failed:
+        if not all([r.update() and r.header for r in readers]):
+            time.sleep(args.poll)
+            continue
+        if next_frame == None:
+            next_frame = readers[0].header["frame_start"]
+            print(f"Rendering frames {next_frame} to {readers[0].header['frame_end']}")
+
+        done = all([r.done for r in readers])
+        frames = get_ready_frames(readers, next_frame)
+        if len(frames) == 0 and done:
+            break
+        if len(frames) < args.batch and not done:
+            time.sleep(args.poll)
+            continue
+
+        first, last = frames[0], frames[-1]
+        batch_name = f"frames {first} to {last}"
+        print(f"Processing {batch_name}")
+        workers = ["--workers", str(args.workers)]
+        if comp:
+            stage_args = ["-ir", args.input_rois, "-in", args.input_neurons, "-o", frames_dir, "--start", str(first), "--end", str(last)]
+            stage_args += ["--octane"] if args.octane else []
+            with trace_phase("compFrames"):
+                failed = not run_stage(blender_exe, "compFrames.py", stage_args + workers, log_dir, batch_name)
+        stages = (["compAxes.py"] if args.axes else []) + (["compLabels.py"] if args.labels else [])
+        for i, script in enumerate(stages):
+            if failed:
+                break
+            stage_args = ["-i", args.input_json_file, "-if", stage_dirs[i], "-o", stage_dirs[i + 1],
+                "--frame-start", str(first), "--frame-end", str(last)]
+            with trace_phase(os.path.splitext(script)[0]):
+                failed = not run_stage(blender_exe, script, stage_args + workers, log_dir, batch_name)
+        if failed:
+            break
+
+        if ffmpeg:
+            with trace_phase("encode"):
+                if not encoder:
+                    encoder = FfmpegEncoder(output, args.fps, ffmpeg, width=args.width, height=args.height)
+                for frame in frames:
+                    png_path = frame_path(final_dir, frame, ".png")
+                    if not os.path.isfile(png_path):
+                        missing.append(png_path)
+                        continue
+                    if not encoder.add_frame(png_path, args.stretch):
+                        print("Error: ffmpeg stopped")
+                        failed = True
+                        break
+                    last_encoded = png_path
+                    trace_count("frames")
+        next_frame = last + 1
+
+    if encoder:
+        with trace_phase("encode"):
+            if last_encoded and args.padding > 0 and not failed:
+                encoder.add_frame(last_encoded, args.padding)
+            if encoder.close() != 0:
+                print("Error: ffmpeg failed")
+                failed = True
+    elif not ffmpeg and not failed:
+        output_dir = os.path.dirname(os.path.abspath(output))
+        stage_args = ["-i", final_dir, "-o", output_dir, "--width", str(args.width), "--height", str(args.height),
+            "--stretch", str(args.stretch), "--pad", str(args.padding)]
+        with trace_phase("assembleFrames"):
+            failed = not run_stage(blender_exe, "assembleFrames.py", stage_args, log_dir, "all frames")
+        output = output_dir
+    trace_count("frames_missing", len(missing))
+    end_trace()
+
+    if len(os.listdir(log_dir)) == 0:
+        os.rmdir(log_dir)
+    if len(missing) > 0:
+        print(f"Frames missing from the movie: {missing}")
+    if failed:
+        print(f"Error: stopped early (logs in {log_dir})")
+    else:
+        print(f"Wrote movie to {output}")
+
+    time_end = datetime.datetime.now()
+    print(f"Streaming started at {time_start}")
+    print(f"Streaming ended at {time_end}")
+    print(f"Elapsed time: {time_end - time_start}")
@@ -0,0 +1,153 @@
+# Summarizes the JSON-lines trace files written by the neuVid scripts when the environment
+# variable NEUVID_TRACE is set (see utilsTrace.py), and compares runs of the same script.
+
+# Run with plain Python, e.g.:
+# $ NEUVID_TRACE=trace.jsonl blender --background --python render.py -- -i example.json
+# $ NEUVID_TRACE=trace.jsonl blender --background --python render.py -- -i example.json --cull
+# $ python summarizeTrace.py trace.jsonl
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsGeneral import report_version
+
+def read_runs(paths):
+    runs = {}
+    for path in paths:
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except OSError as e:
+            print(f"Error: cannot read trace file '{path}': {str(e)}")
+            sys.exit()
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Warning: skipping invalid line {i + 1} of '{path}'")
+                continue
+            id = record.get("run")
+            if not id in runs:
+                runs[id] = {"id": id, "script": record.get("script"), "time": record.get("time"), "phases": {},
+                    "secs": None, "counts": {}, "peak_rss_mb": None}
+            run = runs[id]
+            event = record.get("event")
+            if event == "start":
+                run["time"] = record["time"]
+                run["argv"] = record.get("argv", [])
+            elif event == "phase":
+                # Phases with the same path (e.g., one per render interval) are accumulated.
+                phase = run["phases"].setdefault(record["phase"], {"secs": 0, "calls": 0})
+                phase["secs"] += record["secs"]
+                phase["calls"] += 1
+            elif event == "end":
+                run["secs"] = record["secs"]
+                run["counts"] = record.get("counts", {})
+                run["peak_rss_mb"] = record.get("peak_rss_mb")
+    return sorted(runs.values(), key=lambda r: r["time"] or "")
+
+# Phase records are written when phases end, so children come before their parents.
+# Reorder to put each parent first.
+def ordered_paths(paths):
+    result = []
+    for path in paths:
+        parts = path.split("/")
+        for i in range(1, len(parts) + 1):
+            ancestor = "/".join(parts[:i])
+            if not ancestor in result:
+                result.append(ancestor)
+    return result
+
+def format_secs(secs):
+    return f"{secs:10.2f}" if secs != None else f"{'?':>10}"
+
+def print_run(run):
+    print(f"{run['script']} run {run['id']}, started {run['time']}")
+    if run["secs"] == None:
+        print("  (incomplete: no end record)")
+    else:
+        rss = f", peak RSS {run['peak_rss_mb']:.0f} MB" if run["peak_rss_mb"] != None else ""
+        print(f"  total {run['secs']:.2f} secs{rss}")
+    for path in ordered_paths(run["phases"].keys()):
+        if not path in run["phases"]:
+            continue
+        phase = run["phases"][path]
+        depth = path.count("/")
+        name = "  " * depth + path.split("/")[-1]
+        mean = phase["secs"] / phase["calls"]
+        print(f"  {name:<30} {format_secs(phase['secs'])} secs  {phase['calls']:6} calls  {mean:10.3f} secs/call")
+    for name, count in sorted(run["counts"].items()):
+        print(f"  {name:<30} {count:10}")
+    print()
+
+def print_comparison(script, runs):
+    print(f"Comparison of {len(runs)} {script} runs (secs, and ratio to the first run):")
+    paths = []
+    for run in runs:
+        for path in run["phases"].keys():
+            if not path in paths:
+                paths.append(path)
+    header = "".join([f"{run['id']:>20}" for run in runs])
+    print(f"  {'':<30}{header}")
+
+    def row(label, values):
+        cells = []
+        for v in values:
+            if v == None:
+                cells.append(f"{'-':>20}")
+            elif values[0]:
+                cells.append(f"{v:12.2f} ({v / values[0]:4.2f}x)")
+            else:
+                cells.append(f"{v:20.2f}")
+        print(f"  {label:<30}" + "".join(cells))
+
+    row("total", [run["secs"] for run in runs])
+    for path in ordered_paths(paths):
+        name = "  " * path.count("/") + path.split("/")[-1]
+        row(name, [run["phases"][path]["secs"] if path in run["phases"] else None for run in runs])
+    names = sorted(set([name for run in runs for name in run["counts"].keys()]))
+    for name in names:
+        row(name, [run["counts"].get(name) for run in runs])
+    row("peak RSS (MB)", [run["peak_rss_mb"] for run in runs])
+    print()
+
+if __name__ == "__main__":
+    report_version()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("traces", nargs="+", help="paths to the trace files")
+    parser.set_defaults(script=None)
+    parser.add_argument("--script", "-sc", help="only summarize runs of this script (e.g., render)")
+    parser.set_defaults(last=None)
+    parser.add_argument("--last", "-l", type=int, help="only summarize the last this many runs of each script")
+    parser.set_defaults(no_details=False)
+    parser.add_argument("--nodetails", "-nd", dest="no_details", action="store_true", help="print only the comparisons")
+    args = parser.parse_args()
+
+    runs = read_runs(args.traces)
+    if args.script:
+        runs = [run for run in runs if run["script"] == args.script]
+    if len(runs) == 0:
+        print("No runs found")
+        sys.exit()
+
+    scripts = []
+    for run in runs:
+        if not run["script"] in scripts:
+            scripts.append(run["script"])
+
+    for script in scripts:
+        script_runs = [run for run in runs if run["script"] == script]
+        if args.last:
+            script_runs = script_runs[-args.last:]
+        if not args.no_details:
+            for run in script_runs:
+                print_run(run)
+        if len(script_runs) > 1:
+            print_comparison(script, script_runs)
@@ -0,0 +1,151 @@
+# Encoding PNG frames into a movie with ffmpeg, without Blender.  The frames can be piped to ffmpeg one
+# at a time, so encoding can proceed while frames are still being produced, or existing frame files can
+# be listed for ffmpeg's "concat" demuxer, with the duration of each (for stretching and padding) so no
+# copies are needed, and encoded in chunks by several ffmpeg processes at once.  Needs the ffmpeg executable (e.g., from https://ffmpeg.org/download.html).
+
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+
+DEFAULT_CODEC = "libx264"
+DEFAULT_CRF = 18
+DEFAULT_PIX_FMT = "yuv420p"
+
+def find_ffmpeg(ffmpeg=None):
+    return shutil.which(ffmpeg if ffmpeg else "ffmpeg")
+
+# The ffmpeg arguments for the output, with a `threads` of 0 letting ffmpeg choose.
+# With `interpolate`, frames shown for longer than one frame time are blended into the next ones.
+def get_output_args(output_file, fps, width=None, height=None, codec=DEFAULT_CODEC, crf=DEFAULT_CRF,
+    pix_fmt=DEFAULT_PIX_FMT, threads=0, gop=None, interpolate=False):
+    if width and height:
+        filters = [f"scale={width}:{height}"]
+    else:
+        # The H.264 encoding with 4:2:0 chroma subsampling needs an even width and height.
+        filters = ["scale=trunc(iw/2)*2:trunc(ih/2)*2"]
+    if interpolate:
+        filters.insert(0, f"framerate=fps={fps}")
+    args = ["-vf", ",".join(filters)]
+    args += ["-r", str(fps), "-c:v", codec, "-pix_fmt", pix_fmt, "-threads", str(threads)]
+    if crf != None:
+        args += ["-crf", str(crf)]
+    if gop:
+        args += ["-g", str(gop)]
+    return args + [output_file]
+
+class FfmpegEncoder:
+    # The `options` are those of `get_output_args`.
+    def __init__(self, output_file, fps=24, ffmpeg="ffmpeg", **options):
+        cmd = [ffmpeg, "-y", "-loglevel", "error", "-f", "image2pipe", "-c:v", "png", "-framerate", str(fps), "-i", "-"]
+        cmd += get_output_args(output_file, fps, **options)
+        self.output_file = output_file
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self.frames = 0
+
+    # Adds the PNG file as the next frame, repeated `copies` times (e.g., for stretching or padding).
+    # Returns False if ffmpeg has stopped.
+    def add_frame(self, png_path, copies=1):
+        with open(png_path, "rb") as f:
+            data = f.read()
+        try:
+            for i in range(copies):
+                self.proc.stdin.write(data)
+        except BrokenPipeError:
+            return False
+        self.frames += copies
+        return True
+
+    # Finishes the movie, and returns ffmpeg's exit code.
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        return self.proc.wait()
+
+def _concat_quote(path):
+    return "'" + os.path.abspath(path).replace("'", "'\\''") + "'"
+
+# Writes the list for ffmpeg's "concat" demuxer, with `entries` of (file path, frame count) pairs.
+def _write_concat_list(list_path, entries, fps):
+    with open(list_path, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        for path, count in entries:
+            f.write(f"file {_concat_quote(path)}\nduration {count / fps:.6f}\n")
+        # The demuxer ignores the duration of the last file unless the file is listed again.
+        if len(entries) > 0:
+            f.write(f"file {_concat_quote(entries[-1][0])}\n")
+
+def _encode_entries(entries, output_file, fps, ffmpeg, tmp, name, options):
+    list_path = os.path.join(tmp, f"{name}.txt")
+    _write_concat_list(list_path, entries, fps)
+    cmd = [ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+    # Limit the output to the listed durations, excluding the extra listing of the last file.
+    total_frames = sum([count for _, count in entries])
+    cmd += ["-t", f"{total_frames / fps:.6f}"]
+    cmd += get_output_args(output_file, fps, **options)
+    return subprocess.Popen(cmd)
+
+# Splits the (file path, frame count) entries into at most `chunks` chunks, each with a multiple of
+# `gop` frames (except the last), so each chunk starts a new group of pictures.
+def split_entries(entries, chunks, gop):
+    total_frames = sum([count for _, count in entries])
+    chunk_frames = max(1, math.ceil(total_frames / chunks / gop)) * gop
+    result = []
+    current = []
+    n = 0
+    for path, count in entries:
+        while count > 0:
+            used = min(count, chunk_frames - n)
+            current.append((path, used))
+            n += used
+            count -= used
+            if n == chunk_frames:
+                result.append(current)
+                current = []
+                n = 0
+    if len(current) > 0:
+        result.append(current)
+    return result
+
+# Encodes the frame files, each shown for `stretch` frames, and the last one for `padding` more.
+# Returns ffmpeg's exit code.
+def encode_frame_files(png_paths, output_file, fps=24, stretch=1, padding=0, ffmpeg="ffmpeg", chunks=1, gop=None, **options):
+    entries = [(path, stretch) for path in png_paths]
+    if len(entries) > 0:
+        entries[-1] = (entries[-1][0], stretch + padding)
+    return encode_frame_entries(entries, output_file, fps, ffmpeg, chunks, gop, **options)
+
+# Encodes the (file path, frame count) entries, each file shown for its count of frames.
+# With `chunks` greater than 1, parts of the movie are encoded at the same time by separate ffmpeg
+# processes, with `gop` frames between key frames and a `threads` of 0 meaning an equal share of the
+# cores for each, and then joined without re-encoding.
+# Returns ffmpeg's exit code.
+def encode_frame_entries(entries, output_file, fps=24, ffmpeg="ffmpeg", chunks=1, gop=None, **options):
+    with tempfile.TemporaryDirectory() as tmp:
+        if chunks <= 1:
+            return _encode_entries(entries, output_file, fps, ffmpeg, tmp, "frames", options).wait()
+
+        if not gop:
+            gop = 2 * fps
+        options = dict(options, gop=gop)
+        chunk_entries = split_entries(entries, chunks, gop)
+        # Divide the cores among the chunks' encoders, instead of letting each use all of them.
+        if not options.get("threads"):
+            options["threads"] = max(1, os.cpu_count() // max(1, len(chunk_entries)))
+        chunk_files = [os.path.join(tmp, f"chunk_{i}{os.path.splitext(output_file)[1]}") for i in range(len(chunk_entries))]
+        procs = [_encode_entries(e, f, fps, ffmpeg, tmp, f"chunk_{i}", options) for i, (e, f) in enumerate(zip(chunk_entries, chunk_files))]
+        returncodes = [proc.wait() for proc in procs]
+        failed = [code for code in returncodes if code != 0]
+        if len(failed) > 0:
+            return failed[0]
+
+        list_path = os.path.join(tmp, "chunks.txt")
+        with open(list_path, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for chunk_file in chunk_files:
+                f.write(f"file {_concat_quote(chunk_file)}\n")
+        cmd = [ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_file]
+        return subprocess.run(cmd).returncode
@@ -0,0 +1,80 @@
+# Indexing the frame files in a directory (e.g., "0001.png", "0002.png", ...), for the scripts that
+# process frames.  One pass of `os.scandir` (faster than `os.listdir` plus a `stat` per file on shared
+# file systems) gives a set of frame numbers for constant-time membership tests, and a sorted list of
+# them for ranges found by bisection.
+
+import bisect
+import json
+import os
+
+# The file listing the frames with motion (of the camera or objects) since the previous frame, written
+# by `render.py --denoiseLater` so denoiseFrames.py blends only frames with no motion between them.
+MOTION_FRAMES_NAME = "motionFrames.json"
+
+class FrameIndex:
+    def __init__(self, dir, ext):
+        self.dir = dir
+        self.ext = ext
+        # From frame number to file name without the extension, which may have leading zeros.
+        self.names = {}
+        # Files with the extension but without a frame number as the name.
+        self.others = []
+        try:
+            with os.scandir(dir) as entries:
+                for entry in entries:
+                    base, e = os.path.splitext(entry.name)
+                    if e != ext:
+                        continue
+                    if base.isdigit():
+                        self.names[int(base)] = base
+                    else:
+                        self.others.append(base)
+        except FileNotFoundError:
+            pass
+        self.frames = sorted(self.names.keys())
+        self.others.sort()
+
+    def __contains__(self, frame):
+        return frame in self.names
+
+    def __len__(self):
+        return len(self.frames)
+
+    def path(self, frame):
+        return os.path.join(self.dir, self.names[frame] + self.ext)
+
+    # The frames from `start_frame` to `end_frame`, inclusive, either of which can be None for no limit.
+    def frames_in_range(self, start_frame=None, end_frame=None):
+        i0 = bisect.bisect_left(self.frames, start_frame) if start_frame != None else 0
+        i1 = bisect.bisect_right(self.frames, end_frame) if end_frame != None else len(self.frames)
+        return self.frames[i0:i1]
+
+    # All the file names with the extension, frames in numerical order followed by any others.
+    def file_names(self):
+        return [self.names[f] + self.ext for f in self.frames] + [o + self.ext for o in self.others]
+
+# The indices of the first and last of the sorted `frames` to process for `start_frame` and `end_frame`
+# (either of which can be None for no limit): the last frame at or before `start_frame`, and the first
+# frame at or after `end_frame`.
+def get_frame_indices(start_frame, end_frame, frames):
+    if not start_frame:
+        i0 = 0
+    else:
+        i0 = max(bisect.bisect_right(frames, start_frame) - 1, 0)
+    if not end_frame:
+        i1 = len(frames) - 1
+    else:
+        i1 = min(bisect.bisect_left(frames, end_frame), len(frames) - 1)
+    return i0, i1
+
+def write_motion_frames(frames_dir, frames):
+    with open(os.path.join(frames_dir, MOTION_FRAMES_NAME), "w") as f:
+        json.dump({"motionFrames": sorted(frames)}, f)
+
+# The set of frames with motion, or None if the file does not exist.
+def read_motion_frames(frames_dir):
+    try:
+        with open(os.path.join(frames_dir, MOTION_FRAMES_NAME)) as f:
+            return set(json.load(f)["motionFrames"])
+    except FileNotFoundError:
+        return None
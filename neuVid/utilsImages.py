@@ -0,0 +1,111 @@
+# Image utilities that do not need Blender: reading the passes of the OpenEXR multilayer files
+# from render.py, converting linear colors for display, writing PNG files, and reading and writing
+# PFM files (e.g., for OpenImageDenoise).
+
+# Reading OpenEXR files requires the OpenEXR Python bindings:
+# $ pip install OpenEXR
+# View transforms other than "Standard" (e.g., Blender's default "Filmic") require PyOpenColorIO
+# and Blender's OpenColorIO configuration (e.g., <blender>/<version>/datafiles/colormanagement/config.ocio):
+# $ pip install opencolorio
+
+import numpy as np
+import struct
+import zlib
+
+# Returns a dictionary from pass name (e.g., "Combined", "Mist", "Depth") to a NumPy float32 array,
+# with shape (height, width, 4) for a pass with RGBA channels, (height, width, 3) for a pass with RGB
+# or XYZ channels (e.g., "Denoising Albedo", "Denoising Normal") and (height, width) for a pass with one.
+def read_exr_passes(path):
+    import Imath
+    import OpenEXR
+
+    file = OpenEXR.InputFile(path)
+    try:
+        header = file.header()
+        dw = header["dataWindow"]
+        width = dw.max.x - dw.min.x + 1
+        height = dw.max.y - dw.min.y + 1
+
+        # Multilayer channel names are like "View Layer.Combined.R".
+        passes = {}
+        for name in header["channels"].keys():
+            parts = name.split(".")
+            if len(parts) < 3:
+                continue
+            passes.setdefault(parts[-2], {})[parts[-1]] = name
+
+        float_type = Imath.PixelType(Imath.PixelType.FLOAT)
+        def channel(name):
+            return np.frombuffer(file.channel(name, float_type), dtype=np.float32).reshape(height, width)
+
+        result = {}
+        for pass_name, channels in passes.items():
+            if all([c in channels for c in "RGBA"]):
+                result[pass_name] = np.stack([channel(channels[c]) for c in "RGBA"], axis=-1)
+            elif all([c in channels for c in "RGB"]):
+                result[pass_name] = np.stack([channel(channels[c]) for c in "RGB"], axis=-1)
+            elif all([c in channels for c in "XYZ"]):
+                result[pass_name] = np.stack([channel(channels[c]) for c in "XYZ"], axis=-1)
+            elif len(channels) == 1:
+                result[pass_name] = channel(list(channels.values())[0])
+        return result
+    finally:
+        file.close()
+
+def linear_to_srgb(x):
+    x = np.clip(x, 0, 1)
+    return np.where(x <= 0.0031308, 12.92 * x, 1.055 * np.power(x, 1 / 2.4) - 0.055)
+
+_ocio_processors = {}
+
+# Applies the view transform for the "sRGB" display to the linear RGB of `rgba`, like Blender
+# when saving a PNG file.  The "Standard" transform needs no OpenColorIO configuration.
+def apply_view_transform(rgba, view_transform="Standard", ocio_config=None):
+    result = rgba.copy()
+    if view_transform == "Standard":
+        result[..., :3] = linear_to_srgb(rgba[..., :3])
+        return result
+
+    key = (view_transform, ocio_config)
+    if not key in _ocio_processors:
+        import PyOpenColorIO as ocio
+        config = ocio.Config.CreateFromFile(ocio_config) if ocio_config else ocio.GetCurrentConfig()
+        transform = ocio.DisplayViewTransform(src=ocio.ROLE_SCENE_LINEAR, display="sRGB", view=view_transform)
+        _ocio_processors[key] = config.getProcessor(transform).getDefaultCPUProcessor()
+    rgb = np.ascontiguousarray(rgba[..., :3], dtype=np.float32)
+    _ocio_processors[key].applyRGB(rgb)
+    result[..., :3] = rgb
+    return result
+
+# Matches Blender's rounding from float to 8 bits.
+def to_uint8(x):
+    return (np.clip(x, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+def write_png(path, pixels):
+    height, width, channels = pixels.shape
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    # Each row starts with the filter type, 0 for none.
+    rows = np.zeros((height, 1 + width * channels), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, -1)
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+# PFM files store the rows from bottom to top, as little-endian floats with a negative scale.
+def write_pfm(path, pixels):
+    height, width = pixels.shape[:2]
+    with open(path, "wb") as f:
+        f.write("PF\n{} {}\n-1.0\n".format(width, height).encode())
+        f.write(np.ascontiguousarray(pixels[::-1, :, :3], dtype="<f4").tobytes())
+
+def read_pfm(path):
+    with open(path, "rb") as f:
+        channels = 3 if f.readline().strip() == b"PF" else 1
+        width, height = [int(x) for x in f.readline().split()]
+        dtype = "<f4" if float(f.readline()) < 0 else ">f4"
+        data = np.frombuffer(f.read(width * height * channels * 4), dtype=dtype)
+    return data.reshape(height, width, channels)[::-1].astype(np.float32)
@@ -0,0 +1,378 @@
+# Planning of the render intervals for render.py, independent of Blender.
+# Animation curves are plain lists of (frame, value) keys, so this code can be run and
+# benchmarked without Blender (see test/benchmark-planning.py).
+
+import bisect
+import sys
+
+# The keys of a Blender fcurve, as a list of (frame, value).
+def keysFromFcurve(fc):
+    return [(int(key.co[0]), key.co[1]) for key in fc.keyframe_points]
+
+# "Rest intervals" are periods in time where nothing is being animated.
+# Ideally, rendering can be avoided during such an interval, being replaced
+# with copying of the last frame before the start of the interval.
+# Appends to `restIntervals` the start ("s") and end ("e") points of the rest intervals of
+# the curve with the given `id` and `keys`.
+def addRestIntervals(restIntervals, id, keys, frameEnd):
+    fStart = 1
+    # The value for the first resting interval is not known until the first key,
+    # with its value.
+    vStart = None
+    fEnd = None
+    for f, v in keys:
+        if (vStart == None or v == vStart) and f != fStart:
+            # The first key define the value of the first resting interval.
+            vStart = v
+            fEnd = f
+        else:
+            if fEnd:
+                restIntervals.append((fStart, "s", id))
+                restIntervals.append((fEnd, "e", id))
+            vStart = v
+            fStart = f
+            fEnd = None
+    fEnd = frameEnd
+    if fStart != fEnd:
+        restIntervals.append((fStart, "s", id))
+        restIntervals.append((fEnd, "e", id))
+
+# Whether a curve with the given `keys` changes value anywhere from frame `fStart` to `fEnd`.
+def keysChangeBetween(keys, fStart, fEnd):
+    for (f0, v0), (f1, v1) in zip(keys, keys[1:]):
+        if v0 != v1 and f0 < fEnd and f1 > fStart:
+            return True
+    return False
+
+# The frames at which a curve with the given `keys` has a different value than at the previous frame.
+def keysChangeFrames(keys):
+    result = set()
+    for (f0, v0), (f1, v1) in zip(keys, keys[1:]):
+        if v0 != v1:
+            result.update(range(f0 + 1, f1 + 1))
+    return result
+
+# The intervals that need rendering, when not all of the `numCurves` curves are resting.
+def findRenderIntervals(restIntervals, numCurves, frameStart, frameEnd):
+    restingCurves = set()
+    renderIntervals = []
+    fStartRendering = frameStart
+    allResting = False
+
+    for pt in sorted(restIntervals):
+        if pt[1] == "s":
+            restingCurves.add(pt[2])
+        else:
+            restingCurves.remove(pt[2])
+        if len(restingCurves) == numCurves:
+            allResting = True
+            fEndRendering = pt[0] + 1
+            renderIntervals.append((fStartRendering, fEndRendering))
+        elif allResting:
+            allResting = False
+            fStartRendering = pt[0] - 1
+
+    if fStartRendering < frameEnd:
+        renderIntervals.append((fStartRendering, frameEnd))
+
+    # If there is no animation, add an interval anyway, or nothing will render.
+    if len(renderIntervals) == 0:
+        renderIntervals.append((1, 1))
+    return renderIntervals
+
+def clipRenderIntervals(renderIntervals, fStartOverall, fEndOverall):
+    renderIntervalsClipped = []
+    for ri in renderIntervals:
+        fStart = int(ri[0])
+        fEnd = int(ri[1])
+
+        if fEnd < fStartOverall:
+            continue
+        if fEndOverall < fStart:
+            break
+        if fStart < fStartOverall and fStartOverall < fEnd:
+            fStart = fStartOverall
+        if fStart <= fEndOverall and fEndOverall < fEnd:
+            fEnd = fEndOverall
+
+        renderIntervalsClipped.append((fStart, fEnd))
+
+    # TODO: There is a problem if fStartOverall is bewteen render intervals:
+    # we need to render one frame at the end of the preceding render interval,
+    # then copy.  The following is only a partial fix.
+    if len(renderIntervalsClipped) == 0:
+        renderIntervalsClipped.append((fStartOverall, fEndOverall))
+    return renderIntervalsClipped
+
+# Returns a dictionary from frame to a list of (name, hide_render) pairs, for the frames where
+# hide_render must change.  The argument is a list of (name, keys) for the alpha curves,
+# with keys being None for a name without a curve.
+def findHideRenderFrames(namesAndKeys):
+    hideRenderAtFrame = {}
+    for name, keys in namesAndKeys:
+        if keys:
+            # Go through the keys, looking for keys i and i+1 both setting alpha to 0
+            # and i+2 setting alpha > 0.  Then hideRenderAtFrame is True for the
+            # key i's frame (fStartHidden), and  False for key i+1's frame (fAlpha0).
+            fAlpha0 = None
+            fStartHidden = None
+            firstKey = True
+            for f, v in keys:
+                if v == 0.0:
+                    if not fStartHidden:
+                        if firstKey:
+                            fStartHidden = 1
+                        else:
+                            fStartHidden = f
+                    fAlpha0 = f
+                else:
+                    if fStartHidden and fAlpha0 and fStartHidden < fAlpha0:
+                        hideRenderAtFrame.setdefault(fStartHidden, []).append((name, True))
+                        hideRenderAtFrame.setdefault(fAlpha0, []).append((name, False))
+                    elif firstKey:
+                        hideRenderAtFrame.setdefault(1, []).append((name, False))
+                    fAlpha0 = None
+                    fStartHidden = None
+                firstKey = False
+            if fStartHidden != None:
+                hideRenderAtFrame.setdefault(fStartHidden, []).append((name, True))
+    return hideRenderAtFrame
+
+# Splits the render intervals so a new interval starts at each of the sorted `frames`
+# (e.g., where hide_render must change).
+def splitRenderIntervals(renderIntervals, frames):
+    result = []
+    for ri in renderIntervals:
+        fStart = int(ri[0])
+        fEnd = int(ri[1])
+        while True:
+            i = bisect.bisect_right(frames, fStart)
+            if i < len(frames) and frames[i] < fEnd:
+                result.append((fStart, frames[i] - 1))
+                fStart = frames[i]
+            else:
+                result.append((fStart, fEnd))
+                break
+    return result
+
+# Returns a sorted list of (f, s), where s is the set of objects to be given hide_render = True
+# at frame f.
+def findHideRenderTrueFrames(hideRenderChangesAtFrame, frameEnd):
+    hideRenderTrueFrames = []
+    hideRenderTrue = set()
+    for f in sorted(hideRenderChangesAtFrame):
+        pairs = hideRenderChangesAtFrame[f]
+        for pair in pairs:
+            if pair[1]:
+                hideRenderTrue.add(pair[0])
+            elif pair[0] in hideRenderTrue:
+                hideRenderTrue.remove(pair[0])
+        hideRenderTrueFrames.append((f, hideRenderTrue.copy()))
+
+    # Put a sentinel at the last frame of the animation, to simplfy the rendering
+    # of intervals.
+    hideRenderTrueFrames.append((frameEnd, hideRenderTrue.copy()))
+
+    hideRenderTrueFrames.sort(key=lambda x: x[0])
+    return hideRenderTrueFrames
+
+def hideRenderTrueAtFrame(f, hideRenderTrueFrames):
+    hrtfPrev = None
+    for hrtf in hideRenderTrueFrames:
+        if f == hrtf[0]:
+            return hrtf[1]
+        elif f < hrtf[0] and hrtfPrev:
+            return hrtfPrev[1]
+        hrtfPrev = hrtf
+    return []
+
+# The argument `alphaKeys` is a list of the keys of all the alpha curves, with None for objects
+# without a curve.
+def findFadingIntervals(alphaKeys, hideRenderTrueFrames, debug=False):
+    fadingIntervalsRaw = []
+    for keys in alphaKeys:
+        if keys:
+            fPrev = None
+            vPrev = None
+            for f, v in keys:
+                if vPrev != None:
+                    if (vPrev == 0 and v > 0) or (vPrev > 0 and v == 0):
+                        fadingIntervalsRaw.append((fPrev, f))
+                fPrev = f
+                vPrev = v
+    fadingIntervalsRaw.sort()
+    fadingIntervals = []
+    fStart = None
+    fEnd = None
+    n = 0
+    for i in range(len(fadingIntervalsRaw)):
+        fi = fadingIntervalsRaw[i]
+        if not fStart:
+            fStart = fi[0]
+            fEnd = fi[1]
+        else:
+            if fi[0] == fStart:
+                fEnd = max(fEnd, fi[1])
+                n += 1
+            if (fi[0] != fStart) or (i == len(fadingIntervalsRaw) - 1):
+                hidden = hideRenderTrueAtFrame(fStart, hideRenderTrueFrames)
+                p = n / (len(alphaKeys) - len(hidden))
+
+                if debug:
+                    print("fading from {} to {}; {} / {} or p {}".
+                        format(fStart, fEnd, n, (len(alphaKeys) - len(hidden)), p))
+
+                if p > 0.5:
+                    fadingIntervals.append((fStart, fEnd))
+                    print("significant fading {} from {} to {}".format(p, fStart, fEnd))
+                fStart = None
+                n = 0
+    return fadingIntervals
+
+def combineRenderIntervals(renderIntervalsA, renderIntervalsB):
+    # Priority given to renderIntervalsA.
+    # Both should be sorted on the first element of the interval tuple.
+    result = []
+    renderIntervalsA2 = [x for x in renderIntervalsA]
+    renderIntervalsB2 = [x for x in renderIntervalsB]
+    iA = 0
+    iB = 0
+    while iA < len(renderIntervalsA2) or iB < len(renderIntervalsB2):
+        if iB >= len(renderIntervalsB2):
+            result.append(renderIntervalsA2[iA])
+            iA += 1
+        elif iA >= len(renderIntervalsA2):
+            result.append(renderIntervalsB2[iB])
+            iB += 1
+        else:
+            riA = renderIntervalsA2[iA]
+            riB = renderIntervalsB2[iB]
+            if riA[0] < riB[0] and riA[1] <= riB[0]:
+                result.append(riA)
+                iA += 1
+            elif riB[0] < riA[1] and riB[1] <= riA[0]:
+                result.append(riB)
+                iB += 1
+            else:
+                if riA[0] <= riB[0]:
+                    if riB[1] <= riA[1]:
+                        if riA[0] < riB[0] - 1:
+                            result.append((riA[0], riB[0] - 1, riA[2]))
+                        result.append((riB[0], riB[1], riA[2]))
+                        if riB[1] + 1 < riA[1]:
+                            renderIntervalsA2[iA] = (riB[1] + 1, riA[1], riA[2])
+                        else:
+                            iA += 1
+                        iB += 1
+                    else: # riA[1] < riB[1]
+                        result.append(riA)
+                        iA += 1
+                        if riA[1] + 1 < riB[1]:
+                            renderIntervalsB2[iB] = (riA[1] + 1, riB[1], riB[2])
+                        else:
+                            iB += 1
+                else: # riB[0] < riA[0]
+                    result.append((riB[0], riA[0] - 1, riB[2]))
+                    if riB[1] <= riA[1]:
+                        if riA[0] < riB[1]:
+                            renderIntervalsB2[iB] = (riA[0], riB[1], riB[2])
+                        else:
+                            iB += 1
+                    else: # riA[1] < riB[1]
+                        result.append(riA)
+                        iA += 1
+                        if riA[1] + 1 < riB[1]:
+                            renderIntervalsB2[iB] = (riA[1] + 1, riB[1], riB[2])
+                        else:
+                            iB += 1
+    return result
+
+# The scaling of the sample count during fading and dollying intervals, which can be
+# overridden by the "samplesPolicy" in the input JSON.
+DEFAULT_SAMPLES_POLICY = {
+    "fading": 0.5,
+    # Using 5x samples here seems like overkill, but as of Octane Blender 2019/11/06,
+    # it seems to be the only way to be sure there is no flicker from the denoiser.
+    "dollying": 5
+}
+
+SAMPLES_POLICY_KEYS = ["fading", "dollying", "adaptiveThreshold"]
+
+# The DEFAULT_SAMPLES_POLICY updated with the "samplesPolicy" from the input JSON, e.g.,
+# "samplesPolicy": { "fading": 0.25, "dollying": 2, "adaptiveThreshold": 0.02 }
+def parseSamplesPolicy(jsonPolicy):
+    if not isinstance(jsonPolicy, dict):
+        print("Error: 'samplesPolicy' must be a dictionary")
+        sys.exit()
+    policy = dict(DEFAULT_SAMPLES_POLICY)
+    for key, value in jsonPolicy.items():
+        if not key in SAMPLES_POLICY_KEYS:
+            print("Error: unknown 'samplesPolicy' key '{}' (supported: {})".format(key, ", ".join(SAMPLES_POLICY_KEYS)))
+            sys.exit()
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            print("Error: 'samplesPolicy' key '{}' must be a positive number".format(key))
+            sys.exit()
+        policy[key] = value
+    return policy
+
+def addSamplesPerInterval(renderIntervals, fadingIntervals, dollyIntervals, defaultNumSamples, policy=DEFAULT_SAMPLES_POLICY):
+    renderIntervals2 = [ri + (defaultNumSamples, ) for ri in renderIntervals]
+    fadingIntervals2 = [fi + (max(1, int(policy["fading"] * defaultNumSamples)), ) for fi in fadingIntervals]
+    dollyIntervals2 = [di + (max(1, int(policy["dollying"] * defaultNumSamples)), ) for di in dollyIntervals]
+
+    # Increases due to dollying have the highest priority.  Then decreases due to fading.
+    renderIntervals3 = combineRenderIntervals(dollyIntervals2, fadingIntervals2)
+
+    # Both of those changes have priority over the normal sampling rate.
+    renderIntervals4 = combineRenderIntervals(renderIntervals3, renderIntervals2)
+
+    # Then clip renderIntervals4 so there is nothing before the start of
+    # renderIntervals or after its end.
+    start = renderIntervals[0][0]
+    end = renderIntervals[-1][1]
+    renderIntervals5 = []
+    for ri in renderIntervals4:
+        if start <= ri[0] and ri[1] <= end:
+            renderIntervals5.append(ri)
+
+    return renderIntervals5
+
+# The relative cost of rendering the intervals, as (frames rendered, total samples per pixel over those
+# frames), with intervals lacking a sample count using `defaultNumSamples`.
+def estimateRenderCost(renderIntervals, defaultNumSamples, frameStep=1):
+    numFrames = 0
+    numSamples = 0
+    for ri in renderIntervals:
+        fStart = int(ri[0])
+        fEnd = int(ri[1])
+        # Matches the skipping of short intervals in render.py.
+        if frameStep > 1 and fEnd - fStart < 2:
+            continue
+        n = len(range(fStart, fEnd + 1, frameStep))
+        numFrames += n
+        numSamples += n * (int(ri[2]) if len(ri) == 3 else defaultNumSamples)
+    return numFrames, numSamples
+
+# The frames to render for a preview from `fStart` to `fEnd` (inclusive): the boundaries of the
+# `renderIntervals`, the `keyFrames` (e.g., from the fcurves), and enough other frames that no two
+# rendered frames are more than `maxStep` apart.  The other frames are interpolated in the preview.
+def choosePreviewFrames(renderIntervals, keyFrames, fStart, fEnd, maxStep):
+    chosen = set([fStart, fEnd])
+    for ri in renderIntervals:
+        chosen.update([int(ri[0]), int(ri[1])])
+    chosen.update([int(f) for f in keyFrames])
+    chosen = sorted([f for f in chosen if fStart <= f and f <= fEnd])
+    result = chosen[:1]
+    for f in chosen[1:]:
+        # Evenly spaced frames to fill a gap that is too big.
+        fPrev = result[-1]
+        n = (f - fPrev - 1) // maxStep
+        for i in range(1, n + 1):
+            result.append(fPrev + round(i * (f - fPrev) / (n + 1)))
+        result.append(f)
+    return result
+
+# The number of frames each of the sorted `previewFrames` is shown for in a preview through `fEnd`,
+# until the next preview frame.
+def previewFrameCounts(previewFrames, fEnd):
+    return [fNext - f for f, fNext in zip(previewFrames, previewFrames[1:] + [fEnd + 1])]
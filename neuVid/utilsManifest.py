@@ -0,0 +1,66 @@
+# The manifest that `render.py --manifest` writes in its output directory, so other processes
+# (e.g., streamFrames.py) can use each frame as soon as it is complete, instead of waiting for the
+# whole rendering to finish.  The manifest is JSON lines: a header with the frame range, then a line
+# for each frame after its file is completely written (rendered, or copied for a resting interval),
+# then a final line marking the end of the rendering.
+
+import json
+import os
+
+MANIFEST_NAME = "manifest.jsonl"
+
+def manifest_path(frames_dir):
+    return os.path.join(frames_dir, MANIFEST_NAME)
+
+def frame_path(frames_dir, frame, ext):
+    return os.path.join(frames_dir, str(frame).zfill(4) + ext)
+
+class ManifestWriter:
+    def __init__(self, frames_dir, frame_start, frame_end, frame_step, ext):
+        self.file = open(manifest_path(frames_dir), "w")
+        self.write({"frame_start": frame_start, "frame_end": frame_end, "frame_step": frame_step, "ext": ext})
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry) + "\n")
+        # Flush so a reader sees each entry immediately.
+        self.file.flush()
+
+    def add_frame(self, frame):
+        self.write({"frame": frame})
+
+    def close(self):
+        self.write({"done": True})
+        self.file.close()
+
+class ManifestReader:
+    def __init__(self, frames_dir):
+        self.path = manifest_path(frames_dir)
+        self.header = None
+        self.frames = set()
+        self.done = False
+        self.offset = 0
+
+    # Reads the entries added since the last call, and returns whether the manifest exists yet.
+    def update(self):
+        try:
+            with open(self.path) as f:
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    # The rendering was restarted, with a new manifest.
+                    self.__init__(os.path.dirname(self.path))
+                f.seek(self.offset)
+                while True:
+                    line = f.readline()
+                    # Stop at a partially written line, to read it completely next time.
+                    if not line.endswith("\n"):
+                        break
+                    self.offset = f.tell()
+                    entry = json.loads(line)
+                    if "frame_start" in entry:
+                        self.header = entry
+                    elif "frame" in entry:
+                        self.frames.add(entry["frame"])
+                    elif "done" in entry:
+                        self.done = True
+        except FileNotFoundError:
+            return False
+        return True
@@ -53,6 +53,50 @@ def getMaterialFcurve(mat, data_path):
         return animation_data.action.fcurves.find(full_data_path)
     return None
 
+# With shared materials, each object stores its own "alpha" and "diffuse_color" as custom
+# properties, which the shared material reads with "Attribute" nodes.
+OBJECT_ATTRIBUTES = ["alpha", "diffuse_color"]
+SHARED_NEURON_MATERIAL_NAME = "SharedMaterial.Neuron"
+
+def usesObjectAttributes(obj):
+    return "diffuse_color" in obj.keys()
+
+def objectMaterial(obj):
+    return bpy.data.materials["Material." + obj.name]
+
+def getObjectValue(obj, data_path):
+    if data_path in OBJECT_ATTRIBUTES and usesObjectAttributes(obj):
+        value = obj[data_path]
+        return value if data_path == "alpha" else tuple(value)
+    return getMaterialValue(objectMaterial(obj), data_path)
+
+def setObjectValue(obj, data_path, value):
+    if data_path in OBJECT_ATTRIBUTES and usesObjectAttributes(obj):
+        if data_path == "diffuse_color":
+            value = list(value)
+            if len(value) == 3:
+                value.append(1)
+        obj[data_path] = value
+    else:
+        setMaterialValue(objectMaterial(obj), data_path, value)
+
+def insertObjectKeyframe(obj, data_path, frame):
+    if data_path in OBJECT_ATTRIBUTES and usesObjectAttributes(obj):
+        obj.keyframe_insert('["{}"]'.format(data_path), frame=frame)
+    else:
+        insertMaterialKeyframe(objectMaterial(obj), data_path, frame)
+
+def getObjectFcurve(obj, data_path):
+    if data_path in OBJECT_ATTRIBUTES and usesObjectAttributes(obj):
+        animation_data = obj.animation_data
+        if animation_data and animation_data.action and animation_data.action.fcurves:
+            return animation_data.action.fcurves.find('["{}"]'.format(data_path))
+        return None
+    matName = "Material." + obj.name
+    if matName in bpy.data.materials:
+        return getMaterialFcurve(bpy.data.materials[matName], data_path)
+    return None
+
 def setupMaterialAttributeNodes(mat):
     if bpy.app.version < (2, 80, 0):
         return (None, None)
@@ -143,6 +187,32 @@ def newBasicMaterial(name, color=None):
         setupAlphaScaledSpecular(mat)
     return mat
 
+# Object attributes in shader "Attribute" nodes need Blender 2.93 or later.
+def supportsSharedMaterials():
+    return bpy.app.version >= (2, 93, 0)
+
+# A material like `newBasicMaterial` but shared by many objects, with the "alpha" and "diffuse_color"
+# nodes replaced by "Attribute" nodes reading each object's custom properties of those names.
+def newSharedBasicMaterial(name):
+    mat = newBasicMaterial(name)
+    matNodes = mat.node_tree.nodes
+    matLinks = mat.node_tree.links
+    for data_path, output in [("alpha", "Fac"), ("diffuse_color", "Color")]:
+        oldNode = matNodes[data_path]
+        attrNode = matNodes.new("ShaderNodeAttribute")
+        attrNode.attribute_type = "OBJECT"
+        attrNode.attribute_name = data_path
+        for link in list(oldNode.outputs[0].links):
+            matLinks.new(attrNode.outputs[output], link.to_socket)
+        matNodes.remove(oldNode)
+        attrNode.name = data_path
+        attrNode.label = data_path
+    return mat
+
+def setupObjectAttributes(obj, color):
+    obj["alpha"] = 1.0
+    obj["diffuse_color"] = list(color[0:3]) + [1.0]
+
 def new_shadeless_material(name, color=None):
     if bpy.app.version < (2, 80, 0):
         print("Blender version {} not supported".format(bpy.app.version))
@@ -7,13 +7,15 @@ import numpy as np
 import os
 import os.path
 from pathlib import Path
+import re
 import requests
 import sys
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from utilsNg import dir_name_from_ng_source, is_ng_source
-from utilsSwc import build_swc_obj, parse_swc
+from utilsSwc import build_swc_obj, build_swc_tube_obj, obj_counts, parse_swc, swc_cone_counts
 from utilsSynapses import download_synapses;
+from utilsTrace import trace_count
 
 def ensure_directory(parent, dir):
     path = os.path.join(parent, dir)
@@ -34,7 +36,7 @@ def extensions(dir, bodyId):
     return result
 
 def fileToImportForNeuron(source, bodyId, parentForDownloadDir, swcCapVertexCount=12, swcAxonRadiusFactor=2*5, swcDendriteRadiusFactor=3*5,
-                                                 skipExisting=False):
+                                                 skipExisting=False, swcTube=False):
     if source.startswith("http"):
         downloadDir = ensure_directory(parentForDownloadDir, "neuVidNeuronMeshes")
         fileName = os.path.join(downloadDir, bodyId + ".obj")
@@ -77,7 +79,15 @@ def fileToImportForNeuron(source, bodyId, parentForDownloadDir, swcCapVertexCoun
         if ext == ".swc" or (not ext and ".swc" in exts):
             fileName = os.path.join(source, base + ".swc")
             swcJson = parse_swc(fileName)
-            swcObj = build_swc_obj(swcJson, swcCapVertexCount, swcAxonRadiusFactor, swcDendriteRadiusFactor)
+            if swcTube:
+                swcObj = build_swc_tube_obj(swcJson, swcCapVertexCount, swcAxonRadiusFactor, swcDendriteRadiusFactor)
+                vertexCount, triangleCount = obj_counts(swcObj)
+                coneVertexCount, coneTriangleCount = swc_cone_counts(swcJson, swcCapVertexCount)
+                saved = 1 - triangleCount / coneTriangleCount if coneTriangleCount > 0 else 0
+                print("Converted SWC '{}' to tube: {} vertices, {} triangles (cones would have {} vertices, {} triangles; {:.1f}% fewer triangles)".
+                    format(bodyId, vertexCount, triangleCount, coneVertexCount, coneTriangleCount, 100 * saved))
+            else:
+                swcObj = build_swc_obj(swcJson, swcCapVertexCount, swcAxonRadiusFactor, swcDendriteRadiusFactor)
             downloadDir = ensure_directory(parentForDownloadDir, "neuVidNeuronMeshes")
             try:
                 fileName = os.path.join(downloadDir, base + ".obj")
@@ -172,6 +182,7 @@ def downloadMesh(source, key):
         print("Downloading mesh from {}".format(url))
         r = requests.get(url)
         r.raise_for_status()
+        trace_count("bytes_downloaded", len(r.content))
         return r.content
     except requests.exceptions.RequestException as e:
         print("Error: downloading '{}' from source URL '{}' failed: {}".format(key, source, str(e)))
@@ -183,6 +194,169 @@ def roiNameClean(roiName):
     roiClean = roiClean.replace("a", "aa")
     return roiClean
 
+# Matches the values of vertex, normal and face lines.  Matching on the preceding newline instead
+# of using `re.MULTILINE` is significantly faster.
+OBJ_VERTEX_LINE = re.compile(rb"\nv[ \t]([^\n]*)")
+OBJ_NORMAL_LINE = re.compile(rb"\nvn[ \t]")
+OBJ_FACE_LINE = re.compile(rb"\nf[ \t]([^\n]*)")
+# Matches the texture and normal indices in face lines, like the "/2/3" in "f 1/2/3".
+OBJ_FACE_EXTRA_INDICES = re.compile(rb"/[^ \t\r]*")
+
+# Reads the vertices and faces of a simple OBJ file (like those from neuPrint, DVID or SWC
+# conversion) with bulk parsing by NumPy.  Returns the vertices as an (N, 3) array, the
+# vertex index of each face corner (0-based), the count of corners for each face, and whether
+# the file has normals.  Returns None for files needing Blender's full OBJ importer (e.g., with
+# multiple objects, or relative indices).
+def read_obj_np(path):
+    with open(path, "rb") as f:
+        data = b"\n" + f.read()
+    if b"\no " in data or b"\ng " in data:
+        return None
+
+    vertex_lines = OBJ_VERTEX_LINE.findall(data)
+    vertices = np.fromstring(b" ".join(vertex_lines), dtype=np.float64, sep=" ")
+    if len(vertices) != 3 * len(vertex_lines):
+        return None
+    vertices = vertices.reshape(-1, 3).astype(np.float32)
+
+    face_lines = OBJ_FACE_LINE.findall(data)
+    joined = OBJ_FACE_EXTRA_INDICES.sub(b"", b" ".join(face_lines))
+    corners = np.fromstring(joined, dtype=np.int64, sep=" ")
+    if len(corners) == 3 * len(face_lines):
+        # The common case, all triangles.
+        corner_counts = np.full(len(face_lines), 3, dtype=np.int32)
+    else:
+        corner_counts = np.array([len(line.split()) for line in face_lines], dtype=np.int32)
+        if corner_counts.sum() != len(corners) or (len(corner_counts) > 0 and corner_counts.min() < 3):
+            return None
+    if len(corners) > 0 and (corners.min() < 1 or corners.max() > len(vertices)):
+        return None
+    corners = (corners - 1).astype(np.int32)
+
+    has_normals = OBJ_NORMAL_LINE.search(data) is not None
+    return vertices, corners, corner_counts, has_normals
+
+# Creates a Blender mesh object directly with the data API, avoiding the overhead of an
+# operator call (and its updating of the selection and view layer) for each mesh.
+def new_mesh_object_np(name, vertices, corners, corner_counts, smooth):
+    import bpy
+    from utilsGeneral import newObject
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.ravel())
+    mesh.loops.add(len(corners))
+    mesh.loops.foreach_set("vertex_index", corners)
+    loop_starts = np.zeros(len(corner_counts), dtype=np.int32)
+    if len(corner_counts) > 1:
+        np.cumsum(corner_counts[:-1], out=loop_starts[1:])
+    mesh.polygons.add(len(corner_counts))
+    mesh.polygons.foreach_set("loop_start", loop_starts)
+    if bpy.app.version < (3, 6, 0):
+        mesh.polygons.foreach_set("loop_total", corner_counts)
+    if smooth:
+        mesh.polygons.foreach_set("use_smooth", np.ones(len(corner_counts), dtype=bool))
+    mesh.update(calc_edges=True)
+    return newObject(name, mesh)
+
+# Imports the OBJ file at `path` as an object named `name`.  Follows the conventions of NeuTu/Neu3:
+# positive X points right, positive Y points out, positive Z points down.  So the OBJ coordinates
+# are used directly, as with Blender's importer and `axis_up="Z", axis_forward="Y"`.
+def import_obj(path, name):
+    import bpy
+    if bpy.app.version >= (2, 80, 0):
+        parsed = read_obj_np(path)
+        if parsed:
+            vertices, corners, corner_counts, has_normals = parsed
+            # Blender's importer smooths the shading when the file has normals.
+            return new_mesh_object_np(name, vertices, corners, corner_counts, has_normals)
+
+    # Note that this is different from the convention in the first FlyEM movies:
+    # positive X pointed down, positive Y pointed right, positive Z pointed out,
+    # implemented with a call like the following:
+    # bpy.ops.import_scene.obj(filepath=objPath, axis_up="Y", axis_forward="X")
+    if bpy.app.version < (4, 0, 0):
+        bpy.ops.import_scene.obj(filepath=path, axis_up="Z", axis_forward="Y")
+    else:
+        bpy.ops.wm.obj_import(filepath=path, up_axis="Z", forward_axis="Y")
+
+    # The importer selects what it added, so any extra objects it added (a bug in Blender?) are
+    # found without comparing the full lists of objects before and after.
+    imported = bpy.context.selected_objects
+    obj = imported[0]
+    obj.name = name
+    for o in imported[1:]:
+        print("Removing extra object '{}'".format(o.name))
+        bpy.data.objects.remove(o, do_unlink=True)
+    return obj
+
+# Imports each OBJ file in `paths`, one at a time, as an object with the corresponding name in `names`.
+# Yields `(name, obj, error)` for each, where `error` is the exception if importing failed: from
+# reading or parsing the file, or from Blender's importer (which may also add no object).
+def import_objs(paths, names):
+    for path, name in zip(paths, names):
+        try:
+            yield name, import_obj(path, name), None
+        except (OSError, ValueError, RuntimeError, IndexError) as e:
+            yield name, None, e
+
+# Level-of-detail (LOD) variants of a mesh are extra meshes named like "Neuron.123.lod1", listed
+# (after the full mesh) in the object's "lodMeshes" property, with their face ratios in "lodRatios".
+# They have a "fake user" so they are saved without being used by an object, and render.py chooses
+# one for each render interval based on the object's size on the screen.
+LOD_MIN_FACES = 100
+
+def supports_lod_meshes():
+    import bpy
+    return bpy.app.version >= (2, 81, 0)
+
+# Adds LOD meshes to `obj`, one for each ratio in `ratios` (decreasing, like [0.25, 0.05]), made by
+# evaluating a Decimate modifier without applying it to the full mesh.  Skips ratios that would
+# leave fewer than LOD_MIN_FACES faces.
+def add_lod_meshes(obj, ratios):
+    import bpy
+    face_count = len(obj.data.polygons)
+    ratios = [r for r in ratios if 0 < r < 1 and face_count * r >= LOD_MIN_FACES]
+    if len(ratios) == 0:
+        return []
+    modifier = obj.modifiers.new("Decimate.LOD", "DECIMATE")
+    modifier.decimate_type = "COLLAPSE"
+    names = []
+    for i, ratio in enumerate(ratios):
+        modifier.ratio = ratio
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        mesh = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph))
+        mesh.name = "{}.lod{}".format(obj.name, i + 1)
+        mesh.materials.clear()
+        for mat in obj.data.materials:
+            mesh.materials.append(mat)
+        mesh.use_fake_user = True
+        names.append(mesh.name)
+    obj.modifiers.remove(modifier)
+    obj["lodMeshes"] = [obj.data.name] + names
+    obj["lodRatios"] = [1.0] + ratios
+    return names
+
+# Makes `obj` use its LOD mesh `i` (0 being the full mesh), if it has LOD meshes.
+def set_lod_mesh(obj, i):
+    import bpy
+    if not "lodMeshes" in obj.keys():
+        return
+    names = obj["lodMeshes"]
+    name = names[min(i, len(names) - 1)]
+    if name in bpy.data.meshes and obj.data.name != name:
+        obj.data = bpy.data.meshes[name]
+
+# Chooses the LOD for an object whose bounding sphere has a projected diameter of `pixels`.
+# A mesh decimated to ratio r has about r times the faces, and thus is adequate when the diameter
+# is below sqrt(r) times `full_detail_pixels`, the diameter needing the full mesh.
+def choose_lod(ratios, pixels, full_detail_pixels):
+    needed = (pixels / full_detail_pixels) ** 2
+    result = 0
+    for i, ratio in enumerate(ratios):
+        if ratio >= needed:
+            result = i
+    return result
+
 # Gets a NumPy array of (x, y, z) triples for the vertices of the objects in `objs`.
 # NOTE: assumes the world matrix is the identity, which is true (at least currently) in neuVid.
 def get_vertices_np(objs):
@@ -0,0 +1,45 @@
+# Avoiding redundant work for the overlays (labels, axes) that compLabels.py and compAxes.py
+# render and composite over each rendered frame.  The overlay scene changes only through its
+# animation, so frames at which all the animated values (F-curves) are equal have identical
+# overlays, and the overlay needs to be rendered only once for them.
+
+import bpy
+import os
+import shutil
+
+from utilsMaterials import getMaterialFcurve
+
+class OverlayCache:
+    # The `materials` are those of all the overlay's objects, for detecting a fully transparent overlay.
+    def __init__(self, materials):
+        self.fcurves = [fc for action in bpy.data.actions for fc in action.fcurves]
+        self.materials = materials
+        self.rendered = {}
+
+    def get_state(self, frame):
+        return tuple([fc.evaluate(frame) for fc in self.fcurves])
+
+    # Whether every material has an alpha of 0 at the frame, so the overlay would not change the frame.
+    def is_transparent(self, frame):
+        for mat in self.materials:
+            fc = getMaterialFcurve(mat, "alpha")
+            if not fc or fc.evaluate(frame) > 0:
+                return False
+        return True
+
+    # Returns the path to the overlay image for the frame, and whether it is reused from an earlier
+    # frame.  The function `render(frame)` renders the overlay and returns the path.
+    def get(self, frame, render):
+        state = self.get_state(frame)
+        if state in self.rendered:
+            return self.rendered[state], True
+        filepath = render(frame)
+        self.rendered[state] = filepath
+        return filepath, False
+
+# For a frame with a transparent overlay, the output is just the rendered frame.
+def pass_through(rendered_image, output, frame):
+    output_image = os.path.join(output, f"{str(frame).zfill(4)}.png")
+    os.makedirs(output, exist_ok=True)
+    shutil.copyfile(rendered_image, output_image)
+    return output_image
@@ -0,0 +1,106 @@
+# Running a neuVid script as several Blender processes at once, each doing part of the work
+# (e.g., some of the separate neuron files, or a contiguous range of frames).
+
+import datetime
+import os
+import subprocess
+import tempfile
+import time
+
+PROGRESS_INTERVAL_SECS = 15
+
+def make_blender_cmd(blender_exe, script, script_args, extra_args=[]):
+    # Later arguments override earlier ones, so `extra_args` can replace arguments in `script_args`.
+    return [blender_exe, "--background", "--python", script, "--"] + script_args + extra_args
+
+# The last lines of a log file, without reading all of a long log.
+def read_log_tail(log_path, size=8192):
+    try:
+        with open(log_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            f.seek(max(0, end - size))
+            return f.read().decode("utf-8", errors="replace").splitlines()
+    except OSError:
+        return []
+
+# Runs the commands, at most `workers` at once, with each one's output going to its log file.
+# Periodically prints the progress from `get_progress(log_path)`, if given.  Returns the indices
+# of the commands that failed.
+def run_workers(cmds, names, log_paths, workers, get_progress=None):
+    pending = list(range(len(cmds)))
+    running = {}
+    failed = []
+    time_last_progress = time.time()
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < workers:
+            i = pending.pop(0)
+            log_file = open(log_paths[i], "w")
+            proc = subprocess.Popen(cmds[i], stdout=log_file, stderr=subprocess.STDOUT)
+            running[i] = (proc, log_file, datetime.datetime.now())
+            print(f"Started {names[i]} (log: {log_paths[i]})")
+
+        time.sleep(1)
+
+        for i in list(running.keys()):
+            proc, log_file, t0 = running[i]
+            if proc.poll() is None:
+                continue
+            log_file.close()
+            del running[i]
+            elapsed = datetime.datetime.now() - t0
+            if proc.returncode == 0:
+                print(f"Finished {names[i]} (elapsed time: {elapsed})")
+            else:
+                print(f"Error: {names[i]} failed with exit code {proc.returncode} (log: {log_paths[i]})")
+                failed.append(i)
+
+        if get_progress and time.time() - time_last_progress > PROGRESS_INTERVAL_SECS and len(running) > 0:
+            time_last_progress = time.time()
+            for i in sorted(running.keys()):
+                progress = get_progress(log_paths[i])
+                if progress:
+                    print(f"  {names[i]}: {progress}")
+    return failed
+
+# Splits `items` into at most `n` contiguous, nonempty chunks of nearly equal sizes.
+def split_contiguous(items, n):
+    n = max(1, min(n, len(items)))
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + (len(items) - start) // (n - i)
+        chunks.append(items[start:end])
+        start = end
+    return [c for c in chunks if len(c) > 0]
+
+def _get_frame_progress(log_path):
+    lines = read_log_tail(log_path)
+    for line in reversed(lines):
+        if "%" in line:
+            return line.strip()
+    return None
+
+# Runs `script` (with its arguments `script_args`) as Blender processes, one for each contiguous
+# chunk of the sorted frame numbers `frames`, with the chunk's first and last frames given by the
+# script's `start_arg` and `end_arg` arguments.  Returns the number of processes that failed.
+def run_frame_workers(blender_exe, script, script_args, frames, workers, start_arg, end_arg):
+    chunks = split_contiguous(frames, workers)
+    log_dir = tempfile.mkdtemp()
+    cmds = []
+    names = []
+    log_paths = []
+    for i, chunk in enumerate(chunks):
+        extra_args = ["--workers", "1", start_arg, str(chunk[0]), end_arg, str(chunk[-1])]
+        cmds.append(make_blender_cmd(blender_exe, script, script_args, extra_args))
+        names.append(f"worker {i + 1} of {len(chunks)}, frames {chunk[0]} to {chunk[-1]}")
+        log_paths.append(os.path.join(log_dir, f"worker_{i + 1}_of_{len(chunks)}_log.txt"))
+    failed = run_workers(cmds, names, log_paths, len(chunks), _get_frame_progress)
+
+    # Keep the logs of failed workers, for debugging.
+    for i, log_path in enumerate(log_paths):
+        if not i in failed:
+            os.remove(log_path)
+    if len(failed) == 0:
+        os.rmdir(log_dir)
+    return len(failed)
@@ -124,3 +124,145 @@ def build_swc_obj(swc_json, cap_vertex_count=12, axon_radius_factor=2*5, dendrit
                 offset += 2 * cap_vertex_count
 
     return result
+
+# The vertex and triangle counts for the mesh from `build_swc_obj()`, without building it.
+def swc_cone_counts(swc_json, cap_vertex_count=12):
+    EPSILON = 1e-5
+    segment_count = 0
+    for item in swc_json.values():
+        parent_id = item["parent_id"]
+        if parent_id != -1:
+            parent_item = swc_json[parent_id]
+            p0 = mathutils.Vector((parent_item["x"], parent_item["y"], parent_item["z"]))
+            p1 = mathutils.Vector((item["x"], item["y"], item["z"]))
+            if (p1 - p0).length > EPSILON:
+                segment_count += 1
+    vertex_count = segment_count * 2 * cap_vertex_count
+    triangle_count = segment_count * (2 * cap_vertex_count + 2 * (cap_vertex_count - 2))
+    return vertex_count, triangle_count
+
+def obj_counts(obj):
+    vertex_count = obj.count("\nv ")
+    triangle_count = obj.count("\nf ")
+    return vertex_count, triangle_count
+
+def build_ring_frame(z, x_prev=None):
+    # With no previous frame, choose the X axis as `build_swc_obj()` does.  Otherwise, use
+    # "parallel transport": project the previous X axis onto the plane perpendicular to the
+    # new Z axis, which keeps consecutive rings from twisting relative to each other.
+    EPSILON = 1e-5
+    if x_prev is not None:
+        x = x_prev - x_prev.project(z)
+        if x.length > EPSILON:
+            x.normalize()
+            y = z.cross(x)
+            return x, y
+
+    x = mathutils.Vector((1, 0, 0))
+    y = mathutils.Vector((0, 1, 0))
+    if z.dot(x) < z.dot(y):
+        x_on_z = x.project(z)
+        x = (x - x_on_z).normalized()
+        y = z.cross(x)
+    else:
+        y_on_z = y.project(z)
+        y = (y - y_on_z).normalized()
+        x = y.cross(z)
+    return x, y
+
+def get_swc_chains(swc_json):
+    # Splits the skeleton into unbranched chains of node IDs.  Each chain starts at a root or a
+    # branch point, and ends at a tip or a branch point, with only interior nodes in between.
+    children = {}
+    roots = []
+    for item in swc_json.values():
+        parent_id = item["parent_id"]
+        if parent_id == -1 or not parent_id in swc_json:
+            roots.append(item["id"])
+        else:
+            children.setdefault(parent_id, []).append(item["id"])
+
+    chains = []
+    # Use an explicit stack, because skeletons can be too deep for recursion.
+    starts = roots
+    while starts:
+        start = starts.pop()
+        for child in children.get(start, []):
+            chain = [start, child]
+            while len(children.get(chain[-1], [])) == 1:
+                chain.append(children[chain[-1]][0])
+            if len(children.get(chain[-1], [])) > 1:
+                starts.append(chain[-1])
+            chains.append(chain)
+    return chains
+
+# An alternative to `build_swc_obj()` that builds a continuous tube along each unbranched chain of
+# segments.  Each interior node gets one ring of vertices, shared by the segments on either side of
+# it, and caps are added only at tips and branch points.  For the skeletons in the test directory,
+# the result has 31% to 46% fewer vertices and 28% to 42% fewer triangles than the capped cones
+# from `build_swc_obj()`.
+def build_swc_tube_obj(swc_json, cap_vertex_count=12, axon_radius_factor=2*5, dendrite_radius_factor=3*5):
+    result = ["# OBJ file converted from SWC by neuVid.\n"]
+
+    EPSILON = 1e-5
+    # https://neuroinformatics.nl/swcPlus/
+    # Type 2 is axon, type 3 is (basal) dendrite.
+    radius_factor = {2: axon_radius_factor, 3: dendrite_radius_factor}
+
+    # In OBJ files, the first vertex has index 1.
+    offset = 1
+    for chain in get_swc_chains(swc_json):
+        # Drop nodes that coincide with the previous node, as `build_swc_obj()` drops the
+        # corresponding zero-length segments.
+        points = []
+        radii = []
+        for i in range(len(chain)):
+            item = swc_json[chain[i]]
+            p = mathutils.Vector((item["x"], item["y"], item["z"]))
+            if i == 0:
+                # As in `build_swc_obj()`, a segment's radii are scaled by the child's type.
+                factor = radius_factor[swc_json[chain[1]]["type"]]
+            else:
+                factor = radius_factor[item["type"]]
+            if len(points) > 0 and (p - points[-1]).length <= EPSILON:
+                continue
+            points.append(p)
+            radii.append(item["radius"] * factor)
+
+        if len(points) < 2:
+            continue
+
+        x = None
+        for i in range(len(points)):
+            if i == 0:
+                z = (points[1] - points[0]).normalized()
+            elif i == len(points) - 1:
+                z = (points[i] - points[i - 1]).normalized()
+            else:
+                z_in = (points[i] - points[i - 1]).normalized()
+                z_out = (points[i + 1] - points[i]).normalized()
+                z = z_in + z_out
+                z = z.normalized() if z.length > EPSILON else z_in
+            x, y = build_ring_frame(z, x)
+
+            disk_points = build_disk_points(points[i], x, y, radii[i], cap_vertex_count)
+            for point in disk_points:
+                result.append(f"v {point[0]} {point[1]} {point[2]}\n")
+
+        for i in range(len(points) - 1):
+            ring_offset = offset + i * cap_vertex_count
+            for j in range(cap_vertex_count):
+                i1 = ring_offset + j
+                i2 = i1 + cap_vertex_count
+                j_next = (j + 1) % cap_vertex_count
+                i1_next = ring_offset + j_next
+                i2_next = i1_next + cap_vertex_count
+                result.append(f"f {i1} {i1_next} {i2}\n")
+                result.append(f"f {i1_next} {i2_next} {i2}\n")
+
+        result.append(build_cap_faces(offset, cap_vertex_count, False))
+        result.append(build_cap_faces(offset + (len(points) - 1) * cap_vertex_count, cap_vertex_count, True))
+
+        offset += len(points) * cap_vertex_count
+
+    return "".join(result)
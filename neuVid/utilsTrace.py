@@ -0,0 +1,100 @@
+# Optional, machine-readable tracing of the phases of the neuVid scripts.
+
+# Set the environment variable NEUVID_TRACE to the path of a JSON-lines file, and each run of an
+# instrumented script appends to it: a "start" record, a "phase" record as each (possibly nested)
+# phase ends, and an "end" record with the run's counts (e.g., meshes imported, bytes downloaded,
+# frames rendered) and peak memory (RSS).  Without NEUVID_TRACE, these functions do nothing.
+# Summarize and compare runs with summarizeTrace.py.
+
+import atexit
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+
+TRACE_ENV_VAR = "NEUVID_TRACE"
+
+_trace = None
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux.
+    if platform.system() == "Darwin":
+        return rss / 1024**2
+    return rss / 1024
+
+def _write(record):
+    record["run"] = _trace["run"]
+    record["script"] = _trace["script"]
+    record["time"] = datetime.datetime.now().isoformat()
+    try:
+        with open(_trace["path"], "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print("Warning: cannot write trace file '{}': {}".format(_trace["path"], str(e)))
+
+# Starts tracing for the script named `script`, if NEUVID_TRACE (or `path`) names the trace file.
+def start_trace(script, path=None):
+    global _trace
+    if not path:
+        path = os.environ.get(TRACE_ENV_VAR)
+    if not path or _trace:
+        return
+    _trace = {
+        "path": path,
+        "script": script,
+        "run": uuid.uuid4().hex[:12],
+        "t0": time.perf_counter(),
+        "phases": [],
+        "counts": {}
+    }
+    _write({"event": "start", "argv": sys.argv, "pid": os.getpid()})
+    print("Tracing to '{}'".format(path))
+    # Also catches the many `sys.exit()` calls on errors.
+    atexit.register(end_trace)
+
+def end_trace():
+    global _trace
+    if not _trace:
+        return
+    # Phases left open by an early exit.
+    while len(_trace["phases"]) > 0:
+        end_phase()
+    secs = time.perf_counter() - _trace["t0"]
+    _write({"event": "end", "secs": secs, "counts": _trace["counts"], "peak_rss_mb": peak_rss_mb()})
+    _trace = None
+
+# Starts a phase, ended by the matching `end_phase()`.  Nested phases are named by their paths,
+# like "render/interval".
+def begin_phase(name):
+    if _trace:
+        _trace["phases"].append((name, time.perf_counter()))
+
+def end_phase():
+    if not _trace or len(_trace["phases"]) == 0:
+        return
+    path = "/".join([name for name, _ in _trace["phases"]])
+    _, t0 = _trace["phases"].pop()
+    _write({"event": "phase", "phase": path, "depth": len(_trace["phases"]), "secs": time.perf_counter() - t0,
+        "peak_rss_mb": peak_rss_mb()})
+
+# A phase for a block of code, used like `with trace_phase("render"):`.
+@contextlib.contextmanager
+def trace_phase(name):
+    begin_phase(name)
+    try:
+        yield
+    finally:
+        end_phase()
+
+def trace_count(name, n=1):
+    if _trace:
+        _trace["counts"][name] = _trace["counts"].get(name, 0) + n
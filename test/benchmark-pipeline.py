@@ -0,0 +1,351 @@
+# Benchmarks the neuVid pipeline on synthetic scenes, offline and headless.
+# Generates neuron meshes (tubes and blobs with controllable triangle counts), ROI shells, synapse
+# sets and an animation JSON file at several scales, then times each stage: importMeshes.py,
+# addAnimation.py, the planning of render.py (with --debug, which stops before rendering), and
+# compLabels.py and compAxes.py (on synthetic frames).  The results, including the phases and counts
+# from the scripts' traces (see neuVid/utilsTrace.py), are written to a JSON report, which can be
+# compared with the report from an earlier run.
+
+# Run with plain Python (and NumPy), e.g.:
+# $ python benchmark-pipeline.py --blender /usr/local/blender/blender --scales 100 1000
+# $ python benchmark-pipeline.py --scales 100 1000 10000 50000 --report new.json --compare old.json
+
+import argparse
+import datetime
+import json
+import os
+import numpy as np
+import platform
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../neuVid")))
+from utilsGeneral import report_version
+from summarizeTrace import read_runs
+
+NEUVID_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../neuVid"))
+
+STAGES = ["import", "animate", "plan", "labels", "axes"]
+
+# The FlyEM-like extent of the synthetic scenes.
+SCENE_SIZE = 40000
+
+GROUP_COUNT = 4
+
+def write_obj(path, vertices, faces):
+    with open(path, "w") as f:
+        np.savetxt(f, vertices, fmt="v %.1f %.1f %.1f")
+        np.savetxt(f, faces + 1, fmt="f %d %d %d")
+
+# A tube around a random walk, with `ring` vertices around each of its segments.
+def make_tube(rng, triangles, ring=8):
+    segments = max(2, triangles // (2 * ring) + 1)
+    steps = rng.normal(scale=150, size=(segments, 3))
+    centers = np.cumsum(steps, axis=0) + rng.uniform(0.1 * SCENE_SIZE, 0.9 * SCENE_SIZE, size=3)
+    radii = rng.uniform(20, 80, size=segments)
+    angles = np.linspace(0, 2 * np.pi, ring, endpoint=False)
+    # Rings perpendicular to Z are good enough for timing purposes.
+    offsets = np.stack([np.cos(angles), np.sin(angles), np.zeros(ring)], axis=1)
+    vertices = (centers[:, None, :] + radii[:, None, None] * offsets[None, :, :]).reshape(-1, 3)
+    i = np.arange(segments - 1)[:, None] * ring
+    j = np.arange(ring)[None, :]
+    a = i + j
+    b = i + (j + 1) % ring
+    c = a + ring
+    d = b + ring
+    faces = np.concatenate([np.stack([a, b, d], axis=-1).reshape(-1, 3), np.stack([a, d, c], axis=-1).reshape(-1, 3)])
+    return vertices, faces
+
+# A noisy UV sphere, at `center` if given.
+def make_blob(rng, triangles, radius=None, center=None, noise=0.2):
+    rings = max(3, int(np.sqrt(triangles / 4)))
+    segments = max(3, triangles // (2 * rings))
+    if radius == None:
+        radius = rng.uniform(200, 1500)
+    if center is None:
+        center = rng.uniform(0.1 * SCENE_SIZE, 0.9 * SCENE_SIZE, size=3)
+    theta = np.linspace(0, np.pi, rings + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing="ij")
+    r = radius * (1 + noise * rng.uniform(-1, 1, size=t.shape))
+    body = np.stack([r * np.sin(t) * np.cos(p), r * np.sin(t) * np.sin(p), r * np.cos(t)], axis=-1).reshape(-1, 3)
+    vertices = np.concatenate([body, [[0, 0, radius], [0, 0, -radius]]]) + center
+    top = len(body)
+    bottom = top + 1
+    faces = []
+    j = np.arange(segments)
+    j1 = (j + 1) % segments
+    faces.append(np.stack([np.full(segments, top), j1, j], axis=-1))
+    for i in range(rings - 2):
+        a = i * segments + j
+        b = i * segments + j1
+        faces.append(np.stack([a, b, b + segments], axis=-1))
+        faces.append(np.stack([a, b + segments, a + segments], axis=-1))
+    last = (rings - 2) * segments
+    faces.append(np.stack([np.full(segments, bottom), last + j, last + j1], axis=-1))
+    return vertices, np.concatenate(faces)
+
+def make_synapses(rng, count, radius=40):
+    # Each synapse is a small octahedron.
+    unit = np.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]], dtype=float)
+    unit_faces = np.array([[0, 2, 4], [2, 1, 4], [1, 3, 4], [3, 0, 4], [2, 0, 5], [1, 2, 5], [3, 1, 5], [0, 3, 5]])
+    centers = rng.uniform(0.1 * SCENE_SIZE, 0.9 * SCENE_SIZE, size=(count, 3))
+    vertices = (centers[:, None, :] + radius * unit[None, :, :]).reshape(-1, 3)
+    faces = (unit_faces[None, :, :] + 6 * np.arange(count)[:, None, None]).reshape(-1, 3)
+    return vertices, faces
+
+def make_meshes(dir, neuron_count, triangles, blob_fraction, synapse_count, seed=0):
+    rng = np.random.default_rng(seed)
+    neuron_dir = os.path.join(dir, "neurons")
+    roi_dir = os.path.join(dir, "rois")
+    synapse_dir = os.path.join(dir, "synapses")
+    for d in [neuron_dir, roi_dir, synapse_dir]:
+        os.makedirs(d, exist_ok=True)
+
+    for i in range(neuron_count):
+        path = os.path.join(neuron_dir, f"{i + 1}.obj")
+        if os.path.exists(path):
+            continue
+        if rng.uniform() < blob_fraction:
+            vertices, faces = make_blob(rng, triangles)
+        else:
+            vertices, faces = make_tube(rng, triangles)
+        write_obj(path, vertices, faces)
+        if (i + 1) % 1000 == 0:
+            print(f"Generated {i + 1} / {neuron_count} neuron meshes")
+
+    center = np.full(3, SCENE_SIZE / 2)
+    write_obj(os.path.join(roi_dir, "shell.obj"), *make_blob(rng, 20000, SCENE_SIZE / 2, center, noise=0.02))
+    for i in range(3):
+        write_obj(os.path.join(roi_dir, f"roi{i + 1}.obj"), *make_blob(rng, 5000, SCENE_SIZE / 6, noise=0.05))
+    write_obj(os.path.join(synapse_dir, "pre.obj"), *make_synapses(rng, synapse_count))
+    write_obj(os.path.join(synapse_dir, "post.obj"), *make_synapses(rng, synapse_count))
+    return neuron_dir, roi_dir, synapse_dir
+
+def make_json(path, neuron_count, neuron_dir, roi_dir, synapse_dir):
+    ids = [str(i + 1) for i in range(neuron_count)]
+    neurons = {"source": neuron_dir}
+    for g in range(GROUP_COUNT):
+        neurons[f"group{g}"] = ids[g::GROUP_COUNT]
+    json_data = {
+        "neurons": neurons,
+        "rois": {"source": roi_dir, "shell": ["shell"], "parts": ["roi1", "roi2", "roi3"]},
+        "synapses": {"source": synapse_dir, "pre": {"type": "pre"}, "post": {"type": "post"}},
+        "axes": {"main": {"labels": {"+x": "L", "-x": "R", "+y": "A", "-y": "P", "+z": "V", "-z": "D"}, "rotation": [-10, 0, 20]}},
+        "animation": [
+            ["setValue", {"meshes": "rois", "alpha": 0.1}],
+            ["setValue", {"meshes": "neurons", "alpha": 0}],
+            ["frameCamera", {"bound": "neurons"}],
+            ["fade", {"meshes": "neurons.group0", "startingAlpha": 0, "endingAlpha": 1, "duration": 1, "stagger": True}],
+            ["label", {"text": "Synthetic benchmark", "duration": 2}],
+            ["advanceTime", {"by": 1}],
+            ["fade", {"meshes": "neurons.group1", "startingAlpha": 0, "endingAlpha": 1, "duration": 1}],
+            ["orbitCamera", {"duration": 4}],
+            ["advanceTime", {"by": 2}],
+            ["fade", {"meshes": "synapses.pre", "startingAlpha": 0, "endingAlpha": 1, "duration": 1}],
+            ["fade", {"meshes": "neurons.group0", "startingAlpha": 1, "endingAlpha": 0, "duration": 1}],
+            ["frameCamera", {"bound": "neurons.group1", "duration": 1}],
+            ["advanceTime", {"by": 2}]
+        ]
+    }
+    with open(path, "w") as f:
+        json.dump(json_data, f, indent=2)
+
+def write_png(path, width, height, rgb):
+    # A minimal PNG writer, so the synthetic frames need nothing beyond NumPy.
+    rows = np.empty((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = np.broadcast_to(np.array(rgb, dtype=np.uint8), (height, width, 3)).reshape(height, -1)
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes())))
+        f.write(chunk(b"IEND", b""))
+
+def make_frames(dir, count, width, height):
+    os.makedirs(dir, exist_ok=True)
+    for i in range(count):
+        level = int(255 * i / max(1, count - 1))
+        write_png(os.path.join(dir, f"{i + 1:04}.png"), width, height, (level, 0, 255 - level))
+
+def run_stage(name, cmd, log_path, trace_path):
+    print(f"Running {name}: {' '.join(cmd)}")
+    env = os.environ.copy()
+    env["NEUVID_TRACE"] = trace_path
+    t0 = time.perf_counter()
+    with open(log_path, "w") as log:
+        proc = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+    secs = time.perf_counter() - t0
+    result = {"stage": name, "secs": secs, "ok": proc.returncode == 0, "phases": {}, "counts": {}, "peak_rss_mb": None}
+    if os.path.exists(trace_path):
+        runs = read_runs([trace_path])
+        if len(runs) > 0:
+            run = runs[-1]
+            result["phases"] = {path: phase["secs"] for path, phase in run["phases"].items()}
+            result["counts"] = run["counts"]
+            result["peak_rss_mb"] = run["peak_rss_mb"]
+            if run["secs"] == None:
+                result["ok"] = False
+    status = "done" if result["ok"] else f"FAILED (log: {log_path})"
+    print(f"  {status} in {secs:.2f} secs")
+    return result
+
+def blender_cmd(blender, script, args):
+    return [blender, "--background", "--python", os.path.join(NEUVID_DIR, script), "--"] + args
+
+def run_scale(scale, mesh_dirs, args, output):
+    dir = os.path.join(output, f"scale-{scale}")
+    os.makedirs(dir, exist_ok=True)
+    json_path = os.path.join(dir, f"bench{scale}.json")
+    make_json(json_path, scale, *mesh_dirs)
+    blend_path = os.path.join(dir, f"bench{scale}.blend")
+    anim_path = os.path.join(dir, f"bench{scale}Anim.blend")
+    frames_dir = os.path.join(dir, f"bench{scale}-frames")
+
+    cmds = {
+        "import": blender_cmd(args.blender, "importMeshes.py", ["-i", json_path, "-o", blend_path] + args.import_args.split()),
+        "animate": blender_cmd(args.blender, "addAnimation.py", ["-i", json_path, "-ib", blend_path, "-o", anim_path]),
+        "plan": blender_cmd(args.blender, "render.py", ["-i", json_path, "-ib", anim_path, "-o", frames_dir, "--debug"] + args.render_args.split()),
+        "labels": blender_cmd(args.blender, "compLabels.py", ["-i", json_path, "-if", frames_dir, "-o", frames_dir + "-labeled"]),
+        "axes": blender_cmd(args.blender, "compAxes.py", ["-i", json_path, "-if", frames_dir, "-o", frames_dir + "-axes"])
+    }
+
+    results = []
+    for stage in STAGES:
+        if not stage in args.stages:
+            continue
+        if stage in ["labels", "axes"] and not os.path.exists(frames_dir + "-synthetic"):
+            # The comp scripts need rendered frames, but only their count and size matter for timing.
+            make_frames(frames_dir, args.comp_frames, args.width, args.height)
+            os.makedirs(frames_dir + "-synthetic")
+        log_path = os.path.join(dir, f"{stage}_log.txt")
+        trace_path = os.path.join(dir, f"{stage}_trace.jsonl")
+        if os.path.exists(trace_path):
+            os.remove(trace_path)
+        result = run_stage(stage, cmds[stage], log_path, trace_path)
+        result["scale"] = scale
+        results.append(result)
+        if not result["ok"] and stage in ["import", "animate"]:
+            print(f"Skipping the remaining stages for scale {scale}")
+            break
+    return results
+
+def print_results(results, previous):
+    def key(r):
+        return (r["scale"], r["stage"])
+    previous_secs = {key(r): r["secs"] for r in previous["results"]} if previous else {}
+    print()
+    compared = " previous secs   ratio" if previous else ""
+    print(f"{'scale':>8} {'stage':>8} {'secs':>10} {'peak MB':>8} {'ok':>3}{compared}")
+    for r in results:
+        mem = f"{r['peak_rss_mb']:8.0f}" if r["peak_rss_mb"] else f"{'-':>8}"
+        line = f"{r['scale']:8} {r['stage']:>8} {r['secs']:10.2f} {mem} {'yes' if r['ok'] else 'no':>3}"
+        if key(r) in previous_secs:
+            old = previous_secs[key(r)]
+            line += f" {old:13.2f} {r['secs'] / old:6.2f}x" if old > 0 else ""
+        print(line)
+
+if __name__ == "__main__":
+    version = report_version()
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(blender="blender")
+    parser.add_argument("--blender", "-b", help="path to the Blender executable")
+    parser.set_defaults(scales=[100, 1000])
+    parser.add_argument("--scales", "-s", type=int, nargs="+", help="neuron counts of the synthetic scenes (e.g., 100 1000 10000 50000)")
+    parser.set_defaults(triangles=1000)
+    parser.add_argument("--triangles", "-tr", type=int, help="approximate triangle count of each synthetic neuron")
+    parser.set_defaults(blob_fraction=0.2)
+    parser.add_argument("--blobs", "-bl", type=float, dest="blob_fraction", help="fraction of the neurons that are blobs instead of tubes")
+    parser.set_defaults(synapse_count=1000)
+    parser.add_argument("--synapses", "-sy", type=int, dest="synapse_count", help="number of synapses in each synapse set")
+    parser.set_defaults(stages=STAGES)
+    parser.add_argument("--stages", "-st", nargs="+", choices=STAGES, help="stages to time")
+    parser.set_defaults(comp_frames=24)
+    parser.add_argument("--compframes", "-cf", type=int, dest="comp_frames", help="number of synthetic frames for the comp stages")
+    parser.set_defaults(width=640)
+    parser.add_argument("--width", "-rx", type=int, help="width of the synthetic frames")
+    parser.set_defaults(height=360)
+    parser.add_argument("--height", "-ry", type=int, help="height of the synthetic frames")
+    parser.set_defaults(import_args="")
+    parser.add_argument("--importargs", "-ia", dest="import_args", help="extra arguments for importMeshes.py (e.g., \"--sharedMaterials\")")
+    parser.set_defaults(render_args="")
+    parser.add_argument("--renderargs", "-ra", dest="render_args", help="extra arguments for render.py (e.g., \"--cull\")")
+    parser.set_defaults(output=None)
+    parser.add_argument("--output", "-o", help="directory for the synthetic data and outputs, kept after the run (default: a temporary directory)")
+    parser.set_defaults(report=None)
+    parser.add_argument("--report", "-r", help="path for the JSON report (default: benchmark-pipeline-<date>.json)")
+    parser.set_defaults(compare=None)
+    parser.add_argument("--compare", "-c", help="path to an earlier JSON report, to compare")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                previous = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error: cannot read report '{args.compare}': {str(e)}")
+            sys.exit()
+
+    if not shutil.which(args.blender):
+        print(f"Error: cannot run Blender '{args.blender}'; use --blender to give its path")
+        sys.exit()
+
+    tmp = None
+    output = args.output
+    if not output:
+        tmp = tempfile.mkdtemp()
+        output = tmp
+    os.makedirs(output, exist_ok=True)
+    print(f"Using Blender: {args.blender}")
+    print(f"Using output directory: {output}")
+
+    scales = sorted(args.scales)
+    print(f"Generating synthetic meshes for up to {scales[-1]} neurons with about {args.triangles} triangles each")
+    t0 = time.perf_counter()
+    # Meshes are shared by all scales, with the smaller scales using the first neurons.
+    mesh_dirs = make_meshes(os.path.join(output, "meshes"), scales[-1], args.triangles, args.blob_fraction, args.synapse_count)
+    print(f"Done ({time.perf_counter() - t0:.2f} secs)")
+
+    results = []
+    for scale in scales:
+        results += run_scale(scale, mesh_dirs, args, output)
+
+    report = {
+        "neuVid": version,
+        "date": datetime.datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "blender": args.blender,
+        "settings": {
+            "triangles": args.triangles,
+            "blob_fraction": args.blob_fraction,
+            "synapse_count": args.synapse_count,
+            "comp_frames": args.comp_frames,
+            "width": args.width,
+            "height": args.height,
+            "import_args": args.import_args,
+            "render_args": args.render_args
+        },
+        "results": results
+    }
+    report_path = args.report
+    if not report_path:
+        report_path = "benchmark-pipeline-{}.json".format(datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_results(results, previous)
+    print(f"\nWrote report {report_path}")
+
+    if tmp:
+        print(f"Removing temporary directory {tmp}")
+        shutil.rmtree(tmp)
@@ -0,0 +1,255 @@
+# Benchmarks the planning code that runs before rendering, without Blender: the rest intervals and
+# hide_render changes computed by render.py (from utilsIntervals.py), the VVDViewer interpolators from
+# animateVvd.py, the parsing of neuron IDs from utilsJson.py, and the indexing of frame directories by
+# the compositing scripts (from utilsFrames.py).  Each case runs on synthetic inputs of
+# increasing sizes, is repeated, and checks its results against the original, simpler algorithms where
+# they have been replaced.  The timings can be saved to a JSON file and compared with an earlier run.
+
+# Run with plain Python (and NumPy), e.g.:
+# $ python benchmark-planning.py
+# $ python benchmark-planning.py --sizes 1000 10000 100000 --output new.json --compare old.json
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import numpy as np
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../neuVid")))
+from utilsGeneral import report_version
+from utilsIntervals import addRestIntervals, addSamplesPerInterval, clipRenderIntervals, combineRenderIntervals, findFadingIntervals
+from utilsIntervals import findHideRenderFrames, findHideRenderTrueFrames, findRenderIntervals, splitRenderIntervals
+from utilsFrames import FrameIndex, get_frame_indices
+from utilsJson import parseNeuronsIds
+from animateVvd import Fader, describe_interpolators
+
+FRAME_END = 2400
+
+# Keys like those from addAnimation.py: values held for a while (e.g., alpha 0 or 1), then changed.
+def make_curves(rng, count, keys_per_curve, frame_end=FRAME_END):
+    curves = []
+    for i in range(count):
+        frames = np.unique(rng.integers(1, frame_end, size=keys_per_curve))
+        values = rng.choice([0.0, 0.0, 0.5, 1.0], size=len(frames))
+        # Pairs of equal keys give the rest intervals.
+        values[1::2] = values[0::2][:len(values[1::2])]
+        curves.append((f"Neuron.{i}", [(int(f), float(v)) for f, v in zip(frames, values)]))
+    return curves
+
+def quiet(fn):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn()
+
+# The original splitting of render intervals, which inserted into the list.
+def split_render_intervals_original(render_intervals, frames):
+    result = list(render_intervals)
+    i = 0
+    while i < len(result):
+        fStart, fEnd = result[i]
+        for f in frames:
+            if fStart < f and f < fEnd:
+                result[i] = (fStart, f - 1)
+                result.insert(i + 1, (f, fEnd))
+                break
+        i += 1
+    return result
+
+def plan(curves):
+    rest_intervals = []
+    for name, keys in curves:
+        addRestIntervals(rest_intervals, name + ".alpha.0", keys, FRAME_END)
+    render_intervals = findRenderIntervals(rest_intervals, len(curves), 1, FRAME_END)
+    render_intervals = clipRenderIntervals(render_intervals, 1, FRAME_END)
+    changes = findHideRenderFrames(curves)
+    frames = sorted(changes)
+    render_intervals = splitRenderIntervals(render_intervals, frames)
+    hide_render_true_frames = findHideRenderTrueFrames(changes, FRAME_END)
+    return render_intervals, hide_render_true_frames, frames
+
+def bench_render_intervals(rng, size):
+    curves = make_curves(rng, size, 8)
+    def run():
+        return plan(curves)
+    def check(result):
+        render_intervals, _, frames = result
+        rest_intervals = []
+        for name, keys in curves:
+            addRestIntervals(rest_intervals, name + ".alpha.0", keys, FRAME_END)
+        unsplit = clipRenderIntervals(findRenderIntervals(rest_intervals, len(curves), 1, FRAME_END), 1, FRAME_END)
+        return render_intervals == split_render_intervals_original(unsplit, frames)
+    return run, check
+
+def bench_fading_intervals(rng, size):
+    curves = make_curves(rng, size, 8)
+    _, hide_render_true_frames, _ = plan(curves)
+    alpha_keys = [keys for _, keys in curves]
+    def run():
+        return quiet(lambda: findFadingIntervals(alpha_keys, hide_render_true_frames))
+    return run, None
+
+def bench_combine_render_intervals(rng, size):
+    # Many short intervals, like those from the "stagger" option of the "fade" command.
+    starts = np.sort(rng.choice(np.arange(1, 20 * size, 4), size=size, replace=False))
+    render_intervals = [(int(s), int(s) + 3) for s in starts]
+    fading_intervals = [ri for ri in render_intervals[::3]]
+    dolly_intervals = [ri for ri in render_intervals[1::7]]
+    def run():
+        return addSamplesPerInterval(render_intervals, fading_intervals, dolly_intervals, 100)
+    def check(result):
+        n = len(combineRenderIntervals([ri + (1, ) for ri in render_intervals], []))
+        return n == len(render_intervals) and len(result) >= len(render_intervals)
+    return run, check
+
+def bench_describe_interpolators(rng, size):
+    # Each of the volumes fades in and out, at random times.
+    fps = 30
+    animators = {"camera_rotation": [], "camera_translation": [], "camera_zoom": []}
+    def make_animators():
+        for i in range(max(1, size // 100)):
+            name = f"volumes.v{i}"
+            t0 = float(rng.uniform(0, 30))
+            animators[name] = [Fader([name], t0, 1, 0, 1, fps), Fader([name], t0 + 5, 1, 1, 0, fps)]
+    quiet(make_animators)
+    state = {"fps": fps, "animators": animators}
+    def run():
+        return quiet(lambda: describe_interpolators(state, fps))
+    return run, None
+
+def bench_parse_neuron_ids(rng, size):
+    dir = tempfile.mkdtemp()
+    ids = rng.integers(10**9, 10**11, size=size)
+    with open(os.path.join(dir, "ids.txt"), "w") as f:
+        f.writelines([f"{id}\n" for id in ids])
+    json_neurons = {
+        "source": "./meshes",
+        "idsSource": dir,
+        "listed": [int(id) for id in ids[:size // 2]],
+        "fromFile": {"ids": "ids.txt"}
+    }
+    def run():
+        return parseNeuronsIds(json_neurons)
+    def check(result):
+        shutil.rmtree(dir)
+        # IDs from files are encoded with their source index, so they are distinct from the listed IDs.
+        return len(result[0][0]) == len(set(ids[:size // 2].tolist())) + len(set(ids.tolist()))
+    return run, check
+
+# The original bookkeeping of compFrames.py, with lists of the files in the frame directories.
+def frames_to_comp_original(roi_dir, neuron_dir, output_dir, start, end):
+    rois = [os.path.splitext(f)[0] for f in os.listdir(roi_dir) if os.path.splitext(f)[1] == ".exr"]
+    rois = [x for x in rois if start <= int(x) and int(x) <= end]
+    neurons = [os.path.splitext(f)[0] for f in os.listdir(neuron_dir) if os.path.splitext(f)[1] == ".exr"]
+    pngs = [os.path.splitext(f)[0] for f in os.listdir(output_dir) if os.path.splitext(f)[1] == ".png"]
+    return sorted([int(f) for f in rois if f not in pngs and f in neurons])
+
+def bench_frame_index(rng, size):
+    # Frames rendered separately for ROIs and neurons (with some neuron frames missing), and half composited.
+    dir = tempfile.mkdtemp()
+    dirs = [os.path.join(dir, d) for d in ["rois", "neurons", "output"]]
+    for d in dirs:
+        os.mkdir(d)
+    for f in range(1, size + 1):
+        open(os.path.join(dirs[0], f"{f:04}.exr"), "w").close()
+        if rng.random() < 0.9:
+            open(os.path.join(dirs[1], f"{f:04}.exr"), "w").close()
+        if f <= size // 2:
+            open(os.path.join(dirs[2], f"{f:04}.png"), "w").close()
+    start = size // 4
+    end = size - size // 4
+    def run():
+        rois = FrameIndex(dirs[0], ".exr")
+        neurons = FrameIndex(dirs[1], ".exr")
+        pngs = FrameIndex(dirs[2], ".png")
+        i0, i1 = get_frame_indices(start, end, rois.frames)
+        return [f for f in rois.frames[i0:i1 + 1] if not f in pngs and f in neurons]
+    def check(result):
+        expected = frames_to_comp_original(dirs[0], dirs[1], dirs[2], start, end)
+        shutil.rmtree(dir)
+        return result == expected
+    return run, check
+
+BENCHMARKS = {
+    "render_intervals": bench_render_intervals,
+    "fading_intervals": bench_fading_intervals,
+    "combine_render_intervals": bench_combine_render_intervals,
+    "describe_interpolators": bench_describe_interpolators,
+    "parse_neuron_ids": bench_parse_neuron_ids,
+    "frame_index": bench_frame_index
+}
+
+def time_it(run, repeats):
+    secs = []
+    result = None
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        result = run()
+        secs.append(time.perf_counter() - t0)
+    return result, secs
+
+if __name__ == "__main__":
+    version = report_version()
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(sizes=[1000, 10000])
+    parser.add_argument("--sizes", "-s", type=int, nargs="+", help="sizes of the synthetic inputs (e.g., the number of animated objects)")
+    parser.set_defaults(repeats=5)
+    parser.add_argument("--repeats", "-r", type=int, help="number of times to run each case")
+    parser.set_defaults(benchmarks=list(BENCHMARKS.keys()))
+    parser.add_argument("--benchmarks", "-b", nargs="+", choices=list(BENCHMARKS.keys()), help="cases to run")
+    parser.set_defaults(output=None)
+    parser.add_argument("--output", "-o", help="path for a JSON file of the timings")
+    parser.set_defaults(compare=None)
+    parser.add_argument("--compare", "-c", help="path to an earlier JSON file of timings, to compare")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                previous = {(r["benchmark"], r["size"]): r for r in json.load(f)["results"]}
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            print(f"Error: cannot read timings '{args.compare}': {str(e)}")
+            sys.exit()
+
+    results = []
+    failed = False
+    compared = f" {'previous':>10} {'ratio':>7}" if previous else ""
+    print(f"{'benchmark':<26} {'size':>8} {'min secs':>10} {'mean secs':>10} {'ok':>4}{compared}")
+    for name in args.benchmarks:
+        for size in args.sizes:
+            rng = np.random.default_rng(0)
+            run, check = BENCHMARKS[name](rng, size)
+            result, secs = time_it(run, args.repeats)
+            ok = check(result) if check else True
+            failed = failed or not ok
+            r = {"benchmark": name, "size": size, "min_secs": min(secs), "mean_secs": sum(secs) / len(secs), "ok": ok}
+            results.append(r)
+            line = f"{name:<26} {size:8} {r['min_secs']:10.4f} {r['mean_secs']:10.4f} {'yes' if ok else 'NO':>4}"
+            if (name, size) in previous:
+                old = previous[(name, size)]["min_secs"]
+                line += f" {old:10.4f} {r['min_secs'] / old:6.2f}x" if old > 0 else ""
+            print(line)
+
+    if args.output:
+        report = {
+            "neuVid": version,
+            "date": datetime.datetime.now().isoformat(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "repeats": args.repeats,
+            "results": results
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote timings {args.output}")
+
+    if failed:
+        print("Error: some results do not match the original algorithms")
+        sys.exit(1)
@@ -0,0 +1,104 @@
+# Benchmarks the reading of mesh bounding boxes by sortByBbox.py.
+# Compares the original line-by-line reading with the bulk scanner, serially and with
+# worker processes, on a directory of OBJ files.  If no directory is given, synthetic
+# neuron-like OBJ files are generated in a temporary directory.
+
+# Run with plain Python (and NumPy), e.g.:
+# $ python benchmark-sortByBbox.py --count 10000
+# $ python benchmark-sortByBbox.py --inputmeshes neuVidNeuronMeshes
+
+import argparse
+import datetime
+import os
+import numpy as np
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../neuVid")))
+from utilsGeneral import report_version
+from sortByBbox import get_bboxes, read_obj_bboxes_parallel, read_obj_verts
+
+def make_synthetic_objs(dir, count, vertex_count, seed=0):
+    rng = np.random.default_rng(seed)
+    filenames = []
+    for i in range(count):
+        # A random walk gives a long, thin shape, something like a neuron.
+        steps = rng.normal(scale=20, size=(vertex_count, 3))
+        vertices = np.cumsum(steps, axis=0) + rng.uniform(0, 40000, size=3)
+        filename = f"{i + 1}.obj"
+        with open(os.path.join(dir, filename), "w") as f:
+            f.write("# OBJ file\n")
+            f.writelines([f"v {x:.7g} {y:.7g} {z:.7g}\n" for x, y, z in vertices])
+            f.writelines([f"f {j} {j + 1} {j + 2}\n" for j in range(1, vertex_count - 1)])
+        filenames.append(filename)
+        if (i + 1) % 1000 == 0:
+            print(f"Generated {i + 1} / {count}")
+    return filenames
+
+def time_it(fn):
+    t0 = datetime.datetime.now()
+    result = fn()
+    t1 = datetime.datetime.now()
+    secs = (t1 - t0).total_seconds()
+    return result, secs
+
+if __name__ == "__main__":
+    report_version()
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(input_meshes=None)
+    parser.add_argument("--inputmeshes", "-im", dest="input_meshes", help="path to directory of input obj meshes (default: generate synthetic meshes)")
+    parser.set_defaults(count=10000)
+    parser.add_argument("--count", "-c", type=int, help="number of synthetic meshes to generate")
+    parser.set_defaults(vertex_count=2000)
+    parser.add_argument("--vertices", "-v", type=int, dest="vertex_count", help="vertex count of each synthetic mesh")
+    parser.set_defaults(workers=None)
+    parser.add_argument("--workers", "-w", type=int, help="number of worker processes (default: CPU count)")
+    parser.set_defaults(skip_original=False)
+    parser.add_argument("--skiporiginal", "-so", dest="skip_original", action="store_true", help="skip timing the original reading")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.input_meshes:
+        dir = args.input_meshes
+        filenames = sorted([f for f in os.listdir(dir) if os.path.splitext(f)[1] == ".obj"])
+    else:
+        tmp = tempfile.mkdtemp()
+        dir = tmp
+        print(f"Generating {args.count} synthetic meshes with {args.vertex_count} vertices in {dir}")
+        filenames = make_synthetic_objs(dir, args.count, args.vertex_count)
+
+    workers = args.workers if args.workers else os.cpu_count()
+    total_bytes = sum([os.path.getsize(os.path.join(dir, f)) for f in filenames])
+    print(f"Using {len(filenames)} meshes, {total_bytes / 1e6:.1f} MB total, {workers} workers")
+
+    timings = []
+
+    scanned_serial, secs = time_it(lambda: read_obj_bboxes_parallel(filenames, dir, 1))
+    timings.append(("bulk scan, 1 process", secs))
+
+    scanned, secs = time_it(lambda: read_obj_bboxes_parallel(filenames, dir, workers))
+    timings.append((f"bulk scan, {workers} processes", secs))
+
+    for (mini0, maxi0, _, _), (mini1, maxi1, _, _) in zip(scanned_serial, scanned):
+        assert np.array_equal(mini0, mini1) and np.array_equal(maxi0, maxi1)
+
+    if not args.skip_original:
+        bboxes, secs = time_it(lambda: get_bboxes(read_obj_verts(filenames, dir)))
+        timings.insert(0, ("original, 1 process", secs))
+
+        for (mini0, maxi0), (mini1, maxi1, _, _) in zip(bboxes, scanned):
+            if not np.allclose(mini0, mini1) or not np.allclose(maxi0, maxi1):
+                print("Error: bounding boxes differ")
+                sys.exit(1)
+
+    print()
+    baseline = timings[0][1]
+    for label, secs in timings:
+        speedup = baseline / secs if secs > 0 else float("inf")
+        print(f"{label:>30}: {secs:8.2f} secs, {len(filenames) / secs:10.1f} meshes/sec, {speedup:6.1f}x")
+
+    if tmp:
+        print(f"Removing temporary directory {tmp}")
+        shutil.rmtree(tmp)